@@ -2,6 +2,10 @@ import sys
 import os
 import csv
 
+# score stores (scores.npz) written by the eval scripts; see im2txt/coco_caption/score_store.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "im2txt", "coco_caption"))
+from score_store import ScoreStore
+
 # returns whether the given row is a header in the format we're looking for
 def is_header(row):
     header = ['preds_file_name', ' avg_bleu1', ' avg_bleu2', ' avg_bleu3', ' avg_bleu4']
@@ -35,7 +39,8 @@ if len(sys.argv) < 2:
     print("The script indicates the best row by adding a `BEST` marker to it;\n")
     print("The best row is chosen based on the average of its bleu-1,2,3,4 scores.")
     print("WARNING: each csv in the directory will be overwritten when marking the best row.")
-    print("\nusage: python3 " + __file__ + " <directory containing im2txt/ntk2 score csvs>")
+    print("Score stores (.npz) in the directory are queried for their best checkpoint (per split) and left as they are.")
+    print("\nusage: python3 " + __file__ + " <directory containing im2txt/ntk2 score csvs and/or score stores>")
     print("i.e. python3 " + __file__ + " ./scores\n")
     exit()
 
@@ -47,7 +52,19 @@ if not os.path.isdir(input_dir):
     exit()
 
 for fname in os.listdir(input_dir):
-    if fname[-4:] == ".csv":
+    if fname[-4:] == ".npz":
+        # the store keeps every caption's scores; the per file averages
+        # (what the csv rows hold) are computed from it
+        store = ScoreStore.load(os.path.join(input_dir,fname))
+        
+        for split in sorted(set(store.columns()["split"].tolist())):
+            best_ckpt = store.best_checkpoint(split=split)
+            
+            for ckpt_num, preds_name, means in store.checkpoint_means(split=split):
+                if ckpt_num == best_ckpt:
+                    print("%s (%s, %s): %f, %f, %f, %f (avg=%f)"%(fname,split,preds_name,means[0],means[1],means[2],means[3],sum(means)/4))
+    
+    elif fname[-4:] == ".csv":
         # open the file as a csv
         
         csv_file = open(os.path.join(input_dir,fname), "r")
@@ -35,10 +35,15 @@
 
 
 import os
+import sys
 import json
 import csv
 import random
 
+# score stores (scores.npz) written by the eval scripts; see im2txt/coco_caption/score_store.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "im2txt", "coco_caption"))
+from score_store import load_entries
+
 random.seed(600) # seed RNG for reproducibility; i.e., running this script multiple times will produce the same output csv
 
 
@@ -70,22 +75,22 @@ predictions_root = "predictions" # root predictions folder
 
 
 # load im2txt low, high, both
+# (each from a score json, or from a score store (.npz), which gives the
+# entries of its best checkpoint in the same layout)
 
 im2txt_low = {} # mapping "com.github.jamesgay.fitnotes-screens/screenshot_2.png" -> caption
 im2txt_high = {}
 im2txt_both = {}
 
 for fname in os.listdir(os.path.join(predictions_root, "im2txt")):
-    im2txt_json = open(os.path.join(predictions_root, "im2txt", fname), "r")
+    im2txt_path = os.path.join(predictions_root, "im2txt", fname)
     
     if fname.find("-low-") != -1:
-        im2txt_low = json.load(im2txt_json)
+        im2txt_low = load_entries(im2txt_path)
     elif fname.find("-high-") != -1:
-        im2txt_high = json.load(im2txt_json)
+        im2txt_high = load_entries(im2txt_path)
     elif fname.find("-both-") != -1:
-        im2txt_both = json.load(im2txt_json)
-    
-    im2txt_json.close()
+        im2txt_both = load_entries(im2txt_path)
 
 
 
@@ -357,16 +362,15 @@ neuraltalk2_both = {}
 
 
 for fname in os.listdir(os.path.join(predictions_root, "neuraltalk2")):
-    ntk2_json = open(os.path.join(predictions_root, "neuraltalk2", fname), "r")
+    ntk2_path = os.path.join(predictions_root, "neuraltalk2", fname)
     
+    # (a score json or a score store, like im2txt above)
     if fname.find("-low") != -1:
-        neuraltalk2_low = json.load(ntk2_json)
+        neuraltalk2_low = load_entries(ntk2_path)
     elif fname.find("-high") != -1:
-        neuraltalk2_high = json.load(ntk2_json)
+        neuraltalk2_high = load_entries(ntk2_path)
     elif fname.find("-both") != -1:
-        neuraltalk2_both = json.load(ntk2_json)
-    
-    ntk2_json.close()
+        neuraltalk2_both = load_entries(ntk2_path)
     
 
 
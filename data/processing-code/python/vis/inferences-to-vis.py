@@ -31,11 +31,16 @@ import csv
 
 from shutil import copyfile
 
+# score stores (scores.npz) written by the eval scripts; see im2txt/coco_caption/score_store.py
+os.sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "im2txt", "coco_caption"))
+from score_store import load_entries
+
 if len(os.sys.argv) < 3:
     print("Script to take either an im2txt, ntk2, or seq2seq prediction-score json")
     print("and produce a folder (automatically named based on the input json) containing")
     print("the html and the javascript needed to visualize predictions.")
     print("usage: python " + __file__ + " <gt, im2, ntk, seq> <inference json/txt/csv>")
+    print("(for im2 and ntk the json can also be a score store (.npz); its best checkpoint is visualized)")
     print("i.e. python " + __file__ + " im2 inferences-low.json")
     print("")
     exit()
@@ -51,7 +56,7 @@ assert(((model_type == "im2") or (model_type == "ntk") or (model_type == "seq")
 inference_json = None
 
 if model_type == "im2" or model_type == "ntk":
-    inference_json = json.load(open(os.sys.argv[2], "r"))
+    inference_json = load_entries(os.sys.argv[2])
 else: # seq2seq gets read normally (without json load; not a json)
     inference_json = open(os.sys.argv[2], "r")
 
@@ -64,7 +69,14 @@ if (model_type != "gt"):
 
     # first make a directory
 
-    new_dir = os.path.join(".","vis-%s-%s"%(model_type,os.sys.argv[2][0:os.sys.argv[2].find(".json")]))
+    # name of the input without its extension
+    input_name = os.sys.argv[2]
+    if input_name.endswith(".npz"):
+        input_name = input_name[0:-len(".npz")]
+    else:
+        input_name = input_name[0:input_name.find(".json")]
+
+    new_dir = os.path.join(".","vis-%s-%s"%(model_type,input_name))
 
     if not os.path.isdir(new_dir):
         os.mkdir(new_dir)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#
+# File Name : bench_ngrams.py
+#
+# Description : Micro-benchmark of n-gram counting for the BLEU and CIDEr
+#               scorers: the old tuple-of-strings precook against the packed
+#               integer featurizer in pycocoevalcap/ngrams.py, over the
+#               ground truth and predicted captions of our data. Reports the
+#               time to count every caption and the memory the n-gram keys
+#               and count dicts take up.
+#
+# usage: python2 bench_ngrams.py [--repeat N] [file or directory ...]
+#
+# With no paths it reads ./ground_truth and
+# ../../data/final-im2txt-ntk2-predictions.
+
+import os
+import gc
+import sys
+import time
+from collections import defaultdict
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from pycocoevalcap.ngrams import count_ngrams
+from ptb_parity import files_under, captions_from_file
+
+COCO_CAPTION_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATHS = [os.path.join(COCO_CAPTION_DIR, 'ground_truth'),
+                 os.path.join(COCO_CAPTION_DIR, '..', '..', 'data', 'final-im2txt-ntk2-predictions')]
+
+def count_ngrams_tuples(words, n=4):
+    # the precook the scorers used before ngrams.py
+    counts = defaultdict(int)
+    for k in xrange(1,n+1):
+        for i in xrange(len(words)-k+1):
+            ngram = tuple(words[i:i+k])
+            counts[ngram] += 1
+    return counts
+
+def run(name, count, sentences, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.time()
+        for words in sentences:
+            count(words)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    # memory held by the counts: the dicts plus their keys (the word strings
+    # inside the tuple keys are shared with the sentences, so not counted)
+    dict_bytes = 0
+    key_bytes = 0
+    keys = 0
+    for words in sentences:
+        counts = count(words)
+        dict_bytes += sys.getsizeof(counts)
+        key_bytes += sum([sys.getsizeof(key) for key in counts])
+        keys += len(counts)
+    print('%-8s %8.3f s  %10d n-grams  %8.1f MB keys  %8.1f MB dicts' % \
+            (name, best, keys, key_bytes / 1024.0 / 1024.0, dict_bytes / 1024.0 / 1024.0))
+
+def main(argv):
+    repeat = 3
+    paths = []
+    i = 0
+    while i < len(argv):
+        if argv[i] == '--repeat':
+            repeat = int(argv[i+1])
+            i += 2
+        else:
+            paths.append(argv[i])
+            i += 1
+    if len(paths) == 0:
+        paths = DEFAULT_PATHS
+
+    sentences = []
+    for path in paths:
+        for f in files_under(path):
+            sentences.extend([c.lower().split() for c in captions_from_file(f) if c.strip() != ''])
+    print('Counting 1..4-grams of %d captions (best of %d)' % (len(sentences), repeat))
+
+    run('tuples', count_ngrams_tuples, sentences, repeat)
+    run('packed', count_ngrams, sentences, repeat)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
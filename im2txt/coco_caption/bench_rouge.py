@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+# File Name : bench_rouge.py
+#
+# Description : Micro-benchmark of ROUGE-L: Rouge.calc_score per image (the
+#               dynamic programming my_lcs) against the batched bit-parallel
+#               Rouge.calc_scores, on predicted captions of our data scored
+#               against the ground truth captions of their images (5 per image
+#               unless --refs says otherwise). Also checks the scores agree.
+#
+# usage: python2 bench_rouge.py [--repeat N] [--refs K] [ground truth json] [predictions file or directory ...]
+#
+# With no paths it scores the lo2txtRC val predictions against
+# ./ground_truth/im2txt/low/captions_val.json.
+
+import os
+import gc
+import sys
+import json
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from pycocoevalcap.rouge.rouge import Rouge
+from ptb_parity import files_under
+
+COCO_CAPTION_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_GT = os.path.join(COCO_CAPTION_DIR, 'ground_truth', 'im2txt', 'low', 'captions_val.json')
+DEFAULT_PREDICTIONS = os.path.join(COCO_CAPTION_DIR, '..', '..', 'data', 'final-im2txt-ntk2-predictions',
+        'im2txt', 'lo2txtRC-preds-scores', 'predictions-lo2txtRC-val')
+
+def run(name, score, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.time()
+        scores = score()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('%-8s %8.3f s' % (name, best))
+    return scores
+
+def main(argv):
+    repeat = 3
+    num_refs = 5
+    paths = []
+    i = 0
+    while i < len(argv):
+        if argv[i] == '--repeat':
+            repeat = int(argv[i+1])
+            i += 2
+        elif argv[i] == '--refs':
+            num_refs = int(argv[i+1])
+            i += 2
+        else:
+            paths.append(argv[i])
+            i += 1
+    gt_path = paths[0] if len(paths) > 0 else DEFAULT_GT
+    prediction_paths = paths[1:] if len(paths) > 1 else [DEFAULT_PREDICTIONS]
+
+    with open(gt_path) as f:
+        annotations = json.load(f)['annotations']
+    gts = {}
+    for ann in annotations:
+        gts.setdefault(str(ann['image_id']), []).append(ann['caption'].lower())
+
+    # references are cycled up to num_refs per image
+    candidates = []
+    refs = []
+    for path in prediction_paths:
+        for f in files_under(path):
+            with open(f) as prediction_file:
+                predictions = json.load(prediction_file)
+            for prediction in predictions:
+                image_refs = gts.get(str(prediction['image_id']))
+                if not image_refs:
+                    continue
+                image_refs = [image_refs[k % len(image_refs)] for k in range(num_refs)]
+                for caption in prediction['captions']:
+                    candidates.append(caption.lower())
+                    refs.append(image_refs)
+    print('ROUGE-L of %d captions, %d references each (best of %d)' % (len(candidates), num_refs, repeat))
+
+    rouge = Rouge()
+    old = run('my_lcs', lambda: [rouge.calc_score([c], r) for c, r in zip(candidates, refs)], repeat)
+    new = run('bit_lcs', lambda: rouge.calc_scores(candidates, refs), repeat)
+    mismatches = sum([1 for a, b in zip(old, new) if a != b])
+    print('%d scores differ' % mismatches)
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
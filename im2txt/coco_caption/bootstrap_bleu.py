@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# File Name : bootstrap_bleu.py
+#
+# Description : Bootstrap confidence intervals of corpus BLEU and paired
+#               significance tests between prediction files, e.g. the
+#               checkpoints of a sweep or the best checkpoints of im2txt,
+#               neuraltalk2 and SAT (see pycocoevalcap/bleu/bootstrap.py).
+#               Every file is scored on the images all of them caption, so
+#               the tests are paired.
+#
+# usage: python2 bootstrap_bleu.py [flags] <ground truth json> <predictions json or directory> ...
+#
+# Prediction files can be im2txt prediction jsons (a list of image_id and
+# captions), neuraltalk2 ones (screenshot -> caption1..3, mapped to image ids
+# through --screens) or SAT / COCO results jsons (a list of image_id and
+# caption); a directory stands for every json in it.
+#
+# flags:
+#     --samples N         number of bootstrap resamples (default 1000)
+#     --alpha A           1 - confidence level of the intervals (default 0.05)
+#     --beam K            which of the captions of an image to score (default 0, the best beam)
+#     --screens PATH      image id -> screenshot json for neuraltalk2 files (default ./imageids-to-screens.json)
+#     --all-pairs         test every pair of files, not just every file against the best one
+#     --python-tokenizer  tokenize with the in-process PTBTokenizer reimplementation instead of java
+
+import os
+import sys
+import json
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from pycocoevalcap.tokenizer.ptbtokenizer import PTBTokenizer, PTBTokenizerServer
+from pycocoevalcap.bleu.ref_index import get_ref_index
+from pycocoevalcap.bleu.bootstrap import caption_stats, bootstrap_ci, paired_bootstrap, score_names
+
+def load_captions(path, beam, screens_to_ids):
+    """image id -> caption of one prediction file"""
+    with open(path) as f:
+        preds = json.load(f)
+    captions = {}
+    if isinstance(preds, dict):
+        # neuraltalk2: screenshot -> {"caption1": .., "caption2": .., "caption3": ..}
+        assert screens_to_ids is not None, "%s is a neuraltalk2 prediction file; pass --screens" % path
+        for screenshot, entry in preds.items():
+            captions[screens_to_ids[screenshot]] = entry.get('caption%d' % (beam+1), '')
+    else:
+        for entry in preds:
+            if 'captions' in entry:
+                # im2txt: {"image_id": .., "captions": [..]}
+                captions[entry['image_id']] = entry['captions'][beam] if beam < len(entry['captions']) else ''
+            else:
+                # SAT / COCO results: {"image_id": .., "caption": ..}
+                captions[str(entry['image_id']).zfill(7)] = entry['caption']
+    return captions
+
+def prediction_paths(args):
+    paths = []
+    for arg in args:
+        if os.path.isdir(arg):
+            paths.extend(sorted([os.path.join(arg, name) for name in os.listdir(arg) if name.endswith('.json')]))
+        else:
+            paths.append(arg)
+    return paths
+
+def main(argv):
+    num_samples = 1000
+    alpha = 0.05
+    beam = 0
+    screens_path = 'imageids-to-screens.json'
+    all_pairs = False
+    backend = 'java'
+    args = []
+    flags = list(argv)
+    while len(flags) != 0:
+        flag = flags.pop(0)
+        if flag in ['--samples', '--beam'] and len(flags) != 0 and flags[0].isdigit():
+            value = int(flags.pop(0))
+            if flag == '--samples':
+                num_samples = value
+            else:
+                beam = value
+        elif flag == '--alpha' and len(flags) != 0:
+            alpha = float(flags.pop(0))
+        elif flag == '--screens' and len(flags) != 0:
+            screens_path = flags.pop(0)
+        elif flag == '--all-pairs':
+            all_pairs = True
+        elif flag == '--python-tokenizer':
+            backend = 'python'
+        elif flag.startswith('--'):
+            print("Error: unknown or incomplete flag '%s'" % flag)
+            return 1
+        else:
+            args.append(flag)
+    if len(args) < 2:
+        print('usage: python2 bootstrap_bleu.py [flags] <ground truth json> <predictions json or directory> ...')
+        return 1
+
+    gt_path = args[0]
+    paths = prediction_paths(args[1:])
+    names = [os.path.basename(path) for path in paths]
+
+    screens_to_ids = None
+    if os.path.isfile(screens_path):
+        with open(screens_path) as f:
+            screens_to_ids = dict((screen, image_id) for image_id, screen in json.load(f).items())
+
+    with open(gt_path) as f:
+        annotations = json.load(f)['annotations']
+    gts = {}
+    for ann in annotations:
+        gts.setdefault(ann['image_id'], []).append({'caption': ann['caption']})
+
+    systems = [load_captions(path, beam, screens_to_ids) for path in paths]
+
+    # only images every file captions, so that every test is paired
+    image_ids = set(gts)
+    for captions in systems:
+        image_ids &= set(captions)
+    image_ids = sorted(image_ids)
+    print('Scoring %d files on the %d images all of them caption' % (len(paths), len(image_ids)))
+
+    with PTBTokenizerServer():
+        tokenizer = PTBTokenizer(backend=backend)
+        # cooked once and cached next to the ground truths, like eval-bleu-im2txt.py does
+        ref_index_path = '%s-bleu-refs-%s.pkl' % (os.path.splitext(gt_path)[0], backend)
+        ref_index = get_ref_index(ref_index_path, tokenizer.tokenize(gts))
+        res = tokenizer.tokenize(dict(((i, image_id), [{'caption': captions[image_id]}]) \
+                for i, captions in enumerate(systems) for image_id in image_ids))
+
+    stats = [caption_stats(ref_index, [(image_id, res[(i, image_id)][0]) for image_id in image_ids]) \
+            for i in range(len(systems))]
+
+    b_time = time.time()
+    cis = [bootstrap_ci(s, num_samples, alpha) for s in stats]
+    columns = score_names()
+    print('\n%d%% confidence intervals (%d resamples):' % (round(100 * (1 - alpha)), num_samples))
+    width = max([len(name) for name in names])
+    print('%-*s %s' % (width, 'file', ' '.join(['%-24s' % c for c in columns])))
+    for name, ci in zip(names, cis):
+        print('%-*s %s' % (width, name, ' '.join(['%.4f [%.4f, %.4f]' % ci[c] for c in columns])))
+
+    best = max(range(len(paths)), key=lambda i: cis[i]['Bleu_avg'][0])
+    if all_pairs:
+        pairs = [(i, j) for i in range(len(paths)) for j in range(i+1, len(paths))]
+    else:
+        pairs = [(best, j) for j in range(len(paths)) if j != best]
+    if len(pairs) != 0:
+        print('\nPaired bootstrap on Bleu_avg (* p < %g):' % alpha)
+        for i, j in pairs:
+            delta, low, high, p = paired_bootstrap(stats[i], stats[j], num_samples, alpha)['Bleu_avg']
+            print('%s - %s: %+.4f [%+.4f, %+.4f] p=%.4f%s' % (names[i], names[j], delta, low, high, p, ' *' if p < alpha else ''))
+    print('\nBootstrapped in %.2f s' % (time.time() - b_time))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
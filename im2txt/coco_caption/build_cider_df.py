@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+#
+# File Name : build_cider_df.py
+#
+# Description : Builds the CIDEr document frequency file (see
+#               pycocoevalcap/cider/cider_df.py) of each ground truth split,
+#               next to its json as <name>.cider-df.json. COCOEvalCap uses one
+#               when cocoEval.params['cider_df'] points at it (and
+#               params['cider_df_ground_truth'] at the json), which makes
+#               CIDEr of a single caption or a small batch match its value in
+#               a full split evaluation.
+#
+# usage: python2 build_cider_df.py [--python-tokenizer] [ground truth json ...]
+#
+# With no paths it builds high, low and combined x val and test from
+# ./ground_truth/im2txt. The frequencies are counted over PTB tokenized
+# references, so build them with the same tokenizer backend the evaluation
+# uses (java by default, which needs java and the CoreNLP jar).
+
+import os
+import sys
+import json
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from pycocoevalcap.tokenizer.ptbtokenizer import PTBTokenizer, PTBTokenizerServer
+from pycocoevalcap.cider.cider_df import df_path, save_document_frequency
+
+GROUND_TRUTH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ground_truth', 'im2txt')
+DEFAULT_PATHS = [os.path.join(GROUND_TRUTH_DIR, model_type, 'captions_%s.json' % split)
+                 for model_type in ['high', 'low', 'combined'] for split in ['val', 'test']]
+
+def main(argv):
+    backend = 'java'
+    paths = []
+    for arg in argv:
+        if arg == '--python-tokenizer':
+            backend = 'python'
+        else:
+            paths.append(arg)
+    if len(paths) == 0:
+        paths = DEFAULT_PATHS
+
+    with PTBTokenizerServer():
+        for gt_path in paths:
+            with open(gt_path) as gt_file:
+                annotations = json.load(gt_file)['annotations']
+            gts = {}
+            for ann in annotations:
+                gts.setdefault(ann['image_id'], []).append({'caption': ann['caption']})
+            refs = PTBTokenizer(backend=backend).tokenize(gts)
+
+            save_document_frequency(df_path(gt_path), refs, gt_path, backend)
+            print('Wrote %s (%d images)' % (df_path(gt_path), len(refs)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+#
+# File Name : build_score_store.py
+#
+# Description : Converts a directory of per prediction file score jsons (what
+#               eval-bleu-im2txt.py and eval-bleu-ntk2.py wrote before they
+#               kept a score store, or with --json) into a score store (see
+#               score_store.py), written as scores.npz into the same
+#               directory unless an output path is given.
+#
+# usage: python build_score_store.py <scores directory> [output .npz]
+
+import os
+import sys
+import json
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from score_store import ScoreStore, STORE_NAME, parse_preds_name
+
+def main(argv):
+    if len(argv) < 1:
+        print('usage: python build_score_store.py <scores directory> [output .npz]')
+        return 1
+    scores_dir = argv[0]
+    out_path = argv[1] if len(argv) > 1 else os.path.join(scores_dir, STORE_NAME)
+
+    names = sorted([name for name in os.listdir(scores_dir) \
+            if name.startswith('scores_') and name.endswith('.json')])
+    store = None
+    for name in names:
+        with open(os.path.join(scores_dir, name)) as f:
+            entries = json.load(f)
+        if store is None:
+            # neuraltalk2 entries are identified by their screenshot
+            store = ScoreStore(id_key='screenshot' if len(entries) > 0 and 'screenshot' in entries[0] else 'image_id')
+        checkpoint, split = parse_preds_name(name)
+        store.add_file(name.replace('scores', 'preds', 1), checkpoint, split, entries)
+    if store is None:
+        print('No score jsons in %s' % scores_dir)
+        return 1
+
+    store.save(out_path)
+    print('Wrote %s (%d files, %d captions)' % (out_path, len(names), len(store)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+#
+# File Name : ckpt_fingerprint.py
+#
+# Description : Checkpoint fingerprints for the prediction sweeps
+#               (generate-predictions-im2txt.py, generate-predictions-ntk2.py).
+#               Digests are cached in a sidecar index next to the checkpoints,
+#               keyed by (path, size, mtime, inode), so a checkpoint is only
+#               read again when it changed on disk. New digests are computed
+#               on a pool of threads with a fast non-cryptographic hash
+#               (xxh64 from the optional xxhash package, crc32 + adler32 from
+#               zlib otherwise; both run at several times the speed of md5);
+#               md5 is still available for prediction file names that have
+#               to match older sweeps.
+#
+# Works with python 2 and 3 (neuraltalk2/coco_caption links to this directory).
+
+import os
+import json
+import zlib
+import hashlib
+import threading
+from multiprocessing.dummy import Pool as ThreadPool
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# bump whenever the layout of the index changes
+INDEX_VERSION = 1
+
+# name of the sidecar index, stored in the checkpoint directory
+INDEX_NAME = '.ckpt-fingerprints.json'
+
+# small chunks; a few threads hash at once and none needs a GB buffer
+CHUNK_SIZE = 16 * 1024 * 1024
+
+DEFAULT_WORKERS = 4
+
+class CrcAdler:
+    """64 bit checksum made of the crc32 and the adler32 of the data, with
+    the update()/hexdigest() interface of hashlib."""
+
+    def __init__(self):
+        self.crc = 0
+        self.adler = 1
+
+    def update(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.adler = zlib.adler32(data, self.adler)
+
+    def hexdigest(self):
+        return '%08x%08x' % (self.crc & 0xffffffff, self.adler & 0xffffffff)
+
+# algorithm name -> constructor of a hashlib style object
+ALGORITHMS = {'md5': hashlib.md5, 'crc-adler': CrcAdler}
+if xxhash is not None:
+    ALGORITHMS['xxh64'] = xxhash.xxh64
+
+FAST_ALGORITHM = 'xxh64' if xxhash is not None else 'crc-adler'
+
+def file_digest(path, algorithm=FAST_ALGORITHM):
+    """hex digest of the contents of the file at path"""
+    digest = ALGORITHMS[algorithm]()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+def _stat_key(path):
+    """what identifies one version of a file without reading it"""
+    st = os.stat(path)
+    # repr of the float mtime reads the same in python 2 and 3, so both can
+    # share an index; it is fine enough to tell rewrites apart
+    return {'size': st.st_size, 'mtime': repr(st.st_mtime), 'inode': st.st_ino}
+
+class FingerprintIndex:
+    """Digests of the files in one directory, cached in INDEX_NAME there:
+
+        index = FingerprintIndex(CKPT_DIR)
+        digests = index.digest_all(paths)
+        index.save()
+
+    Entries are keyed by absolute path and only reused while the size,
+    mtime and inode of the file are the ones it was hashed at."""
+
+    def __init__(self, directory, algorithm=FAST_ALGORITHM, index_path=None):
+        if algorithm not in ALGORITHMS:
+            raise ValueError("unknown fingerprint algorithm '%s' (available: %s)" % \
+                    (algorithm, ', '.join(sorted(ALGORITHMS))))
+        self.algorithm = algorithm
+        self.path = index_path or os.path.join(directory, INDEX_NAME)
+        self.entries = self._load()
+        self.lock = threading.Lock()
+        # digests computed (rather than found in the index) by this instance
+        self.computed = 0
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except ValueError:
+            # a corrupt index only costs a rehash
+            return {}
+        if data.get('version') != INDEX_VERSION:
+            return {}
+        return data['entries']
+
+    def save(self):
+        """Writes the index; returns False if the directory is not writable."""
+        tmp_path = self.path + '.tmp'
+        self.lock.acquire()
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'entries': self.entries}, f, sort_keys=True, indent=1)
+            # rename so a concurrent sweep never reads a half written index
+            os.rename(tmp_path, self.path)
+            return True
+        except (IOError, OSError):
+            return False
+        finally:
+            self.lock.release()
+
+    def cached_digest(self, path):
+        """digest of path from the index, or None if it has to be computed"""
+        entry = self.entries.get(os.path.abspath(path))
+        if entry is None or entry['stat'] != _stat_key(path):
+            return None
+        return entry['digests'].get(self.algorithm)
+
+    def digest(self, path):
+        path = os.path.abspath(path)
+        hexdigest = self.cached_digest(path)
+        if hexdigest is not None:
+            return hexdigest
+
+        stat = _stat_key(path)
+        hexdigest = file_digest(path, self.algorithm)
+        self.lock.acquire()
+        try:
+            entry = self.entries.get(path)
+            # digests of other algorithms stay valid as long as the file did
+            if entry is None or entry['stat'] != stat:
+                entry = {'stat': stat, 'digests': {}}
+                self.entries[path] = entry
+            entry['digests'][self.algorithm] = hexdigest
+            self.computed += 1
+        finally:
+            self.lock.release()
+        return hexdigest
+
+    def digest_all(self, paths, workers=DEFAULT_WORKERS):
+        """path -> digest of every path, hashing uncached files on `workers` threads"""
+        paths = list(paths)
+        missing = [path for path in paths if self.cached_digest(path) is None]
+        if len(missing) > 1 and workers > 1:
+            pool = ThreadPool(min(workers, len(missing)))
+            try:
+                pool.map(self.digest, missing)
+            finally:
+                pool.close()
+                pool.join()
+        return dict((path, self.digest(path)) for path in paths)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# File Name : ptb_parity.py
+#
+# Description : Parity check between the two PTBTokenizer backends in
+#               pycocoevalcap/tokenizer: runs the java Stanford PTBTokenizer
+#               and the in-process python reimplementation over every caption
+#               found in the given csv/json files and reports every caption
+#               the two tokenize differently (after punctuation removal, i.e.
+#               exactly what the scorers would see).
+#
+# usage: python2 ptb_parity.py [--max-report N] [file or directory ...]
+#
+# With no paths it checks ../../data/processed-csv-data and
+# ../../data/final-im2txt-ntk2-predictions. Needs java and the CoreNLP jar.
+# Exits with status 1 if any caption differs.
+
+import os
+import sys
+import csv
+import json
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pycocoevalcap', 'tokenizer'))
+from ptbtokenizer import PTBTokenizer, PTBTokenizerServer
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+DEFAULT_PATHS = [os.path.join(DATA_DIR, 'processed-csv-data'),
+                 os.path.join(DATA_DIR, 'final-im2txt-ntk2-predictions')]
+
+# csv columns of data/processed-csv-data holding captions
+CSV_CAPTION_COLUMNS = ['High', 'Low1', 'Low2', 'Low3', 'Low4']
+
+# json keys holding captions: ground truths ("caption"), im2txt predictions
+# ("captions") and neuraltalk2 predictions ("caption1".."caption3")
+JSON_CAPTION_KEYS = ['caption', 'captions', 'caption1', 'caption2', 'caption3']
+
+def to_unicode(s):
+    return s if isinstance(s, unicode) else s.decode('utf-8')
+
+def captions_from_json(obj, out):
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if key in JSON_CAPTION_KEYS and isinstance(value, basestring):
+                out.append(value)
+            elif key in JSON_CAPTION_KEYS and isinstance(value, list):
+                out.extend([v for v in value if isinstance(v, basestring)])
+            else:
+                captions_from_json(value, out)
+    elif isinstance(obj, list):
+        for value in obj:
+            captions_from_json(value, out)
+
+def captions_from_file(path):
+    captions = []
+    if path.endswith('.csv'):
+        with open(path) as csv_file:
+            for row in csv.DictReader(csv_file):
+                captions.extend([row[c] for c in CSV_CAPTION_COLUMNS if row.get(c)])
+    elif path.endswith('.json'):
+        with open(path) as json_file:
+            captions_from_json(json.load(json_file), captions)
+    return captions
+
+def files_under(path):
+    if os.path.isfile(path):
+        return [path]
+    found = []
+    for root, dirs, files in os.walk(path):
+        for f in sorted(files):
+            if f.endswith('.csv') or f.endswith('.json'):
+                found.append(os.path.join(root, f))
+    return found
+
+def main(argv):
+    max_report = 50
+    paths = []
+    i = 0
+    while i < len(argv):
+        if argv[i] == '--max-report':
+            max_report = int(argv[i+1])
+            i += 2
+        else:
+            paths.append(argv[i])
+            i += 1
+    if len(paths) == 0:
+        paths = DEFAULT_PATHS
+
+    # unique, non-empty captions only; predictions repeat heavily across checkpoints
+    captions = set()
+    for path in paths:
+        for f in files_under(path):
+            captions.update([c for c in captions_from_file(f) if c.strip() != ''])
+    captions = sorted(captions)
+    print('Checking %d unique captions' % len(captions))
+
+    captions_for_image = dict((i, [{'caption': c}]) for i, c in enumerate(captions))
+    with PTBTokenizerServer() as server:
+        java = PTBTokenizer(server=server).tokenize(captions_for_image)
+    python = PTBTokenizer(backend='python').tokenize(captions_for_image)
+
+    mismatches = [i for i in range(len(captions)) if to_unicode(java[i][0]) != to_unicode(python[i][0])]
+    for i in mismatches[:max_report]:
+        print('')
+        print('caption: %s' % to_unicode(captions[i]).encode('utf-8'))
+        print('  java:   %s' % to_unicode(java[i][0]).encode('utf-8'))
+        print('  python: %s' % to_unicode(python[i][0]).encode('utf-8'))
+
+    print('')
+    print('%d of %d captions differ' % (len(mismatches), len(captions)))
+    return 1 if len(mismatches) != 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
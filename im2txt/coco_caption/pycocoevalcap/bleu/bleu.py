@@ -9,6 +9,7 @@
 # Authors : Hao Fang <hfang@uw.edu> and Tsung-Yi Lin <tl483@cornell.edu>
 
 from bleu_scorer import BleuScorer
+from ref_index import PrecookedRefs
 
 
 class Bleu:
@@ -43,5 +44,42 @@ class Bleu:
         # return (bleu, bleu_info)
         return score, scores
 
+    def compute_caption_scores(self, gts, res):
+        """
+        Scores every candidate caption of every image in a single BleuScorer pass
+        :param gts: dict : image id -> list of tokenized reference sentences, or their
+                           PrecookedRefs (see ref_index.py)
+        :param res: dict : image id -> list of tokenized candidate sentences (e.g. one per beam)
+        :return: score (list of float) : corpus Bleu_1..n over all candidates
+                 scores (dict) : image id -> one [Bleu_1..n] list per candidate, in the order of res[id]
+        """
+        imgIds = res.keys()
+
+        bleu_scorer = BleuScorer(n=self._n)
+        for id in imgIds:
+            hypos = res[id]
+            ref = gts[id]
+
+            # Sanity check.
+            assert(type(hypos) is list)
+            assert(type(ref) is list or isinstance(ref, PrecookedRefs))
+            assert(len(ref) >= 1)
+
+            for hypo in hypos:
+                bleu_scorer += (hypo, ref)
+
+        score, bleu_list = bleu_scorer.compute_score(option='closest', verbose=1)
+
+        # bleu_list is indexed [n-gram order][candidate]; regroup it per image
+        scores = {}
+        i = 0
+        for id in imgIds:
+            scores[id] = []
+            for _ in res[id]:
+                scores[id].append([bleu_list[k][i] for k in range(self._n)])
+                i += 1
+
+        return score, scores
+
     def method(self):
         return "Bleu"
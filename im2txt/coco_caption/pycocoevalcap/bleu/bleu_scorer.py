@@ -17,25 +17,25 @@ cook_test(test, refs, n=4): Transform a test sentence as a string (together with
 '''
 
 import copy
+import itertools
 import sys, math, re
+import numpy as np
 from collections import defaultdict
+from pycocoevalcap.ngrams import count_ngrams, ngram_order
+from pycocoevalcap.bleu.ref_index import PrecookedRefs
 
 def precook(s, n=4, out=False):
     """Takes a string as input and returns an object that can be given to
     either cook_refs or cook_test. This is optional: cook_refs and cook_test
-    can take string arguments as well."""
+    can take string arguments as well. n-grams are keyed by their packed
+    integer form (see ngrams.py)."""
     words = s.split()
-    counts = defaultdict(int)
-    for k in xrange(1,n+1):
-        for i in xrange(len(words)-k+1):
-            ngram = tuple(words[i:i+k])
-            counts[ngram] += 1
-    return (len(words), counts)
+    return (len(words), count_ngrams(words, n))
 
 def cook_refs(refs, eff=None, n=4): ## lhuang: oracle will call with "average"
     '''Takes a list of reference sentences for a single segment
     and returns an object that encapsulates everything that BLEU
-    needs to know about them.'''
+    needs to know about them: the PrecookedRefs (reflen, maxcounts).'''
 
     reflen = []
     maxcounts = {}
@@ -55,7 +55,7 @@ def cook_refs(refs, eff=None, n=4): ## lhuang: oracle will call with "average"
     
     ## lhuang: N.B.: in case of "closest", keep a list of reflens!! (bad design)
 
-    return (reflen, maxcounts)
+    return PrecookedRefs(reflen, maxcounts)
 
 def cook_test(test, reflen_refmaxcounts, eff=None, n=4):
     '''Takes a test sentence and returns an object that
@@ -80,7 +80,7 @@ def cook_test(test, reflen_refmaxcounts, eff=None, n=4):
 
     result['correct'] = [0]*n
     for (ngram, count) in counts.iteritems():
-        result["correct"][len(ngram)-1] += min(refmaxcounts.get(ngram,0), count)
+        result["correct"][ngram_order(ngram)-1] += min(refmaxcounts.get(ngram,0), count)
 
     return result
 
@@ -109,10 +109,15 @@ class BleuScorer(object):
         self.special_reflen = special_reflen
 
     def cook_append(self, test, refs):
-        '''called by constructor and __iadd__ to avoid creating new instances.'''
+        '''called by constructor and __iadd__ to avoid creating new instances.
+        refs is either a list of reference sentences or the PrecookedRefs
+        cook_refs() returns for them, e.g. from a precooked ref_index.'''
         
         if refs is not None:
-            self.crefs.append(cook_refs(refs))
+            if isinstance(refs, PrecookedRefs):
+                self.crefs.append(refs)
+            else:
+                self.crefs.append(cook_refs(refs))
             if test is not None:
                 cooked_test = cook_test(test, self.crefs[-1])
                 self.ctest.append(cooked_test) ## N.B.: -1
@@ -197,54 +202,62 @@ class BleuScorer(object):
         self._score = None
         return self.compute_score(option, verbose)
         
+    def sentence_stats(self, option=None):
+        '''
+        BLEU sufficient statistics of every cooked test sentence, the sums of
+        which determine the corpus score (see bootstrap.py).
+        :return: stats (numpy array) : one row per test sentence, in the order they were added:
+                 correct 1..n-grams, guessed 1..n-grams, test length, effective reference length
+        '''
+        n = self.n
+        if option is None:
+            option = "average" if len(self.crefs) == 1 else "closest"
+
+        size = len(self.ctest)
+        stats = np.empty((size, 2*n + 2), dtype=np.float64)
+        stats[:, :n] = np.fromiter(itertools.chain.from_iterable([comps['correct'] for comps in self.ctest]), \
+                dtype=np.float64, count=size*n).reshape(size, n)
+        stats[:, n:2*n] = np.fromiter(itertools.chain.from_iterable([comps['guess'] for comps in self.ctest]), \
+                dtype=np.float64, count=size*n).reshape(size, n)
+        stats[:, 2*n] = [comps['testlen'] for comps in self.ctest]
+        if self.special_reflen is None: ## need computation
+            stats[:, 2*n+1] = [self._single_reflen(comps['reflen'], option, comps['testlen']) for comps in self.ctest]
+        else:
+            stats[:, 2*n+1] = self.special_reflen
+        return stats
+
     def compute_score(self, option=None, verbose=0):
         n = self.n
         small = 1e-9
         tiny = 1e-15 ## so that if guess is 0 still return 0
-        bleu_list = [[] for _ in range(n)]
 
         if self._score is not None:
             return self._score
 
-        if option is None:
-            option = "average" if len(self.crefs) == 1 else "closest"
-
-        self._testlen = 0
-        self._reflen = 0
-        totalcomps = {'testlen':0, 'reflen':0, 'guess':[0]*n, 'correct':[0]*n}
-
-        # for each sentence
-        for comps in self.ctest:            
-            testlen = comps['testlen']
-            self._testlen += testlen
-
-            if self.special_reflen is None: ## need computation
-                reflen = self._single_reflen(comps['reflen'], option, testlen)
-            else:
-                reflen = self.special_reflen
-
-            self._reflen += reflen
-                
-            for key in ['guess','correct']:
-                for k in xrange(n):
-                    totalcomps[key][k] += comps[key][k]
-
-            # append per image bleu score
-            bleu = 1.
-            for k in xrange(n):
-                bleu *= (float(comps['correct'][k]) + tiny) \
-                        /(float(comps['guess'][k]) + small) 
-                bleu_list[k].append(bleu ** (1./(k+1)))
-            ratio = (testlen + tiny) / (reflen + small) ## N.B.: avoid zero division
-            if ratio < 1:
-                for k in xrange(n):
-                    bleu_list[k][-1] *= math.exp(1 - 1/ratio)
-
-            #if verbose > 1:
-                #print(comps, reflen)
-
-        totalcomps['reflen'] = self._reflen
-        totalcomps['testlen'] = self._testlen
+        # one row per cooked test sentence, so that sentence level bleu is
+        # computed with array operations rather than a loop per sentence
+        stats = self.sentence_stats(option)
+        correct = stats[:, :n]
+        guess = stats[:, n:2*n]
+        testlens = stats[:, 2*n].astype(np.int64)
+        reflens = stats[:, 2*n+1]
+
+        self._testlen = int(testlens.sum())
+        self._reflen = sum(reflens.tolist())
+
+        # per image bleu score
+        bleus = np.cumprod((correct + tiny) / (guess + small), axis=1) \
+                ** (1. / np.arange(1, n+1))
+        ratio = (testlens + tiny) / (np.array(reflens, dtype=np.float64) + small) ## N.B.: avoid zero division
+        short = ratio < 1
+        bleus[short] *= np.exp(1 - 1/ratio[short])[:, np.newaxis]
+        bleu_list = bleus.T.tolist()
+
+        #if verbose > 1:
+            #print(comps, reflen)
+
+        totalcomps = {'testlen':self._testlen, 'reflen':self._reflen, \
+                'guess':guess.sum(axis=0).tolist(), 'correct':correct.sum(axis=0).tolist()}
 
         bleus = []
         bleu = 1.
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#
+# File Name : bootstrap.py
+#
+# Description : Bootstrap confidence intervals and paired significance tests
+#               for corpus BLEU. Corpus BLEU only depends on the sums of the
+#               per sentence sufficient statistics (BleuScorer.sentence_stats:
+#               matched and guessed n-grams, test and reference length), so a
+#               resample of the sentences is a vector of multinomial counts
+#               and its statistics are one matrix product; thousands of
+#               resamples take a few of those instead of a BLEU computation
+#               per resample.
+
+import numpy as np
+
+from bleu_scorer import BleuScorer
+
+# resamples drawn per matrix product; bounds the weights to chunk x sentences
+CHUNK_SIZE = 1000
+
+def caption_stats(gts, res, n=4):
+    """
+    :param gts: dict : image id -> list of tokenized references, or their
+                       PrecookedRefs (see ref_index.py)
+    :param res: list of (image id, tokenized caption)
+    :return: stats (numpy array) : BleuScorer.sentence_stats() of every caption of res, in order
+    """
+    bleu_scorer = BleuScorer(n=n)
+    for image_id, caption in res:
+        bleu_scorer += (caption, gts[image_id])
+    return bleu_scorer.sentence_stats(option='closest')
+
+def corpus_bleu(totals, n=4):
+    """
+    Corpus Bleu_1..n from summed sufficient statistics, computed like
+    BleuScorer.compute_score.
+    :param totals: numpy array : (..., 2n+2) sums of sentence_stats() rows
+    :return: bleu (numpy array) : (..., n)
+    """
+    small = 1e-9
+    tiny = 1e-15 ## so that if guess is 0 still return 0
+    correct = totals[..., :n]
+    guess = totals[..., n:2*n]
+    ratio = (totals[..., 2*n] + tiny) / (totals[..., 2*n+1] + small)
+    bleu = np.cumprod((correct + tiny) / (guess + small), axis=-1) ** (1. / np.arange(1, n+1))
+    brevity = np.where(ratio < 1, np.exp(1 - 1 / np.minimum(ratio, 1)), 1.)
+    return bleu * brevity[..., np.newaxis]
+
+def _scores(bleu):
+    """Bleu_1..n plus their average, the criterion choose-best-bleu.py ranks by"""
+    return np.concatenate([bleu, bleu.mean(axis=-1)[..., np.newaxis]], axis=-1)
+
+def score_names(n=4):
+    return ['Bleu_%d' % (k+1) for k in xrange(n)] + ['Bleu_avg']
+
+def resampled_scores(stats_list, num_samples=1000, seed=0, n=4):
+    """
+    Draws num_samples resamples (with replacement) of the sentences and
+    scores every system in stats_list on each of them. The same resamples
+    are used for every system, so their scores are paired.
+    :param stats_list: list of numpy array : sentence stats of each system, aligned row by row
+    :return: scores (numpy array) : (systems, num_samples, n+1) Bleu_1..n and their average
+    """
+    num_sentences = len(stats_list[0])
+    for stats in stats_list:
+        assert len(stats) == num_sentences, "paired systems must score the same sentences"
+    rng = np.random.RandomState(seed)
+    uniform = np.full(num_sentences, 1. / num_sentences)
+    scores = np.empty((len(stats_list), num_samples, n+1))
+    for start in xrange(0, num_samples, CHUNK_SIZE):
+        count = min(CHUNK_SIZE, num_samples - start)
+        # how often each sentence is drawn in each resample
+        weights = rng.multinomial(num_sentences, uniform, size=count).astype(np.float64)
+        for i, stats in enumerate(stats_list):
+            scores[i, start:start+count] = _scores(corpus_bleu(weights.dot(stats), n))
+    return scores
+
+def bootstrap_ci(stats, num_samples=1000, alpha=0.05, seed=0, n=4):
+    """
+    Percentile bootstrap confidence interval of the corpus scores of one system.
+    :return: dict : score name -> (score, low, high)
+    """
+    score = _scores(corpus_bleu(stats.sum(axis=0), n))
+    samples = resampled_scores([stats], num_samples, seed, n)[0]
+    low, high = np.percentile(samples, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    return dict(zip(score_names(n), zip(score, low, high)))
+
+def paired_bootstrap(stats_a, stats_b, num_samples=1000, alpha=0.05, seed=0, n=4):
+    """
+    Paired bootstrap test of system a against system b on the same sentences.
+    :return: dict : score name -> (a - b, low, high, p) with the confidence
+             interval of the difference and the two sided p value of it being 0
+    """
+    delta = _scores(corpus_bleu(stats_a.sum(axis=0), n)) - _scores(corpus_bleu(stats_b.sum(axis=0), n))
+    samples = resampled_scores([stats_a, stats_b], num_samples, seed, n)
+    deltas = samples[0] - samples[1]
+    low, high = np.percentile(deltas, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    # how often the resampled difference does not have the sign of the observed one
+    p = 2 * np.minimum((deltas <= 0).mean(axis=0), (deltas >= 0).mean(axis=0))
+    return dict(zip(score_names(n), zip(delta, low, high, np.minimum(p, 1.))))
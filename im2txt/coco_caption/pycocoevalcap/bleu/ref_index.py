@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+# File Name : ref_index.py
+#
+# Description : Precooked BLEU reference index. cook_refs() turns the ground
+#               truth captions of an image into (reflen, maxcounts); those
+#               never change between prediction files, so they are cooked
+#               once per ground truth set, pickled next to the ground truth
+#               json and handed to BleuScorer in place of the raw references.
+
+import os
+import json
+import hashlib
+import cPickle as pickle
+from collections import namedtuple
+
+from pycocoevalcap.ngrams import vocabulary
+
+# bump whenever the layout of the pickled index changes
+INDEX_VERSION = 5
+
+# what cook_refs() returns for the references of an image; BleuScorer takes
+# one in place of the list of reference sentences
+PrecookedRefs = namedtuple('PrecookedRefs', ['reflen', 'maxcounts'])
+
+def fingerprint(tokenized_gts_by_id, n=4):
+    """sha1 over the tokenized references and n; an index is only reused
+    when the references it was cooked from are exactly the same."""
+    data = json.dumps([INDEX_VERSION, n, sorted(tokenized_gts_by_id.items())])
+    return hashlib.sha1(data).hexdigest()
+
+def build_ref_index(tokenized_gts_by_id, n=4):
+    """image id -> cook_refs() of its tokenized reference sentences"""
+    # imported here, bleu_scorer imports PrecookedRefs from this module
+    from bleu_scorer import cook_refs
+    return dict((image_id, cook_refs(refs, n=n)) for image_id, refs in tokenized_gts_by_id.items())
+
+def save_ref_index(path, ref_index, fp, n=4):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        # the n-gram keys are only meaningful with the vocabulary that packed them
+        pickle.dump({'version': INDEX_VERSION, 'n': n, 'fingerprint': fp, 'refs': ref_index, \
+                'vocabulary': list(vocabulary.tokens)}, f, pickle.HIGHEST_PROTOCOL)
+    # rename so a concurrent reader never sees a half written index
+    os.rename(tmp_path, path)
+
+def load_ref_index(path, fp=None, n=4):
+    """Returns the pickled index at path, or None if it is missing, was
+    written by another version, does not match the fingerprint fp or was
+    packed with a vocabulary that conflicts with the one in use."""
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as f:
+        data = pickle.load(f)
+    if data.get('version') != INDEX_VERSION or data.get('n') != n:
+        return None
+    if fp is not None and data.get('fingerprint') != fp:
+        return None
+    if not vocabulary.adopt(data['vocabulary']):
+        return None
+    return data['refs']
+
+def get_ref_index(path, tokenized_gts_by_id, n=4):
+    """Loads the reference index cached at path, (re)building and saving it
+    when it is missing or was cooked from different references."""
+    fp = fingerprint(tokenized_gts_by_id, n)
+    ref_index = load_ref_index(path, fp, n)
+    if ref_index is None:
+        ref_index = build_ref_index(tokenized_gts_by_id, n)
+        save_ref_index(path, ref_index, fp, n)
+    return ref_index
@@ -8,18 +8,49 @@
 # Authors: Ramakrishna Vedantam <vrama91@vt.edu> and Tsung-Yi Lin <tl483@cornell.edu>
 
 from cider_scorer import CiderScorer
+from sparse_cider_scorer import SparseCiderScorer
+from collections import OrderedDict
+import threading
+import numpy as np
 import pdb
 
+# SparseCiderScorers of the most recently scored reference sets; every
+# COCOEvalCap run over the same ground truths (e.g. one per checkpoint)
+# reuses their reference vectors instead of rebuilding them
+MAX_CACHED_SCORERS = 4
+_sparse_scorers = OrderedDict()
+_sparse_scorers_lock = threading.Lock()
+
+def get_sparse_scorer(gts, n=4, sigma=6.0, document_frequency=None):
+    """SparseCiderScorer for gts (image id -> tokenized references), shared
+    by every call with the same references and document frequencies"""
+    key = (n, sigma, document_frequency, tuple(sorted((id, tuple(refs)) for id, refs in gts.items())))
+    _sparse_scorers_lock.acquire()
+    try:
+        if key in _sparse_scorers:
+            scorer = _sparse_scorers.pop(key)
+        else:
+            scorer = SparseCiderScorer(gts, n=n, sigma=sigma, document_frequency=document_frequency)
+        _sparse_scorers[key] = scorer
+        while len(_sparse_scorers) > MAX_CACHED_SCORERS:
+            _sparse_scorers.popitem(last=False)
+        return scorer
+    finally:
+        _sparse_scorers_lock.release()
+
 class Cider:
     """
     Main Class to compute the CIDEr metric 
 
     """
-    def __init__(self, test=None, refs=None, n=4, sigma=6.0):
+    def __init__(self, test=None, refs=None, n=4, sigma=6.0, document_frequency=None):
         # set cider to sum over 1 to 4-grams
         self._n = n
         # set the standard deviation parameter for gaussian penalty
         self._sigma = sigma
+        # cider_df.DocumentFrequency of the whole split; when None the document
+        # frequencies come from the references being scored
+        self._document_frequency = document_frequency
 
     def compute_score(self, gts, res):
         """
@@ -32,8 +63,6 @@ class Cider:
         assert(gts.keys() == res.keys())
         imgIds = gts.keys()
 
-        cider_scorer = CiderScorer(n=self._n, sigma=self._sigma)
-
         for id in imgIds:
             hypo = res[id]
             ref = gts[id]
@@ -44,11 +73,11 @@ class Cider:
             assert(type(ref) is list)
             assert(len(ref) > 0)
 
-            cider_scorer += (hypo[0], ref)
-
-        (score, scores) = cider_scorer.compute_score()
+        cider_scorer = get_sparse_scorer(gts, n=self._n, sigma=self._sigma, \
+                document_frequency=self._document_frequency)
+        scores = cider_scorer.score([(id, res[id][0]) for id in imgIds])
 
-        return score, scores
+        return np.mean(scores), scores
 
     def method(self):
         return "CIDEr"
\ No newline at end of file
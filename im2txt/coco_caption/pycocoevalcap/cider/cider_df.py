@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# File Name : cider_df.py
+#
+# Description : Precomputed CIDEr document frequencies. By default CIDEr takes
+#               its document frequencies (and log reference length) from the
+#               references being scored, so a caption's score depends on which
+#               other images happen to be in the batch and single captions
+#               score 0. A document frequency file fixes them to a whole
+#               ground truth split instead; build them with
+#               ../../build_cider_df.py.
+
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+
+from pycocoevalcap.ngrams import pack
+
+# bump whenever the file layout or the way frequencies are counted changes
+DF_VERSION = 1
+
+def df_path(gt_path):
+    """document frequency file of a ground truth json, stored next to it"""
+    return os.path.splitext(gt_path)[0] + '.cider-df.json'
+
+def file_sha1(path):
+    """sha1 of a file's contents, e.g. of the ground truth a df file was built from"""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def count_document_frequency(refs, n=4):
+    """
+    :param refs: dict : image id -> list of tokenized reference sentences
+    :return: document_frequency (dict) : space separated n-gram -> number of images with it in a reference
+    """
+    document_frequency = {}
+    for image_refs in refs.values():
+        ngrams = set()
+        for ref in image_refs:
+            words = ref.split()
+            for k in xrange(1, n+1):
+                for i in xrange(len(words)-k+1):
+                    ngrams.add(' '.join(words[i:i+k]))
+        for ngram in ngrams:
+            document_frequency[ngram] = document_frequency.get(ngram, 0) + 1
+    return document_frequency
+
+def save_document_frequency(path, refs, gt_path, tokenizer, n=4):
+    data = {
+        'version': DF_VERSION,
+        'n': n,
+        'tokenizer': tokenizer,
+        'ground_truth': os.path.basename(gt_path),
+        'ground_truth_sha1': file_sha1(gt_path),
+        'num_images': len(refs),
+        'document_frequency': count_document_frequency(refs, n),
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f, sort_keys=True)
+
+class DocumentFrequency:
+    """A loaded document frequency file."""
+
+    def __init__(self, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != DF_VERSION:
+            raise ValueError('%s is a version %s CIDEr document frequency file, expected version %d' % \
+                    (path, data.get('version'), DF_VERSION))
+        self.path = path
+        self.n = data['n']
+        self.tokenizer = data['tokenizer']
+        self.num_images = data['num_images']
+        # sha1 of the ground truth json the frequencies were counted on
+        self.ground_truth_sha1 = data['ground_truth_sha1']
+        # (path, size, mtime) of ground truth files -> whether they match, so
+        # that a file is only hashed again when it changes
+        self._matches = {}
+        self.ref_len = np.log(float(self.num_images))
+        # keyed by packed n-gram (see ngrams.py), like the scorers' counts
+        self.document_frequency = dict((pack(ngram.split()), float(count)) \
+                for ngram, count in data['document_frequency'].iteritems())
+
+    def matches(self, gt_path):
+        """whether the frequencies were counted on the current contents of
+        the ground truth json at gt_path (it may have been edited or
+        regenerated since)"""
+        st = os.stat(gt_path)
+        key = (os.path.abspath(gt_path), st.st_size, st.st_mtime)
+        if key not in self._matches:
+            self._matches[key] = self.ground_truth_sha1 == file_sha1(gt_path)
+        return self._matches[key]
+
+# files loaded through load_document_frequency(), one per path
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+def load_document_frequency(path):
+    path = os.path.abspath(path)
+    _loaded_lock.acquire()
+    try:
+        if path not in _loaded:
+            _loaded[path] = DocumentFrequency(path)
+        return _loaded[path]
+    finally:
+        _loaded_lock.release()
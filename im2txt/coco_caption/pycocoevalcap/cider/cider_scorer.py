@@ -7,6 +7,7 @@ from collections import defaultdict
 import numpy as np
 import pdb
 import math
+from pycocoevalcap.ngrams import count_ngrams, ngram_order
 
 def precook(s, n=4, out=False):
     """
@@ -15,15 +16,9 @@ def precook(s, n=4, out=False):
     can take string arguments as well.
     :param s: string : sentence to be converted into ngrams
     :param n: int    : number of ngrams for which representation is calculated
-    :return: term frequency vector for occuring ngrams
+    :return: term frequency vector for occuring ngrams, keyed by packed n-gram (see ngrams.py)
     """
-    words = s.split()
-    counts = defaultdict(int)
-    for k in xrange(1,n+1):
-        for i in xrange(len(words)-k+1):
-            ngram = tuple(words[i:i+k])
-            counts[ngram] += 1
-    return counts
+    return count_ngrams(s.split(), n)
 
 def cook_refs(refs, n=4): ## lhuang: oracle will call with "average"
     '''Takes a list of reference sentences for a single segment
@@ -119,7 +114,7 @@ class CiderScorer(object):
                 # give word count 1 if it doesn't appear in reference corpus
                 df = np.log(max(1.0, self.document_frequency[ngram]))
                 # ngram index
-                n = len(ngram)-1
+                n = ngram_order(ngram)-1
                 # tf (term_freq) * idf (precomputed idf) for n-grams
                 vec[n][ngram] = float(term_freq)*(self.ref_len - df)
                 # compute norm for the vector.  the norm will be used for computing similarity
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+# File Name : sparse_cider_scorer.py
+#
+# Description : CIDEr-D (clipped n-gram tf-idf cosine with a gaussian length
+#               penalty, exactly what CiderScorer.compute_cider computes) on
+#               scipy.sparse matrices. The tf-idf vectors, norms and lengths
+#               of the references are built once per reference set; a batch
+#               of hypotheses is then scored with a handful of sparse matrix
+#               operations instead of dict loops per hypothesis/reference pair.
+
+import numpy as np
+import scipy.sparse as sp
+
+from cider_scorer import precook
+from pycocoevalcap.ngrams import ngram_orders
+
+class SparseCiderScorer(object):
+    """CIDEr-D scorer with cached reference vectors.
+    """
+
+    def __init__(self, refs, n=4, sigma=6.0, document_frequency=None):
+        '''
+        :param refs: dict : image id -> list of tokenized reference sentences
+        :param n: int : number of ngrams for which (ngram) representation is calculated
+        :param sigma: float : standard deviation of the gaussian length penalty
+        :param document_frequency: cider_df.DocumentFrequency : corpus document frequencies
+                                   to use instead of the ones of refs
+        '''
+        self.n = n
+        self.sigma = sigma
+        self.image_ids = list(refs.keys())
+        self.image_index = dict((image_id, i) for i, image_id in enumerate(self.image_ids))
+        crefs = [[precook(ref, n) for ref in refs[image_id]] for image_id in self.image_ids]
+
+        if document_frequency is not None:
+            assert document_frequency.n >= n, "%s only has %d-gram frequencies" % \
+                    (document_frequency.path, document_frequency.n)
+            self.document_frequency = document_frequency.document_frequency
+            self.ref_len = document_frequency.ref_len
+        else:
+            # document frequency: the number of images with the ngram in any of their references
+            self.document_frequency = {}
+            for counts in crefs:
+                for ngram in set([ngram for ref in counts for ngram in ref]):
+                    self.document_frequency[ngram] = self.document_frequency.get(ngram, 0.0) + 1
+            self.ref_len = np.log(float(len(crefs)))
+
+        # one column per ngram that occurs in the references; ngrams that
+        # only occur in hypotheses can not match and only affect their norm
+        ngrams = list(set([ngram for counts in crefs for ref in counts for ngram in ref]))
+        self.columns = dict((ngram, j) for j, ngram in enumerate(ngrams))
+        # column -> ngram order indicator, to sum products per order
+        self.order_matrix = sp.csr_matrix((np.ones(len(ngrams)), \
+                (np.arange(len(ngrams)), ngram_orders(ngrams)-1)), shape=(len(ngrams), n))
+
+        # references of image i are rows ref_offsets[i]:ref_offsets[i+1]
+        self.ref_offsets = np.cumsum([0] + [len(counts) for counts in crefs])
+        self.ref_matrix, self.ref_norms, self.ref_lengths = \
+                self._vectors([ref for counts in crefs for ref in counts])
+
+    def _vectors(self, cooked):
+        '''
+        Maps counts of ngrams to tf-idf vectors, like counts2vec in CiderScorer.
+        :param cooked: list of dict : ngram counts of each sentence
+        :return: matrix (csr_matrix) : one tf-idf row per sentence, over the reference ngram columns
+                 norms (numpy array) : per ngram order l2 norm of every sentence
+                 lengths (numpy array) : length of every sentence (counts2vec uses its bigram count)
+        '''
+        rows, ngrams, tfs = [], [], []
+        for i, counts in enumerate(cooked):
+            rows.extend([i] * len(counts))
+            ngrams.extend(counts.iterkeys())
+            tfs.extend(counts.itervalues())
+        rows = np.array(rows, dtype=np.int64)
+        orders = ngram_orders(ngrams) - 1
+        tfs = np.array(tfs, dtype=np.float64)
+
+        # give word count 1 if it doesn't appear in reference corpus
+        df = np.array([self.document_frequency.get(ngram, 0.0) for ngram in ngrams])
+        vec = tfs * (self.ref_len - np.log(np.maximum(1.0, df)))
+
+        norms = np.zeros((len(cooked), self.n))
+        np.add.at(norms, (rows, orders), vec**2)
+        lengths = np.bincount(rows[orders == 1], weights=tfs[orders == 1], minlength=len(cooked))
+
+        cols = np.array([self.columns.get(ngram, -1) for ngram in ngrams], dtype=np.int64)
+        known = cols >= 0
+        matrix = sp.csr_matrix((vec[known], (rows[known], cols[known])), \
+                shape=(len(cooked), len(self.columns)))
+        return matrix, np.sqrt(norms), lengths
+
+    def score(self, hyps):
+        '''
+        Scores a batch of hypotheses against the references of their images.
+        :param hyps: list of (image id, tokenized hypothesis sentence)
+        :return: scores (numpy array) : CIDEr-D of every hypothesis, in order
+        '''
+        if len(hyps) == 0:
+            return np.zeros(0)
+
+        hyp_matrix, hyp_norms, hyp_lengths = self._vectors([precook(hyp, self.n) for image_id, hyp in hyps])
+
+        # one row per (hypothesis, reference of its image) pair
+        pair_hyp = []
+        pair_ref = []
+        num_refs = []
+        for h, (image_id, hyp) in enumerate(hyps):
+            i = self.image_index[image_id]
+            start, end = self.ref_offsets[i], self.ref_offsets[i+1]
+            pair_hyp.extend([h] * (end - start))
+            pair_ref.extend(range(start, end))
+            num_refs.append(end - start)
+        pair_hyp = np.array(pair_hyp, dtype=np.int64)
+        pair_ref = np.array(pair_ref, dtype=np.int64)
+
+        # vrama91 : clipped cosine similarity per ngram order
+        hyp_vecs = hyp_matrix[pair_hyp]
+        ref_vecs = self.ref_matrix[pair_ref]
+        val = np.asarray((hyp_vecs.minimum(ref_vecs).multiply(ref_vecs) * self.order_matrix).todense())
+        norm_hyp = hyp_norms[pair_hyp]
+        norm_ref = self.ref_norms[pair_ref]
+        nonzero = (norm_hyp != 0) & (norm_ref != 0)
+        val[nonzero] /= norm_hyp[nonzero] * norm_ref[nonzero]
+
+        # vrama91: added a length based gaussian penalty
+        delta = (hyp_lengths[pair_hyp] - self.ref_lengths[pair_ref]).astype(np.float64)
+        val *= (np.e**(-(delta**2)/(2*self.sigma**2)))[:, np.newaxis]
+
+        score = np.zeros((len(hyps), self.n))
+        np.add.at(score, pair_hyp, val)
+        # mean of ngram scores, divided by the number of references, times 10
+        return score.mean(axis=1) / np.array(num_refs) * 10.0
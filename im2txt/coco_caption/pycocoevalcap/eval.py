@@ -4,6 +4,7 @@ from bleu.bleu import Bleu
 from meteor.meteor import Meteor
 from rouge.rouge import Rouge
 from cider.cider import Cider
+from cider.cider_df import load_document_frequency
 from spice.spice import Spice
 
 class COCOEvalCap:
@@ -13,7 +14,18 @@ class COCOEvalCap:
         self.imgToEval = {}
         self.coco = coco
         self.cocoRes = cocoRes
-        self.params = {'image_id': coco.getImgIds()}
+        # 'tokenizer' selects the PTBTokenizer backend: 'java' (Stanford
+        # PTBTokenizer) or 'python' (in-process, so BLEU/ROUGE/CIDEr need no java)
+        # 'cider_df' is a document frequency file (see cider/cider_df.py) to
+        # take CIDEr's document frequencies from instead of the scored references;
+        # 'cider_df_ground_truth' must then be the ground truth json the
+        # references come from, and the file must have been built from it
+        # 'metrics' selects the scorers to run, out of 'Bleu' and 'CIDEr'
+        # (e.g. ['Bleu'] when only BLEU is used)
+        # 'spice_shards' > 0 adds SPICE, run as that many parallel SPICE
+        # processes (see spice/spice.py); 0 leaves the slow SPICE out
+        self.params = {'image_id': coco.getImgIds(), 'tokenizer': 'java', 'metrics': ['Bleu', 'CIDEr'], \
+                'cider_df': None, 'cider_df_ground_truth': None, 'spice_shards': 0}
 
     def evaluate(self):
         imgIds = self.params['image_id']
@@ -28,7 +40,7 @@ class COCOEvalCap:
         # Set up scorers
         # =================================================
         #print('tokenization...')
-        tokenizer = PTBTokenizer()
+        tokenizer = PTBTokenizer(backend=self.params['tokenizer'])
         gts  = tokenizer.tokenize(gts)
         res = tokenizer.tokenize(res)
 
@@ -36,13 +48,30 @@ class COCOEvalCap:
         # Set up scorers
         # =================================================
         #print('setting up scorers...')
-        scorers = [
-            (Bleu(4), ["Bleu_1", "Bleu_2", "Bleu_3", "Bleu_4"]),
-            #(Meteor(),"METEOR"),
-            #(Rouge(), "ROUGE_L"),
-            #(Cider(), "CIDEr"),
-            #(Spice(), "SPICE")
-        ]
+        for metric in self.params['metrics']:
+            if metric not in ['Bleu', 'CIDEr']:
+                raise ValueError("unknown metric %s in params['metrics']" % metric)
+        document_frequency = None
+        if 'CIDEr' in self.params['metrics'] and self.params['cider_df'] is not None:
+            document_frequency = load_document_frequency(self.params['cider_df'])
+            if document_frequency.tokenizer != self.params['tokenizer']:
+                raise ValueError("%s was built with the %s tokenizer, not %s" % \
+                        (self.params['cider_df'], document_frequency.tokenizer, self.params['tokenizer']))
+            gt_path = self.params['cider_df_ground_truth']
+            if gt_path is None:
+                raise ValueError("params['cider_df'] needs params['cider_df_ground_truth'], the ground truth json of the scored references")
+            if not document_frequency.matches(gt_path):
+                raise ValueError("%s was not built from the current %s; rebuild it with build_cider_df.py" % \
+                        (self.params['cider_df'], gt_path))
+        scorers = []
+        if 'Bleu' in self.params['metrics']:
+            scorers.append((Bleu(4), ["Bleu_1", "Bleu_2", "Bleu_3", "Bleu_4"]))
+        #scorers.append((Meteor(),"METEOR"))
+        #scorers.append((Rouge(), "ROUGE_L"))
+        if 'CIDEr' in self.params['metrics']:
+            scorers.append((Cider(document_frequency=document_frequency), "CIDEr"))
+        if self.params['spice_shards'] > 0:
+            scorers.append((Spice(shards=self.params['spice_shards']), "SPICE"))
 
         # =================================================
         # Compute scores
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#
+# File Name : ngrams.py
+#
+# Description : Integer n-gram featurizer shared by the BLEU and CIDEr
+#               scorers. Tokens are mapped to integer ids through a process
+#               wide vocabulary and every n-gram is packed into one integer,
+#               so counting n-grams hashes ints instead of allocating a tuple
+#               of strings for every n-gram. Each token takes 16 bit groups:
+#               its id in base 2^15, most significant digit first, with the
+#               top bit of every group but the last set. Ids below 2^15 take
+#               one group, so 1..4-grams of those fit in 64 bits; larger ids
+#               take more groups (and the key becomes a long), so the
+#               vocabulary has no limit. The vocabulary only grows: a long
+#               running process keeps every distinct token it has counted.
+
+import threading
+from itertools import izip
+import numpy as np
+
+# bits of each group of a packed token, the id bits in it and the flag
+# marking groups that more groups of the same token follow
+BITS = 16
+DIGIT_BITS = BITS - 1
+DIGIT_MASK = (1 << DIGIT_BITS) - 1
+MORE = 1 << DIGIT_BITS
+# MORE flags of the groups of a key of up to 4 groups, and the bound below
+# which such keys fit in a uint64
+MORE_MASK = sum([MORE << (k * BITS) for k in xrange(4)])
+MAX_SHORT_KEY = 1 << (4 * BITS)
+
+class Vocabulary:
+    """Token -> integer id mapping. Ids start at 1, so the first group of a
+    packed n-gram is never 0 and no groups are lost in the integer. Safe to
+    share between threads."""
+
+    def __init__(self):
+        self.token_ids = {}
+        self.tokens = []
+        self.lock = threading.Lock()
+
+    def ids(self, words):
+        ids = map(self.token_ids.get, words)
+        if None in ids:
+            ids = [self._add(w) if i is None else i for w, i in zip(words, ids)]
+        return ids
+
+    def _add(self, w):
+        self.lock.acquire()
+        try:
+            i = self.token_ids.get(w)
+            if i is None:
+                self.tokens.append(w)
+                i = len(self.tokens)
+                self.token_ids[w] = i
+            return i
+        finally:
+            self.lock.release()
+
+    def adopt(self, tokens):
+        """Extends this vocabulary to `tokens`, e.g. the vocabulary a pickled
+        set of counts was built with, so that their keys mean the same here.
+        Returns False if ids were already handed out that disagree."""
+        self.lock.acquire()
+        try:
+            if self.tokens != list(tokens[:len(self.tokens)]):
+                return False
+            for w in tokens[len(self.tokens):]:
+                self.tokens.append(w)
+                self.token_ids[w] = len(self.tokens)
+            return True
+        finally:
+            self.lock.release()
+
+# the vocabulary every scorer in this process counts with
+vocabulary = Vocabulary()
+
+def encode(i):
+    """(packed form, width in bits) of the token with id i"""
+    code = i & DIGIT_MASK
+    width = BITS
+    i >>= DIGIT_BITS
+    while i:
+        code |= ((i & DIGIT_MASK) | MORE) << width
+        width += BITS
+        i >>= DIGIT_BITS
+    return code, width
+
+def count_ngrams(words, n=4):
+    """
+    Counts every 1..n-gram of a tokenized sentence.
+    :param words: list of string : tokens of the sentence
+    :param n: int : longest n-gram to count
+    :return: counts (dict) : packed n-gram -> number of occurrences
+    """
+    ids = vocabulary.ids(words)
+    # each pass extends the previous n-grams by the token k places after their
+    # start (izip reuses its result tuple, so no tuple is allocated per n-gram)
+    keys = list(ids)
+    ngrams = ids
+    if len(ids) == 0 or max(ids) <= DIGIT_MASK:
+        # every token is a single group
+        for k in xrange(1, n):
+            ngrams = [(ngram << BITS) | i for ngram, i in izip(ngrams, ids[k:])]
+            keys += ngrams
+    else:
+        codes = [encode(i) for i in ids]
+        keys = [code for code, width in codes]
+        ngrams = keys
+        for k in xrange(1, n):
+            ngrams = [(ngram << width) | code for ngram, (code, width) in izip(ngrams, codes[k:])]
+            keys += ngrams
+    counts = {}
+    get = counts.get
+    for key in keys:
+        counts[key] = get(key, 0) + 1
+    return counts
+
+def pack(words):
+    """packed form of the n-gram made of words"""
+    key = 0
+    for i in vocabulary.ids(words):
+        code, width = encode(i)
+        key = (key << width) | code
+    return key
+
+def ngram_order(key):
+    """number of tokens in a packed n-gram"""
+    if key < MAX_SHORT_KEY and not key & MORE_MASK:
+        return (key.bit_length() + BITS - 1) // BITS
+    # a token ends at every group without the MORE flag
+    order = 0
+    while key:
+        if not key & MORE:
+            order += 1
+        key >>= BITS
+    return order
+
+def ngram_orders(keys):
+    """numpy array with the number of tokens of every packed n-gram in keys"""
+    try:
+        keys = np.asarray(keys, dtype=np.uint64)
+    except OverflowError:
+        return np.fromiter([ngram_order(key) for key in keys], dtype=np.int64, count=len(keys))
+    orders = np.zeros(len(keys), dtype=np.int64)
+    for k in xrange(4):
+        groups = keys >> np.uint64(k * BITS)
+        orders += (groups != 0) & ((groups & np.uint64(MORE)) == 0)
+    return orders
+
+def unpack(key):
+    """tuple of the tokens of a packed n-gram"""
+    groups = []
+    while key:
+        groups.append(key & ((1 << BITS) - 1))
+        key >>= BITS
+    words = []
+    i = 0
+    for group in reversed(groups):
+        i = (i << DIGIT_BITS) | (group & DIGIT_MASK)
+        if not group & MORE:
+            words.append(vocabulary.tokens[i - 1])
+            i = 0
+    return tuple(words)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+#
+# File Name : ngrams_test.py
+#
+# Description : Tests of the integer n-gram featurizer and of the BLEU and
+#               CIDEr scores computed with it.
+#
+# usage: python2 -m pycocoevalcap.ngrams_test (from coco_caption/)
+
+import unittest
+
+from pycocoevalcap import ngrams
+from pycocoevalcap.bleu.bleu import Bleu
+from pycocoevalcap.cider.cider import Cider
+
+class NgramsTest(unittest.TestCase):
+
+    def test_count_ngrams(self):
+        counts = ngrams.count_ngrams('a b a b'.split(), n=3)
+        self.assertEqual(dict((ngrams.unpack(k), c) for k, c in counts.items()),
+                         {('a',): 2, ('b',): 2, ('a', 'b'): 2, ('b', 'a'): 1,
+                          ('a', 'b', 'a'): 1, ('b', 'a', 'b'): 1})
+        self.assertEqual(ngrams.pack(['a', 'b']), ngrams.pack('a b'.split()))
+        self.assertEqual(ngrams.ngram_order(ngrams.pack(['a', 'b', 'a'])), 3)
+
+    def test_long_ids(self):
+        # ids of 2^15 and above take more than one 16 bit group
+        saved = ngrams.vocabulary
+        try:
+            ngrams.vocabulary = ngrams.Vocabulary()
+            ngrams.vocabulary.adopt(['w%d' % i for i in xrange(40000)])
+            words = ['w3', 'w39999', 'w32767', 'new', 'w39999', 'w0']
+            counts = ngrams.count_ngrams(words)
+            expected = {}
+            for k in xrange(1, 5):
+                for j in xrange(len(words) - k + 1):
+                    ngram = tuple(words[j:j+k])
+                    expected[ngram] = expected.get(ngram, 0) + 1
+            self.assertEqual(dict((ngrams.unpack(k), c) for k, c in counts.items()), expected)
+            keys = counts.keys()
+            self.assertEqual(list(ngrams.ngram_orders(keys)), [len(ngrams.unpack(k)) for k in keys])
+            self.assertEqual([ngrams.ngram_order(k) for k in keys], [len(ngrams.unpack(k)) for k in keys])
+            short_keys = [k for k in keys if k < ngrams.MAX_SHORT_KEY]
+            self.assertEqual(list(ngrams.ngram_orders(short_keys)), [len(ngrams.unpack(k)) for k in short_keys])
+            self.assertEqual(ngrams.pack(['w39999', 'w0']), [k for k in keys if ngrams.unpack(k) == ('w39999', 'w0')][0])
+            self.assertEqual(ngrams.encode(1 << 31), (((ngrams.MORE | 2) << 32) | (ngrams.MORE << 16), 48))
+        finally:
+            ngrams.vocabulary = saved
+
+    def test_large_vocabulary(self):
+        # more distinct tokens than fit in 16 bits
+        num_images = 14000
+        gts, res = {}, {}
+        for i in xrange(num_images):
+            words = ['tok%d_%d' % (i, j) for j in xrange(5)]
+            gts[i] = [' '.join(words)]
+            res[i] = [' '.join(words)]
+        self.assertGreater(len(ngrams.vocabulary.tokens) + 5 * num_images, 65535)
+        bleu, _ = Bleu(4).compute_score(gts, res)
+        for score in bleu:
+            self.assertAlmostEqual(score, 1.0)
+        cider, _ = Cider().compute_score(gts, res)
+        self.assertGreater(cider, 0)
+        self.assertGreater(len(ngrams.vocabulary.tokens), 65535)
+
+if __name__ == '__main__':
+    unittest.main()
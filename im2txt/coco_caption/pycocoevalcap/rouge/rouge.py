@@ -33,6 +33,36 @@ def my_lcs(string, sub):
 
     return lengths[len(string)][len(sub)]
 
+def lcs_masks(tokens):
+    """
+    Match masks of a tokenized string for bit_lcs: bit i of masks[w] is set
+    when tokens[i] == w
+    :param tokens : list of str : tokens from a string split using whitespace
+    :returns: masks (dict) : token -> int bit mask
+    """
+    masks = {}
+    for i, token in enumerate(tokens):
+        masks[token] = masks.get(token, 0) | (1 << i)
+    return masks
+
+def bit_lcs(masks, length, other):
+    """
+    Bit-parallel longest common subsequence (Hyyro 2004): the dynamic
+    programming table of my_lcs is kept one row at a time, as the bits of a
+    single integer, so each token of `other` costs a few integer operations
+    instead of a python loop over the first string.
+    :param masks : dict : lcs_masks() of the first tokenized string
+    :param length : int : number of tokens of the first string
+    :param other : list of str : second tokenized string
+    :returns: length (int): length of the longest common subsequence, the same as my_lcs
+    """
+    full = (1 << length) - 1
+    v = full
+    for token in other:
+        u = v & masks.get(token, 0)
+        v = ((v + u) | (v - u)) & full
+    return length - bin(v).count('1')
+
 class Rouge():
     '''
     Class for computing ROUGE-L score for a set of candidate sentences for the MS COCO test set
@@ -74,6 +104,35 @@ class Rouge():
             score = 0.0
         return score
 
+    def calc_scores(self, candidates, refs):
+        """
+        Batched calc_score using the bit-parallel LCS: every candidate's match
+        masks are built once and reused for all of its references
+        :param candidates: list of str : one candidate sentence per image
+        :param refs: list of list of str : reference sentences of each image
+        :returns scores: list of float (ROUGE-L score of every candidate, the same as calc_score)
+        """
+        scores = []
+        for candidate, image_refs in zip(candidates, refs):
+            assert(len(image_refs)>0)
+            token_c = candidate.split(" ")
+            masks = lcs_masks(token_c)
+
+            prec_max = 0.0
+            rec_max = 0.0
+            for reference in image_refs:
+                token_r = reference.split(" ")
+                lcs = bit_lcs(masks, len(token_c), token_r)
+                prec_max = max(prec_max, lcs/float(len(token_c)))
+                rec_max = max(rec_max, lcs/float(len(token_r)))
+
+            if(prec_max!=0 and rec_max !=0):
+                score = ((1 + self.beta**2)*prec_max*rec_max)/float(rec_max + self.beta**2*prec_max)
+            else:
+                score = 0.0
+            scores.append(score)
+        return scores
+
     def compute_score(self, gts, res):
         """
         Computes Rouge-L score given a set of reference and candidate sentences for the dataset
@@ -85,19 +144,18 @@ class Rouge():
         assert(gts.keys() == res.keys())
         imgIds = gts.keys()
 
-        score = []
         for id in imgIds:
             hypo = res[id]
             ref  = gts[id]
 
-            score.append(self.calc_score(hypo, ref))
-
             # Sanity check.
             assert(type(hypo) is list)
             assert(len(hypo) == 1)
             assert(type(ref) is list)
             assert(len(ref) > 0)
 
+        score = self.calc_scores([res[id][0] for id in imgIds], [gts[id] for id in imgIds])
+
         average_score = np.mean(np.array(score))
         return average_score, np.array(score)
 
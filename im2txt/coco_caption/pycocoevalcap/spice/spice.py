@@ -7,17 +7,37 @@ import json
 import numpy as np
 import ast
 import tempfile
+import multiprocessing
+import time
 
 # Assumes spice.jar is in the same directory as spice.py.  Change as needed.
 SPICE_JAR = 'spice-1.0.jar'
 TEMP_DIR = 'tmp'
 CACHE_DIR = 'cache'
 
+# java heap of a single SPICE process, and of each process in sharded mode
+SPICE_MEMORY = '8G'
+SHARD_MEMORY = '4G'
+# seconds between checks of the running shards
+POLL_INTERVAL = 0.5
+
 class Spice:
     """
     Main Class to compute the SPICE metric 
     """
 
+    def __init__(self, shards=1, memory=None):
+        # shards > 1 splits the images into that many chunks, scored by as
+        # many SPICE processes at once; they share the parse cache in
+        # CACHE_DIR (an LMDB database, safe to use from several processes)
+        # and split the cores between them. memory is the java heap of each
+        # process, so at most shards * memory is used in total.
+        assert shards > 0, "SPICE needs at least one shard"
+        self.shards = shards
+        if memory is None:
+          memory = SPICE_MEMORY if shards == 1 else SHARD_MEMORY
+        self.memory = memory
+
     def float_convert(self, obj):
         try:
           return float(obj)
@@ -50,30 +70,72 @@ class Spice:
         temp_dir=os.path.join(cwd, TEMP_DIR)
         if not os.path.exists(temp_dir):
           os.makedirs(temp_dir)
-        in_file = tempfile.NamedTemporaryFile(delete=False, dir=temp_dir)
-        json.dump(input_data, in_file, indent=2)
-        in_file.close()
-
-        # Start job
-        out_file = tempfile.NamedTemporaryFile(delete=False, dir=temp_dir)
-        out_file.close()
         cache_dir=os.path.join(cwd, CACHE_DIR)
         if not os.path.exists(cache_dir):
           os.makedirs(cache_dir)
-        spice_cmd = ['java', '-jar', '-Xmx8G', SPICE_JAR, in_file.name,
-          '-cache', cache_dir,
-          '-out', out_file.name,
-          '-subset',
-          '-silent'
-        ]
-        subprocess.check_call(spice_cmd, 
-            cwd=os.path.dirname(os.path.abspath(__file__)))
-
-        # Read and process results
-        with open(out_file.name) as data_file:    
-          results = json.load(data_file)
-        os.remove(in_file.name)
-        os.remove(out_file.name)
+
+        # contiguous chunks of images, one input file per SPICE process
+        num_shards = max(1, min(self.shards, len(input_data)))
+        bounds = [len(input_data) * i // num_shards for i in range(num_shards + 1)]
+        in_files = []
+        out_files = []
+        procs = []
+        try:
+          for i in range(num_shards):
+            in_file = tempfile.NamedTemporaryFile(delete=False, dir=temp_dir)
+            in_files.append(in_file.name)
+            json.dump(input_data[bounds[i]:bounds[i+1]], in_file, indent=2)
+            in_file.close()
+            out_file = tempfile.NamedTemporaryFile(delete=False, dir=temp_dir)
+            out_files.append(out_file.name)
+            out_file.close()
+
+          # Start jobs
+          spice_cmds = []
+          for in_name, out_name in zip(in_files, out_files):
+            spice_cmd = ['java', '-jar', '-Xmx' + self.memory, SPICE_JAR, in_name,
+              '-cache', cache_dir,
+              '-out', out_name,
+              '-subset',
+              '-silent'
+            ]
+            if num_shards > 1:
+              spice_cmd += ['-threads', str(max(1, multiprocessing.cpu_count() // num_shards))]
+            spice_cmds.append(spice_cmd)
+          if num_shards == 1:
+            subprocess.check_call(spice_cmds[0], cwd=cwd)
+          else:
+            for spice_cmd in spice_cmds:
+              procs.append(subprocess.Popen(spice_cmd, cwd=cwd))
+            # poll every shard, so the first one to fail is reported (and the
+            # others killed below) without waiting for the ones before it
+            running = list(zip(spice_cmds, procs))
+            while running:
+              for spice_cmd, proc in list(running):
+                returncode = proc.poll()
+                if returncode is None:
+                  continue
+                if returncode != 0:
+                  raise subprocess.CalledProcessError(returncode, spice_cmd)
+                running.remove((spice_cmd, proc))
+              if running:
+                time.sleep(POLL_INTERVAL)
+
+          # Read and merge the results of every shard
+          results = []
+          for out_name in out_files:
+            with open(out_name) as data_file:
+              results.extend(json.load(data_file))
+        finally:
+          # on an error (or an interrupt) stop the shards still running, and
+          # never leave input or output files behind
+          for proc in procs:
+            if proc.poll() is None:
+              proc.kill()
+              proc.wait()
+          for name in in_files + out_files:
+            if os.path.exists(name):
+              os.remove(name)
 
         imgId_to_scores = {}
         spice_scores = []
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#
+# File Name : ptbregex.py
+#
+# Description : In-process, regex based approximation of Stanford PTBTokenizer
+#               run with -preserveLines -lowerCase, so that BLEU, ROUGE and
+#               CIDEr can be computed without launching java.
+#
+# It reproduces the PTBTokenizer behaviour that matters for caption text:
+# punctuation is split off words, contractions and possessives are split the
+# PTB way (do n't, ca n't, user 's), brackets become -LRB- style tokens and
+# double quotes become `` and ''. Like PTBTokenizer -lowerCase, every token
+# (including the bracket tokens) is lowercased afterwards. Run
+# ../../ptb_parity.py to check it against the java tokenizer on our data.
+
+import re
+
+# SGML style tags such as <UNK> are kept as a single token
+_SGML = r'</?[A-Za-z!?][^<>\s]*>'
+_URL = r'(?:https?|ftp)://[^\s"<>]+|www\.[^\s"<>]+'
+_EMAIL = r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+'
+# multi-letter abbreviations such as e.g. or u.s.a.
+_ACRONYM = r'(?:[A-Za-z]\.){2,}'
+# a small set of abbreviations PTBTokenizer keeps their period on
+_ABBREV = r'(?:[Mm]rs?|[Mm]s|[Dd]r|[Pp]rof|[Jj]r|[Ss]r|[Ss]t|[Vv]s|[Ee]tc|[Ii]nc|[Ll]td|[Cc]orp)\.'
+# numbers with decimal points, thousands separators, times and fractions;
+# plain digit runs (and things like 3d or 11pm) are matched as words
+_NUMBER = r'\d+(?:[.,:/]\d+)+'
+# words, possibly joined with hyphens, underscores or slashes (e-mail, n/a)
+_WORD = r"[A-Za-z0-9]+(?:['&][A-Za-z0-9]+)*(?:[-_/][A-Za-z0-9]+(?:'[A-Za-z0-9]+)*)*"
+_PUNCT = r'\.\.\.|--|``|\'\'|[^\sA-Za-z0-9]'
+
+_TOKEN_RE = re.compile('|'.join([_SGML, _URL, _EMAIL, _ACRONYM, _ABBREV, _NUMBER, _WORD, _PUNCT]))
+
+# PTB splits these clitics off the end of a word
+_CLITIC_RE = re.compile(r"^(.+?)(n't|'s|'re|'ve|'ll|'d|'m)$", re.IGNORECASE)
+
+# words PTB splits in a non-obvious place
+_SPECIAL_SPLITS = {
+    "can't": ['ca', "n't"],
+    "won't": ['wo', "n't"],
+    "cannot": ['can', 'not'],
+    "gonna": ['gon', 'na'],
+    "gotta": ['got', 'ta'],
+    "wanna": ['wan', 'na'],
+}
+
+_BRACKETS = {
+    '(': '-LRB-', ')': '-RRB-',
+    '[': '-LSB-', ']': '-RSB-',
+    '{': '-LCB-', '}': '-RCB-',
+}
+
+_OPENING_CONTEXT = set(['', '(', '[', '{', '<', '-', '--'])
+
+def _split_word(word):
+    lowered = word.lower()
+    if lowered in _SPECIAL_SPLITS:
+        parts = _SPECIAL_SPLITS[lowered]
+        # keep the original casing of the first part
+        return [word[:len(parts[0])], word[len(parts[0]):]]
+    # o'clock style words are left alone; only known clitics are split off
+    m = _CLITIC_RE.match(word)
+    if m is not None:
+        return [m.group(1), m.group(2)]
+    return [word]
+
+def tokenize_line(line):
+    """Tokenizes a single sentence the way PTBTokenizer -preserveLines
+    -lowerCase does, returning its tokens joined by single spaces."""
+    tokens = []
+    previous = ''
+    for m in _TOKEN_RE.finditer(line):
+        tok = m.group(0)
+        # whether the token is preceded by whitespace (or starts the line)
+        spaced = m.start() == 0 or line[m.start() - 1].isspace()
+        if tok in _BRACKETS:
+            tok = _BRACKETS[tok]
+        elif tok == '"':
+            tok = '``' if spaced or previous in _OPENING_CONTEXT else "''"
+        elif tok == "'":
+            # an apostrophe opening a quotation becomes `; after a word it
+            # stays a plural possessive (users ')
+            opens = spaced and m.end() < len(line) and not line[m.end()].isspace()
+            tok = '`' if opens else "'"
+        elif tok[0].isalnum():
+            parts = _split_word(tok)
+            tokens.extend(parts[:-1])
+            tok = parts[-1]
+        tokens.append(tok)
+        previous = tok
+    return ' '.join(tokens).lower()
+
+def tokenize_lines(lines):
+    """Tokenizes a list of single-line sentences, one output line per input."""
+    return [tokenize_line(line) for line in lines]
@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-# 
+#
 # File Name : ptbtokenizer.py
 #
 # Description : Do the PTB Tokenization and remove punctuations.
@@ -13,28 +13,217 @@ import sys
 import subprocess
 import tempfile
 import itertools
+import threading
+import ptbregex
+import tokencache
 
 # path to the stanford corenlp jar
 STANFORD_CORENLP_3_4_1_JAR = 'stanford-corenlp-3.4.1.jar'
 
 # punctuations to be removed from the sentences
 PUNCTUATIONS = ["''", "'", "``", "`", "-LRB-", "-RRB-", "-LCB-", "-RCB-", \
-        ".", "?", "!", ",", ":", "-", "--", "...", ";"] 
+        ".", "?", "!", ",", ":", "-", "--", "...", ";"]
 
-class PTBTokenizer:
-    """Python wrapper of Stanford PTBTokenizer"""
+# marker lines framing each batch sent to a PTBTokenizerServer; they survive
+# PTB tokenization and lowercasing unchanged
+BATCH_START = 'xxptbbatchstartxx'
+BATCH_END = 'xxptbbatchendxx'
 
-    def tokenize(self, captions_for_image):
-        cmd = ['java', '-cp', STANFORD_CORENLP_3_4_1_JAR, \
+# PTBTokenizer never flushes stdout on its own, so every batch is followed by
+# enough filler lines to push the end marker through the JVM's output buffers
+PAD_LINE = 'xxptbpadxx'
+PAD_LINES = 2048
+
+# the server entered most recently with a `with` block; PTBTokenizer instances
+# created without an explicit server use it instead of launching java
+_active_server = None
+
+class PTBTokenizerServer:
+    """One long-lived Stanford PTBTokenizer JVM that tokenizes batches of
+    lines over stdin/stdout, shared by every PTBTokenizer.tokenize() call
+    made inside its `with` block:
+
+        with PTBTokenizerServer():
+            for ...:
+                cocoEval.evaluate()
+
+    The JVM is restarted if it dies or returns a short batch."""
+
+    def __init__(self):
+        self.cmd = ['java', '-cp', STANFORD_CORENLP_3_4_1_JAR, \
                 'edu.stanford.nlp.process.PTBTokenizer', \
                 '-preserveLines', '-lowerCase']
+        self.p_tokenizer = None
+        self._previous_server = None
+        # Used to guarantee thread safety
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.p_tokenizer is not None and self.p_tokenizer.poll() is None:
+            return
+        self.p_tokenizer = subprocess.Popen(self.cmd, \
+                cwd=os.path.dirname(os.path.abspath(__file__)), \
+                stdin=subprocess.PIPE, \
+                stdout=subprocess.PIPE)
+
+    def close(self):
+        if self.p_tokenizer is None:
+            return
+        try:
+            self.p_tokenizer.stdin.close()
+        except IOError:
+            pass
+        self.p_tokenizer.kill()
+        self.p_tokenizer.wait()
+        self.p_tokenizer = None
+
+    def __enter__(self):
+        # the JVM itself is only launched by the first batch
+        global _active_server
+        self._previous_server = _active_server
+        _active_server = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active_server
+        _active_server = self._previous_server
+        self.close()
+        return False
 
+    def tokenize_lines(self, lines):
+        """Tokenizes a list of single-line sentences, returning one
+        space separated, lowercased line of tokens per sentence."""
+        self.lock.acquire()
+        try:
+            try:
+                return self._run_batch(lines)
+            except IOError:
+                # the JVM died or got out of sync; start a fresh one and retry once
+                self.close()
+                return self._run_batch(lines)
+        finally:
+            self.lock.release()
+
+    def _run_batch(self, lines):
+        self.start()
+        payload = '\n'.join([BATCH_START] + lines + [BATCH_END] + [PAD_LINE] * PAD_LINES) + '\n'
+        if not isinstance(payload, str):
+            payload = payload.encode('utf-8')
+
+        # write from a second thread so a large batch cannot deadlock against
+        # the JVM blocking on a full stdout pipe
+        def write_payload():
+            try:
+                self.p_tokenizer.stdin.write(payload)
+                self.p_tokenizer.stdin.flush()
+            except IOError:
+                pass
+        writer = threading.Thread(target=write_payload)
+        writer.start()
+
+        try:
+            # skip whatever padding is left over from the previous batch
+            line = self._readline()
+            while line != BATCH_START:
+                line = self._readline()
+
+            token_lines = []
+            line = self._readline()
+            while line != BATCH_END:
+                token_lines.append(line)
+                line = self._readline()
+        finally:
+            writer.join()
+
+        if len(token_lines) != len(lines):
+            raise IOError('PTBTokenizer returned %d lines for a batch of %d' % (len(token_lines), len(lines)))
+        return token_lines
+
+    def _readline(self):
+        line = self.p_tokenizer.stdout.readline()
+        if not line:
+            raise IOError('PTBTokenizer process exited')
+        return line.rstrip('\n')
+
+    def __del__(self):
+        self.close()
+
+class PTBTokenizer:
+    """Python wrapper of Stanford PTBTokenizer"""
+
+    def __init__(self, server=None, backend='java', cache=True):
+        # PTBTokenizerServer to send sentences to; when None, the active
+        # server (if any) is used, otherwise java is launched for each call
+        self.server = server
+        # 'java' runs Stanford PTBTokenizer, 'python' uses the in-process
+        # regex reimplementation in ptbregex.py (no java needed)
+        assert backend in ('java', 'python'), "unsupported tokenizer backend %s" % backend
+        self.backend = backend
+        # tokencache.TokenizationCache consulted before any java tokenization;
+        # True uses the shared default cache file, None disables caching.
+        # The python backend is cheaper than a cache lookup and never caches.
+        if backend != 'java':
+            cache = None
+        elif cache is True:
+            cache = tokencache.get_cache()
+        self.cache = cache
+
+    def cache_namespace(self):
+        # cached lines are only valid for the jar that produced them
+        return 'java:' + STANFORD_CORENLP_3_4_1_JAR
+
+    def tokenize(self, captions_for_image):
         # ======================================================
         # prepare data for PTB Tokenizer
         # ======================================================
         final_tokenized_captions_for_image = {}
         image_id = [k for k, v in captions_for_image.items() for _ in range(len(v))]
-        sentences = '\n'.join([c['caption'].replace('\n', ' ') for k, v in captions_for_image.items() for c in v])
+        captions = [c['caption'].replace('\n', ' ') for k, v in captions_for_image.items() for c in v]
+
+        if self.cache is not None:
+            lines = self.cache.get_many(self.cache_namespace(), captions)
+        else:
+            lines = [None] * len(captions)
+
+        # tokenize each caption that is not cached exactly once
+        missing = sorted(set([c for c, l in zip(captions, lines) if l is None]))
+        if len(missing) != 0:
+            tokenized = dict(zip(missing, self._tokenize_lines(missing)))
+            lines = [tokenized[c] if l is None else l for c, l in zip(captions, lines)]
+            if self.cache is not None:
+                self.cache.put_many(self.cache_namespace(), missing, [tokenized[c] for c in missing])
+
+        if self.cache is not None and str is bytes:
+            # cached lines come back as unicode; hand them out as the utf-8
+            # str the JVM writes, so the output is the same with or without
+            # the cache
+            lines = [l if isinstance(l, bytes) else l.encode('utf-8') for l in lines]
+
+        # ======================================================
+        # create dictionary for tokenized captions
+        # ======================================================
+        for k, line in zip(image_id, lines):
+            if not k in final_tokenized_captions_for_image:
+                final_tokenized_captions_for_image[k] = []
+            tokenized_caption = ' '.join([w for w in line.rstrip().split(' ') \
+                    if w not in PUNCTUATIONS])
+            final_tokenized_captions_for_image[k].append(tokenized_caption)
+
+        return final_tokenized_captions_for_image
+
+    def _tokenize_lines(self, captions):
+        server = self.server if self.server is not None else _active_server
+        if self.backend == 'python':
+            return ptbregex.tokenize_lines(captions)
+        elif server is not None:
+            return server.tokenize_lines(captions)
+        else:
+            return self._tokenize_subprocess('\n'.join(captions))
+
+    def _tokenize_subprocess(self, sentences):
+        cmd = ['java', '-cp', STANFORD_CORENLP_3_4_1_JAR, \
+                'edu.stanford.nlp.process.PTBTokenizer', \
+                '-preserveLines', '-lowerCase']
 
         # ======================================================
         # save sentences to temporary file
@@ -55,14 +244,4 @@ class PTBTokenizer:
         # remove temp file
         os.remove(tmp_file.name)
 
-        # ======================================================
-        # create dictionary for tokenized captions
-        # ======================================================
-        for k, line in zip(image_id, lines):
-            if not k in final_tokenized_captions_for_image:
-                final_tokenized_captions_for_image[k] = []
-            tokenized_caption = ' '.join([w for w in line.rstrip().split(' ') \
-                    if w not in PUNCTUATIONS])
-            final_tokenized_captions_for_image[k].append(tokenized_caption)
-
-        return final_tokenized_captions_for_image
+        return lines
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+# File Name : tokencache.py
+#
+# Description : Persistent, content-addressed cache of tokenizer output.
+#               Ground truth captions and beam outputs repeat across every
+#               prediction file and checkpoint of a sweep, so PTBTokenizer
+#               looks every caption up here first and only tokenizes strings
+#               it has never seen before.
+
+import os
+import hashlib
+import sqlite3
+import threading
+
+# default cache file, next to coco_caption/ground_truth
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+        '..', '..', 'tokenization-cache.sqlite')
+
+# sqlite limits the number of bound parameters per statement
+_LOOKUP_CHUNK = 500
+
+def _to_unicode(s):
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+    return s
+
+def cache_key(namespace, caption):
+    """Content address of a caption: sha1 of the tokenizer namespace and the
+    caption text, so the same string tokenized by a different backend (or a
+    different tokenizer version) never collides."""
+    data = (_to_unicode(namespace) + u'\0' + _to_unicode(caption)).encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+class TokenizationCache:
+    """sqlite backed map from cache_key(namespace, caption) to the raw
+    tokenizer output line for that caption. Safe to share between threads;
+    separate processes may share the same file."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, line TEXT NOT NULL)')
+        self.conn.commit()
+
+    def get_many(self, namespace, captions):
+        """Returns a list with the cached line for each caption, or None where
+        the caption has not been tokenized before."""
+        keys = [cache_key(namespace, c) for c in captions]
+        found = {}
+        self.lock.acquire()
+        try:
+            for start in range(0, len(keys), _LOOKUP_CHUNK):
+                chunk = keys[start:start+_LOOKUP_CHUNK]
+                rows = self.conn.execute('SELECT key, line FROM tokens WHERE key IN (%s)' % \
+                        ','.join(['?'] * len(chunk)), chunk)
+                for key, line in rows:
+                    found[key] = line
+            lines = [found.get(key) for key in keys]
+            hits = len([l for l in lines if l is not None])
+            self.hits += hits
+            self.misses += len(lines) - hits
+        finally:
+            self.lock.release()
+        return lines
+
+    def put_many(self, namespace, captions, lines):
+        rows = [(cache_key(namespace, c), _to_unicode(l)) for c, l in zip(captions, lines)]
+        self.lock.acquire()
+        try:
+            self.conn.executemany('INSERT OR REPLACE INTO tokens (key, line) VALUES (?, ?)', rows)
+            self.conn.commit()
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        return 'tokenization cache %s: %d hits, %d misses' % (self.path, self.hits, self.misses)
+
+    def close(self):
+        self.conn.close()
+
+# caches opened through get_cache(), one per path and process (an sqlite
+# connection must not be used on both sides of a fork), shared by every
+# PTBTokenizer
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache(path=DEFAULT_CACHE_PATH):
+    key = (os.getpid(), os.path.abspath(path))
+    _caches_lock.acquire()
+    try:
+        if key not in _caches:
+            _caches[key] = TokenizationCache(key[1])
+        return _caches[key]
+    finally:
+        _caches_lock.release()
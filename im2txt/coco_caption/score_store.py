@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+#
+# File Name : score_store.py
+#
+# Description : Columnar store of the per-caption scores of a sweep, written by
+#               eval-bleu-im2txt.py and eval-bleu-ntk2.py as scores.npz in
+#               their scores directory. It replaces the json the eval scripts
+#               wrote per prediction file (captions plus nested per-beam score
+#               dicts): every caption is one row of
+#
+#                   file_id, checkpoint, split, image_id, beam, caption_id,
+#                   Bleu_1, Bleu_2, Bleu_3, Bleu_4, METEOR, CIDEr
+#
+#               with NaN for metrics that were not computed (or captions that
+#               were not scored), and the file names and caption texts kept
+#               once in their own tables. The query methods answer the
+#               questions choose-best-bleu.py, survey.py and
+#               inferences-to-vis.py ask with numpy reductions over the
+#               columns; build_score_store.py converts existing score jsons.
+#
+# Works with python 2 and 3 (neuraltalk2/coco_caption links to this directory).
+
+import os
+import io
+import json
+import threading
+import numpy as np
+
+# bump whenever the layout of the store changes
+STORE_VERSION = 1
+
+# name of the store in a scores directory
+STORE_NAME = 'scores.npz'
+
+METRICS = ['Bleu_1', 'Bleu_2', 'Bleu_3', 'Bleu_4', 'METEOR', 'CIDEr']
+BLEU_METRICS = METRICS[:4]
+
+def parse_preds_name(preds_file):
+    """(checkpoint, split) of a preds_<id>_<split>_<ckpt>_<digest>.json or
+    scores_... file name; the id may contain underscores (neuraltalk2)."""
+    parts = os.path.splitext(os.path.basename(preds_file))[0].split('_')
+    split = 'test' if 'test' in parts[:-2] else 'val'
+    return int(parts[-2]), split
+
+def entry_rows(entries, id_key='image_id'):
+    """
+    Flattens the scored entries of one prediction file (the list the eval
+    scripts used to dump as json) into columns.
+    :param entries: list of dict : {id_key: .., "captions": [..], "scores": [{"Bleu_1": ..}, ..]}
+    :param id_key: string : key of the image identifier ("screenshot" for neuraltalk2)
+    :return: columns (dict) : image_id, beam, caption and one list per metric
+    """
+    rows = dict((name, []) for name in ['image_id', 'beam', 'caption'] + METRICS)
+    for entry in entries:
+        scores = entry['scores']
+        for beam, caption in enumerate(entry['captions']):
+            # empty captions and images without ground truths have {} (or a
+            # stray list of them) instead of a dict of scores
+            caption_scores = scores[beam] if beam < len(scores) else {}
+            if not isinstance(caption_scores, dict):
+                caption_scores = {}
+            rows['image_id'].append(entry[id_key])
+            rows['beam'].append(beam)
+            rows['caption'].append(caption)
+            for metric in METRICS:
+                rows[metric].append(caption_scores.get(metric, np.nan))
+    return rows
+
+class ScoreStore:
+    """Scores of every caption of a set of prediction files.
+
+        store = ScoreStore.load(os.path.join(SCORES_DIR, STORE_NAME))
+        checkpoint = store.best_checkpoint(split='test')
+        captions = store.best_captions(checkpoint)
+
+    Files are added whole with add_file() (safe from several threads) and
+    written with save(); the queries assume one prediction file per
+    (checkpoint, split), which is how the sweeps name them."""
+
+    def __init__(self, id_key='image_id'):
+        self.id_key = id_key
+        self.lock = threading.Lock()
+        # parts added since the columns were last concatenated
+        self._parts = []
+        self._columns = None
+
+    @staticmethod
+    def load(path):
+        data = np.load(path)
+        try:
+            if int(data['version']) != STORE_VERSION:
+                raise ValueError('%s is a version %d score store, expected version %d' % \
+                        (path, int(data['version']), STORE_VERSION))
+            store = ScoreStore(id_key=str(data['id_key'].item()))
+            files = data['files']
+            captions = data['captions']
+            columns = {
+                'preds_file': files[data['file_id']],
+                'checkpoint': data['checkpoint'],
+                'split': data['split'],
+                'image_id': data['image_id'],
+                'beam': data['beam'],
+                'caption': captions[data['caption_id']],
+            }
+            for metric in METRICS:
+                columns[metric] = data[metric]
+        finally:
+            data.close()
+        store._columns = columns
+        return store
+
+    def save(self, path):
+        columns = self.columns()
+        files, file_id = np.unique(columns['preds_file'], return_inverse=True)
+        captions, caption_id = np.unique(columns['caption'], return_inverse=True)
+        arrays = {
+            'version': np.array(STORE_VERSION),
+            'id_key': np.array(self.id_key, dtype='U'),
+            'files': files,
+            'file_id': file_id.astype(np.int32),
+            'checkpoint': columns['checkpoint'],
+            'split': columns['split'],
+            'image_id': columns['image_id'],
+            'beam': columns['beam'],
+            'captions': captions,
+            'caption_id': caption_id.astype(np.int32),
+        }
+        for metric in METRICS:
+            arrays[metric] = columns[metric]
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        # rename so a reader never sees a half written store
+        os.rename(tmp_path, path)
+
+    def add_file(self, preds_file, checkpoint, split, entries):
+        """Adds the scored entries of one prediction file (see entry_rows)."""
+        rows = entry_rows(entries, self.id_key)
+        n = len(rows['beam'])
+        part = {
+            'preds_file': np.array([preds_file] * n, dtype='U'),
+            'checkpoint': np.full(n, checkpoint, dtype=np.int64),
+            'split': np.array([split] * n, dtype='U'),
+            'image_id': np.array(rows['image_id'], dtype='U'),
+            'beam': np.array(rows['beam'], dtype=np.int16),
+            'caption': np.array(rows['caption'], dtype='U'),
+        }
+        for metric in METRICS:
+            part[metric] = np.array(rows[metric], dtype=np.float64)
+        self.lock.acquire()
+        try:
+            self._parts.append(part)
+        finally:
+            self.lock.release()
+
+    def remove_files(self, preds_files):
+        """Drops every row of the given prediction files."""
+        columns = self.columns()
+        keep = ~np.isin(columns['preds_file'], np.array(list(preds_files), dtype='U'))
+        self.lock.acquire()
+        try:
+            self._columns = dict((name, column[keep]) for name, column in columns.items())
+        finally:
+            self.lock.release()
+
+    def columns(self):
+        """name -> numpy array of every column, one row per caption"""
+        self.lock.acquire()
+        try:
+            parts = self._parts
+            if self._columns is not None:
+                parts = [self._columns] + parts
+            if len(parts) == 0:
+                return self._empty_columns()
+            if len(parts) > 1 or self._columns is None:
+                self._columns = dict((name, np.concatenate([part[name] for part in parts])) \
+                        for name in parts[0])
+            self._parts = []
+            return self._columns
+        finally:
+            self.lock.release()
+
+    def _empty_columns(self):
+        columns = {'checkpoint': np.zeros(0, dtype=np.int64), 'beam': np.zeros(0, dtype=np.int16)}
+        for name in ['preds_file', 'split', 'image_id', 'caption']:
+            columns[name] = np.zeros(0, dtype='U')
+        for metric in METRICS:
+            columns[metric] = np.zeros(0, dtype=np.float64)
+        return columns
+
+    def __len__(self):
+        return len(self.columns()['beam'])
+
+    def files(self):
+        """names of the prediction files in the store"""
+        return sorted(set(self.columns()['preds_file'].tolist()))
+
+    def _select(self, checkpoint=None, split=None):
+        columns = self.columns()
+        mask = np.ones(len(columns['beam']), dtype=bool)
+        if checkpoint is not None:
+            mask &= columns['checkpoint'] == checkpoint
+        if split is not None:
+            mask &= columns['split'] == split
+        return mask
+
+    def checkpoint_means(self, metrics=BLEU_METRICS, split=None):
+        """
+        Average of every metric over the scored captions of each prediction
+        file, i.e. the rows of the csv the eval scripts write.
+        :return: list of (checkpoint, preds_file, [mean of each metric]), by checkpoint
+        """
+        columns = self.columns()
+        mask = self._select(split=split)
+        files, file_index = np.unique(columns['preds_file'][mask], return_inverse=True)
+        checkpoints = np.zeros(len(files), dtype=np.int64)
+        checkpoints[file_index] = columns['checkpoint'][mask]
+        means = []
+        for metric in metrics:
+            values = columns[metric][mask]
+            scored = ~np.isnan(values)
+            totals = np.bincount(file_index[scored], weights=values[scored], minlength=len(files))
+            counts = np.bincount(file_index[scored], minlength=len(files))
+            means.append(totals / np.maximum(counts, 1))
+        order = np.argsort(checkpoints, kind='mergesort')
+        return [(int(checkpoints[i]), files[i], [float(m[i]) for m in means]) for i in order]
+
+    def best_checkpoint(self, metrics=BLEU_METRICS, split=None):
+        """Checkpoint with the highest average of the per file metric means;
+        the lowest checkpoint wins ties (like choose-best-bleu.py)."""
+        means = self.checkpoint_means(metrics, split)
+        if len(means) == 0:
+            raise ValueError('no scored prediction files%s' % ('' if split is None else ' for split %s' % split))
+        # checkpoint_means is sorted by checkpoint and max keeps the first maximum
+        best = max(means, key=lambda row: sum(row[2]) / len(row[2]))
+        return best[0]
+
+    def _caption_scores(self, mask, metrics):
+        """average of the metrics of every selected row, 0 where unscored"""
+        columns = self.columns()
+        values = np.vstack([columns[metric][mask] for metric in metrics])
+        return np.nan_to_num(values).mean(axis=0)
+
+    def image_aggregates(self, checkpoint, metrics=BLEU_METRICS, how='max', split=None):
+        """
+        Per image aggregate over the beams of one checkpoint of the average
+        of metrics (unscored captions count as 0).
+        :param how: string : 'max' (best beam) or 'mean' (over all beams)
+        :return: dict : image id -> aggregate score
+        """
+        mask = self._select(checkpoint, split)
+        scores = self._caption_scores(mask, metrics)
+        image_ids, image_index = np.unique(self.columns()['image_id'][mask], return_inverse=True)
+        if how == 'max':
+            aggregates = np.full(len(image_ids), -np.inf)
+            np.maximum.at(aggregates, image_index, scores)
+        elif how == 'mean':
+            aggregates = np.bincount(image_index, weights=scores, minlength=len(image_ids)) / \
+                    np.bincount(image_index, minlength=len(image_ids))
+        else:
+            raise ValueError("unknown aggregate '%s'" % how)
+        return dict(zip(image_ids.tolist(), aggregates.tolist()))
+
+    def best_captions(self, checkpoint, metrics=BLEU_METRICS, split=None):
+        """
+        Caption of the best beam of every image of one checkpoint, by the
+        average of metrics: the first beam with the highest score, or ""
+        when no beam scores above 0 (the way survey.py picks them).
+        :return: dict : image id -> caption
+        """
+        mask = self._select(checkpoint, split)
+        columns = self.columns()
+        scores = self._caption_scores(mask, metrics)
+        image_ids = columns['image_id'][mask]
+        beams = columns['beam'][mask]
+        captions = columns['caption'][mask]
+        # best score first, then the lowest beam; the first row of every image wins
+        order = np.lexsort((beams, -scores, image_ids))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = image_ids[order][1:] != image_ids[order][:-1]
+        best = {}
+        for i in order[first]:
+            best[image_ids[i]] = captions[i] if scores[i] > 0 else u''
+        return best
+
+    def entries(self, checkpoint, split=None):
+        """The scored entries of one checkpoint in the layout of the old per
+        file score jsons, for code that still walks those."""
+        mask = self._select(checkpoint, split)
+        columns = self.columns()
+        entries = []
+        for i in np.nonzero(mask)[0]:
+            if columns['beam'][i] == 0:
+                entries.append({self.id_key: columns['image_id'][i], 'captions': [], 'scores': []})
+            entry = entries[-1]
+            entry['captions'].append(columns['caption'][i])
+            entry['scores'].append(dict((metric, float(columns[metric][i])) for metric in METRICS \
+                    if not np.isnan(columns[metric][i])))
+        return entries
+
+def load_entries(path, checkpoint=None):
+    """Scored entries from either a score json or a score store; for a store
+    the entries of checkpoint (by default its best checkpoint)."""
+    if path.endswith('.npz'):
+        store = ScoreStore.load(path)
+        if checkpoint is None:
+            checkpoint = store.best_checkpoint()
+        return store.entries(checkpoint)
+    with io.open(path, encoding='utf-8') as f:
+        return json.load(f)
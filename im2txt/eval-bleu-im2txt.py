@@ -4,6 +4,8 @@ import sys
 import time
 import os
 import io
+import hashlib
+import threading
 sys.path.append('./coco_caption')
 sys.path.append('./coco_caption/pycocotools')
 sys.path.append('./coco_caption/pycocoevalcap')
@@ -16,6 +18,11 @@ sys.path.append('./coco_caption/pycocoevalcap/tokenizer')
 
 from pycocotools.coco import COCO
 from pycocoevalcap.eval import COCOEvalCap
+from pycocoevalcap.tokenizer.ptbtokenizer import PTBTokenizer, PTBTokenizerServer
+from pycocoevalcap.tokenizer import tokencache
+from pycocoevalcap.bleu.bleu import Bleu
+from pycocoevalcap.bleu.ref_index import get_ref_index
+from score_store import ScoreStore, STORE_NAME
 from multiprocessing.dummy import Pool as ThreadPool 
 #import matplotlib.pyplot as plt
 #import skimage.io as io
@@ -38,6 +45,47 @@ def sort_by_ckpt_num(elem):
 def avg(l):
     return float(sum(l))/len(l)
 
+# sha1 of a file's contents, read in chunks so big prediction files are fine
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+# the score cache index lives in the scores directory and maps the cache key
+# of every scored prediction file to its csv row (its scores are in the score
+# store, see coco_caption/score_store.py); the key is
+# "<prediction sha1>:<ground truth sha1>:<metric set>:<file name>" (the name
+# is part of the key because it is part of the csv row), so a prediction file
+# is only scored again when its contents, the ground truths or the way it is
+# scored change
+SCORE_CACHE_INDEX = "score-cache-index.json"
+
+# bump whenever the scores written for a prediction file change
+SCORE_CACHE_VERSION = 2
+
+def score_cache_key(pred_path, gt_sha1, metric_set):
+    return "%s:%s:%s:%s"%(file_sha1(pred_path), gt_sha1, metric_set, os.path.basename(pred_path))
+
+# returns the cached entries of the index at path, or {} if it is missing or
+# was written by another version
+def load_score_cache(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("version") != SCORE_CACHE_VERSION:
+        return {}
+    return data["entries"]
+
+def save_score_cache(path, entries):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": SCORE_CACHE_VERSION, "entries": entries}, f, sort_keys=True, indent=1)
+    # rename so an interrupted run never leaves a half written index behind
+    os.rename(tmp_path, path)
+
 '''
 # dictionary of ground truths
 gts = {
@@ -175,6 +223,9 @@ def get_bleu_scores(caption, image_id, gts_by_id):
 
     # create cocoEval object by taking coco and cocoRes
     cocoEval = COCOEvalCap(coco, cocoRes)
+    cocoEval.params['tokenizer'] = tokenizer_backend
+    # only BLEU is kept, so leave CIDEr out
+    cocoEval.params['metrics'] = ['Bleu']
 
     # evaluate on a subset of images by setting
     # cocoEval.params['image_id'] = cocoRes.getImgIds()
@@ -214,6 +265,66 @@ def get_bleu_scores(caption, image_id, gts_by_id):
     return bleu_1, bleu_2, bleu_3, bleu_4
     
 
+# batched counterpart of get_bleu_scores; scores every caption of a whole
+# prediction file with one tokenizer launch and one BleuScorer instead of
+# building a fake COCO dataset (and launching java) for every single caption
+# all_preds is the loaded prediction json and ref_index maps each image id
+# to its precooked ground truth references (see bleu/ref_index.py)
+# returns (scores, corpus_bleu) where scores[i] is the list of per-caption
+# {"Bleu_1":..,"Bleu_4":..} dicts for all_preds[i] ({} for empty captions),
+# or None if the image has no ground truths, and corpus_bleu is the
+# corpus-level [bleu_1, bleu_2, bleu_3, bleu_4] over every scored caption
+def get_bleu_scores_batch(all_preds, ref_index):
+    
+    # keyed by the index of the entry in all_preds rather than by image id
+    # so that repeated image ids in a prediction file are still scored separately
+    res = {}
+    
+    for i in range(len(all_preds)):
+        entry = all_preds[i]
+        
+        if entry["image_id"] not in ref_index:
+            continue
+        
+        # dont evaluate bleu scores on an empty string
+        non_empty = [{"caption": cap} for cap in entry["captions"] if cap != ""]
+        
+        if len(non_empty) != 0:
+            res[i] = non_empty
+    
+    scores = [None for _ in all_preds]
+    
+    if len(res) == 0:
+        return scores, [0.0, 0.0, 0.0, 0.0]
+    
+    # a single tokenizer run for every caption in the file
+    tokenized_res = PTBTokenizer(backend=tokenizer_backend).tokenize(res)
+    
+    gts = {}
+    for i in tokenized_res:
+        gts[i] = ref_index[all_preds[i]["image_id"]]
+    
+    corpus_bleu, caption_scores = Bleu(4).compute_caption_scores(gts, tokenized_res)
+    
+    for i in range(len(all_preds)):
+        
+        if all_preds[i]["image_id"] not in ref_index:
+            continue
+        
+        # walk the captions in order, handing out scores to the non-empty ones
+        image_scores = iter(caption_scores.get(i, []))
+        scores[i] = []
+        
+        for cap in all_preds[i]["captions"]:
+            if cap != "":
+                bleu_1, bleu_2, bleu_3, bleu_4 = next(image_scores)
+                scores[i].append({"Bleu_1":bleu_1,"Bleu_2":bleu_2,"Bleu_3":bleu_3,"Bleu_4":bleu_4})
+            else:
+                scores[i].append({})
+    
+    return scores, corpus_bleu
+
+
 
 # set up file names and paths
 
@@ -223,8 +334,13 @@ if len(sys.argv) < 4:
     print("\nNOTE: this must be run within an im2txt directory with the coco_caption code on a machine")
     print("that can run coco_caption, otherwise bleu scores will not be possible")
     print("\nNOTE 2: The files in the input prediction directory must have the .json extension to be recognized.")
-    print("\nNOTE 3: This script outputs one json file for each prediction json it reads in. The output file is identical to the prediction file except it has a list of 3 sets of Bleu scores in the same JSON object as the list of 3 captions (per image)") 
+    print("\nNOTE 3: This script writes the score of every caption of every prediction json into one score store, %s in the scores directory (see coco_caption/score_store.py), plus a csv of the average scores of each prediction json"%STORE_NAME)
     print("\nusage: python2 " + __file__ + " <directory with im2txt prediction jsons> <whether the predictions come from a model trained on high, low, or combined> <whether these jsons are predictions on the val or test set>")
+    print("\noptional flags (after the three arguments above):")
+    print("    --per-caption    score each caption with its own COCOEvalCap run (slow; the old behaviour) instead of batching a whole prediction file")
+    print("    --python-tokenizer    tokenize with the in-process PTBTokenizer reimplementation instead of java")
+    print("    --json    also write one json per prediction json, identical to it except for a list of Bleu scores next to the list of captions of every image (the old output)")
+    print("    --incremental    allow a non-empty scores directory; only prediction files that are new or changed since they were last scored (see %s in the scores directory) are scored, and the csv is rebuilt from the cached and the new results"%SCORE_CACHE_INDEX)
     print("\nex: python2 " + __file__ + " ./predictions low test\n")
     exit()
     
@@ -234,6 +350,35 @@ model_type = sys.argv[2]
 global data_split
 data_split = sys.argv[3].lower()
 
+# whether to fall back to one COCOEvalCap run per caption (see get_bleu_scores)
+global per_caption
+per_caption = False
+
+# 'java' for Stanford PTBTokenizer, 'python' for the in-process reimplementation
+global tokenizer_backend
+tokenizer_backend = "java"
+
+# whether to reuse the scores of prediction files that were already scored
+global incremental
+incremental = False
+
+# whether to write the old per prediction file score jsons next to the store
+global write_json
+write_json = False
+
+for flag in sys.argv[4:]:
+    if flag == "--per-caption":
+        per_caption = True
+    elif flag == "--python-tokenizer":
+        tokenizer_backend = "python"
+    elif flag == "--incremental":
+        incremental = True
+    elif flag == "--json":
+        write_json = True
+    else:
+        print("Error: unknown flag '%s'"%flag)
+        exit()
+
 if not os.path.isdir(PREDS_DIR):
     print("Error: invalid predictions directory '" + PREDS_DIR + "'")
     exit()
@@ -291,8 +436,8 @@ if (not os.path.isdir(SCORES_DIR)) and (not os.path.isfile(SCORES_DIR)):
     os.mkdir(SCORES_DIR)
 
 # if scores directory is not empty
-elif len(os.listdir(SCORES_DIR)) != 0:
-    print("Error: scores directory '%s' is not empty; must be empty before BLEU score evaluation."%SCORES_DIR)
+elif len(os.listdir(SCORES_DIR)) != 0 and not incremental:
+    print("Error: scores directory '%s' is not empty; must be empty before BLEU score evaluation (or pass --incremental)."%SCORES_DIR)
     exit()
 
 print("Using scores directory '%s'"%SCORES_DIR)
@@ -320,6 +465,25 @@ for entry in all_gts["annotations"]:
     
     gts_by_id[image_id].append(entry["caption"])
 
+# one PTBTokenizer JVM shared by every tokenization in this run (including the
+# ones COCOEvalCap does in per-caption mode) instead of one java launch per call
+global tokenizer_server
+tokenizer_server = PTBTokenizerServer()
+
+# the ground truths never change between prediction files, so in batched mode
+# they are tokenized and cooked into BLEU references once here rather than
+# once per caption; the cooked references are pickled next to the ground
+# truth file and reused by later runs as long as the references match
+global ref_index
+ref_index = {}
+
+if not per_caption:
+    print("Tokenizing ground truth captions...")
+    tokenized_gts_by_id = PTBTokenizer(server=tokenizer_server, backend=tokenizer_backend).tokenize({image_id: [{"caption": c} for c in gts_by_id[image_id]] for image_id in gts_by_id})
+    ref_index_path = "%s-bleu-refs-%s.pkl"%(os.path.splitext(RELEVANT_GT_FILE.name)[0],tokenizer_backend)
+    ref_index = get_ref_index(ref_index_path, tokenized_gts_by_id)
+    print("Using BLEU reference index '%s'"%ref_index_path)
+
 # list holding all of the filenames of the prediction jsons in the given directory
 prediction_jsons = []
 
@@ -332,6 +496,59 @@ if len(prediction_jsons) == 0:
     print("Error: directory '%s' contains no json files."%PREDS_DIR)
     exit()
 
+# what the scores of a prediction file depend on besides its contents
+# and the ground truths
+metric_set = "bleu1-4,%s,%s"%("per-caption" if per_caption else "batched", tokenizer_backend)
+gt_sha1 = file_sha1(RELEVANT_GT_FILE.name)
+
+global score_cache_path
+score_cache_path = os.path.join(SCORES_DIR, SCORE_CACHE_INDEX)
+
+# the index is always written, so that a later --incremental run can reuse
+# the results of this one; only entries of the current files are kept
+global score_cache
+score_cache = {}
+global score_cache_lock
+score_cache_lock = threading.Lock()
+
+cached_entries = load_score_cache(score_cache_path) if incremental else {}
+
+# per caption scores of every prediction file; in incremental mode the
+# rows of the files that are not scored again are kept
+global score_store_path
+score_store_path = os.path.join(SCORES_DIR, STORE_NAME)
+global score_store
+score_store = ScoreStore()
+
+if incremental and os.path.isfile(score_store_path):
+    score_store = ScoreStore.load(score_store_path)
+
+stored_files = set(score_store.files())
+
+# cache key of every prediction file
+global score_cache_keys
+score_cache_keys = {}
+
+# prediction files that actually need to be scored in this run
+jsons_to_score = []
+
+for pred_json_name in prediction_jsons:
+    key = score_cache_key(os.path.join(PREDS_DIR,pred_json_name), gt_sha1, metric_set)
+    score_cache_keys[pred_json_name] = key
+    
+    cached = cached_entries.get(key)
+    
+    if cached is not None and pred_json_name in stored_files:
+        score_cache[key] = cached
+    else:
+        jsons_to_score.append(pred_json_name)
+
+# rows of files that are scored again or no longer exist
+score_store.remove_files(stored_files - set([name for name in prediction_jsons if name not in jsons_to_score]))
+
+if incremental:
+    print("%d of %d prediction files are already scored; scoring %d"%(len(score_cache),len(prediction_jsons),len(jsons_to_score)))
+
 
 # time that the WHOLE PROCESS starts
 start_time = time.time()
@@ -341,6 +558,10 @@ start_time = time.time()
 global scores_csv_list
 scores_csv_list = [("preds_file_name, avg_bleu1, avg_bleu2, avg_bleu3, avg_bleu4",-99999)]
 
+# rows of the prediction files that are not scored again
+for entry in score_cache.values():
+    scores_csv_list.append((entry["csv_row"],entry["ckpt"]))
+
 
 # function to replace the innards of the `prediction_jsons` for loop
 # such that the work can be multithreaded with ThreadPools
@@ -417,7 +638,13 @@ def main_work_function(pred_json_name):
     bleu_3_scores = []
     bleu_4_scores = []
     
-    for entry in all_preds:
+    # score the whole file at once unless the old per-caption path was requested
+    if not per_caption:
+        batch_scores, corpus_bleu = get_bleu_scores_batch(all_preds, ref_index)
+    
+    for entry_index in range(len(all_preds)):
+        
+        entry = all_preds[entry_index]
         
         # entry to append to `scores_with_preds`
         append_entry = {}
@@ -430,7 +657,19 @@ def main_work_function(pred_json_name):
         captions_triplet = entry["captions"]
         
         # if this image_id has associated ground truths in gts_by_id
-        if image_id in gts_by_id:
+        if image_id in gts_by_id and not per_caption:
+            
+            # batched scores are already in caption order, with {} for empty captions
+            append_entry["scores"] = batch_scores[entry_index]
+            
+            for caption_scores in append_entry["scores"]:
+                if caption_scores != {}:
+                    bleu_1_scores.append(caption_scores["Bleu_1"])
+                    bleu_2_scores.append(caption_scores["Bleu_2"])
+                    bleu_3_scores.append(caption_scores["Bleu_3"])
+                    bleu_4_scores.append(caption_scores["Bleu_4"])
+        
+        elif image_id in gts_by_id:
 
             for cap in captions_triplet:
                 if cap != "": # dont evaluate bleu scores on an empty string
@@ -465,13 +704,33 @@ def main_work_function(pred_json_name):
     scores_csv_list.append(csv_tuple)
     print("Finished evaluating bleu scores for %s in %s s"%(pred_json_name,str(time.time()-b_time)))
     
-    scores_file = open(os.path.join(SCORES_DIR,pred_json_name.replace("preds","scores")), "w")
-    json.dump(scores_with_preds,scores_file)
+    if not per_caption:
+        print("Corpus BLEU for %s: %f, %f, %f, %f"%(pred_json_name,corpus_bleu[0],corpus_bleu[1],corpus_bleu[2],corpus_bleu[3]))
+    
+    score_store.add_file(pred_json_name, csv_tuple[1], data_split, scores_with_preds)
     
-    print("Wrote bleu scores to %s"%scores_file.name)
+    if write_json:
+        scores_file = open(os.path.join(SCORES_DIR,pred_json_name.replace("preds","scores")), "w")
+        json.dump(scores_with_preds,scores_file)
+        
+        scores_file.close()
+        
+        print("Wrote bleu scores to %s"%scores_file.name)
     print("")
         
     pred_file.close()
+    
+    # record the file as scored, saving the index right away so that an
+    # interrupted sweep keeps what it finished
+    score_cache_lock.acquire()
+    try:
+        score_cache[score_cache_keys[pred_json_name]] = {
+            "csv_row": csv_tuple[0],
+            "ckpt": csv_tuple[1]
+        }
+        save_score_cache(score_cache_path, score_cache)
+    finally:
+        score_cache_lock.release()
 
 
 # on 64 threads...
@@ -489,7 +748,15 @@ pool = ThreadPool(64)
 #print(prediction_jsons)
 #exit()
 
-pool.map(main_work_function, prediction_jsons)
+# every PTBTokenizer created by the workers sends its captions to tokenizer_server
+with tokenizer_server:
+    pool.map(main_work_function, jsons_to_score)
+
+score_store.save(score_store_path)
+print("\nWrote scores of %d captions to '%s'"%(len(score_store),score_store_path))
+
+# drops entries of prediction files that are gone, even if nothing was scored
+save_score_cache(score_cache_path, score_cache)
 
 # now we wait for all the threads to return; should be ~ 40 min
 
@@ -506,6 +773,9 @@ scores_csv_files.close()
 
 print("\nWrote out csv '%s'"%scores_csv_files.name)
 
+if tokenizer_backend == 'java':
+    print(tokencache.get_cache().stats())
+
 # close our GT FILE at the very end
 RELEVANT_GT_FILE.close()
 print("\nClosed RELEVANT_GT_FILE. Finished whole process in %s s"%str(time.time()-start_time))
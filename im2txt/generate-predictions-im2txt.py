@@ -95,7 +95,6 @@ with open("test.json", "r") as json_file:
 import json
 import sys
 import os
-import hashlib # for hashing im2txt ckpts
 import time
 from im2txt import run_inference
 
@@ -113,6 +112,7 @@ sys.path.append('./coco_caption/pycocoevalcap/meteor')
 sys.path.append('./coco_caption/pycocoevalcap/rouge')
 sys.path.append('./coco_caption/pycocoevalcap/spice')
 sys.path.append('./coco_caption/pycocoevalcap/tokenizer')
+from ckpt_fingerprint import FingerprintIndex, FAST_ALGORITHM # for hashing im2txt ckpts
 from coco_caption.pycocotools.coco import COCO
 from coco_caption.pycocoevalcap.eval import COCOEvalCap
 import matplotlib.pyplot as plt
@@ -137,12 +137,19 @@ encoder.FLOAT_REPR = lambda o: format(o, '.3f')
 # export CUDA_VISIBLE_DEVICES="2" && python generate-BLEU.py models/train/ low
 
 
+# cache of the Inception features of the test images (see --feature-cache)
+FEATURE_CACHE_DIR = "./feature-cache"
+
 if len(sys.argv) < 3:
     print("\nRuns predictions on a given directory of im2txt checkpoints, outputting jsons of predictions:")
     print("into a new directory")
     print("\nNOTE: this must be run within an im2txt directory with all of the im2txt scripts on a machine")
     print("that can run im2txt, otherwise prediction will not be possible (vocab file needed, tf shards needed)")
     print("\nusage: python3 " + __file__ + " <directory with im2txt checkpoint files> <whether these models were trained on high, low, combined>")
+    print("\noptional flags (after the two arguments above):")
+    print("    --md5    name prediction files after the md5 of their checkpoint (like older sweeps) instead of the faster %s digest"%FAST_ALGORITHM)
+    print("    --in-graph    run the whole beam search of a batch of images in one sess.run (in-graph decoder)")
+    print("    --feature-cache    compute the Inception features of the images once, in %s, for every checkpoint with the same Inception weights"%FEATURE_CACHE_DIR)
     print("\nex: python3 " + __file__ + " ./models/train high\n")
     exit()
 
@@ -161,14 +168,31 @@ if not os.path.isfile(VOCAB_PATH):
     
 
 
-# size of chunks to use when hashing im2txt ckpts
-BUFFER_SIZE = 100000000 # 100 MB chunks #65536 * 10000 # 64 KB
-        
-        
 CKPT_DIR = sys.argv[1]
 model_type = sys.argv[2]
 ext = ".data-00000-of-00001" # extension for im2txt ckpts
 
+# digest that goes into the prediction file names; checkpoint digests are
+# cached next to the checkpoints (see coco_caption/ckpt_fingerprint.py)
+hash_algorithm = FAST_ALGORITHM
+
+# beam search in the graph instead of one sess.run per word
+in_graph_beam_search = False
+
+# feed cached Inception features instead of the images
+feature_cache_dir = None
+
+for flag in sys.argv[3:]:
+    if flag == "--md5":
+        hash_algorithm = "md5"
+    elif flag == "--in-graph":
+        in_graph_beam_search = True
+    elif flag == "--feature-cache":
+        feature_cache_dir = FEATURE_CACHE_DIR
+    else:
+        print("Error: unknown flag '%s'"%flag)
+        exit()
+
 
 if not os.path.isdir(CKPT_DIR):
     print("Error: invalid input directory '" + CKPT_DIR + "'")
@@ -201,11 +225,11 @@ elif len(os.listdir(PREDICTIONS_DIR)) != 0:
     
 
 # path to a validation predictions file written by each checkpoint (validation set)
-# note: the first %s is the checkpoint's number, the second %s is the checkpoints md5
+# note: the first %s is the checkpoint's number, the second %s is the checkpoints digest
 PREDICTION_VAL_PATH = os.path.join(PREDICTIONS_DIR, "preds_" + training_ID + "_val_%s_%s.json")
 
 # path to a validation predictions file written by each checkpoint (test set)
-# note: the first %s is the checkpoint's number, the second %s is the checkpoints md5
+# note: the first %s is the checkpoint's number, the second %s is the checkpoints digest
 PREDICTION_TEST_PATH = os.path.join(PREDICTIONS_DIR, "preds_" + training_ID + "_test_%s_%s.json")
 
 
@@ -254,57 +278,47 @@ QUARTER_CKPT_FILES.sort(reverse=True, key=sort_by_ckpt_num)
 #print(QUARTER_CKPT_FILES)
 #print(len(QUARTER_CKPT_FILES))
 
-# go through 1/4 of the ckpt files (all of QUARTER_CKPT_FILES)
+# hash every checkpoint of the sweep up front (in parallel, and only the ones
+# that are new or changed since the last sweep over this directory)
+fingerprints = FingerprintIndex(CKPT_DIR, hash_algorithm)
+hash_time = time.time()
+ckpt_digests = fingerprints.digest_all([os.path.join(CKPT_DIR,elem[0]) for elem in QUARTER_CKPT_FILES])
+print("Fingerprinted %d checkpoints (%d hashed with %s) in %s seconds"%(len(ckpt_digests),fingerprints.computed,hash_algorithm,str(time.time()-hash_time)))
+
+if not fingerprints.save():
+    print("Note: could not write the checkpoint fingerprint index '%s'"%fingerprints.path)
+
+# trimmed paths are model.ckpt-25468 (trims off .data-00000-of-00001),
+# needed for inferencing
+trimmed_paths = []
 for elem in QUARTER_CKPT_FILES:
-    b_time = time.time() # begin time for this checkpoint
-    # f is the filename of the checkpoint
-    f = elem[0]
-    
-    # if the file is an im2txt checkpoint
-    
-        
-    # absolute path of the file
-    abs_path = os.path.abspath(os.path.join(CKPT_DIR,f))
-        # get the ckpt's hash
-
-    md5_hash = hashlib.md5()
-    with open(os.path.join(CKPT_DIR,f), "rb") as to_hash:
-        while True:
-            data = to_hash.read(BUFFER_SIZE)
-                                    
-            if not data: # if we're at the end of the file
-                break
-                                    
-            md5_hash.update(data)
-        
-    md5_hex = md5_hash.hexdigest()
-    #print(f + ": " + md5_hex)
-        
+    abs_path = os.path.abspath(os.path.join(CKPT_DIR,elem[0]))
+    trimmed_paths.append(abs_path[0:abs_path.find(ext)])
 
-    # trimmed path is model.ckpt-25468 (trims off .data-00000-of-00001)
-    # needed for inferencing
-        
-        
-    trimmed_path = abs_path[0:abs_path.find(ext)]
-        
-    # print(trimmed_path)
-        
-    # inference off of ckpt (validation set) and print the predictions
+# inference off of every ckpt (test set); the inference graph and session are
+# built once and each checkpoint only swaps in its weights
+#val_preds = run_inference.inference_on_ckpts(trimmed_paths, VOCAB_PATH, (IMAGE_FILE_PATTERN%"val"))
+test_preds_per_ckpt = run_inference.inference_on_ckpts(trimmed_paths, VOCAB_PATH, (IMAGE_FILE_PATTERN%"test"),
+                                                       in_graph_beam_search=in_graph_beam_search,
+                                                       feature_cache_dir=feature_cache_dir)
 
-    print("Generating test predictions for %s ..." % (f) )
+# go through 1/4 of the ckpt files (all of QUARTER_CKPT_FILES)
+b_time = time.time() # begin time for the first checkpoint
+for elem, (trimmed_path, test_preds) in zip(QUARTER_CKPT_FILES, test_preds_per_ckpt):
+    # f is the filename of the checkpoint
+    f = elem[0]
     
-    #val_preds = run_inference.inference_on_ckpt(trimmed_path, VOCAB_PATH, (IMAGE_FILE_PATTERN%"val"))
-
-    # inference off of ckpt (test set) and print the predictions
-    test_preds = run_inference.inference_on_ckpt(trimmed_path, VOCAB_PATH, (IMAGE_FILE_PATTERN%"test"))
+    # get the ckpt's hash
+    ckpt_hex = ckpt_digests[os.path.join(CKPT_DIR,f)]
+    #print(f + ": " + ckpt_hex)
     
     print("Generated test predictions for %s in %s seconds" % (f, str(time.time()-b_time)))
     
-    # fill in the filename with (ckpt_number, md5_hex)
-    #val_pred_file = PREDICTION_VAL_PATH%(str(elem[1]), md5_hex)
+    # fill in the filename with (ckpt_number, ckpt_hex)
+    #val_pred_file = PREDICTION_VAL_PATH%(str(elem[1]), ckpt_hex)
     
-    # fill in the filename with (ckpt_number, md5_hex)
-    test_pred_file = PREDICTION_TEST_PATH%(str(elem[1]), md5_hex)
+    # fill in the filename with (ckpt_number, ckpt_hex)
+    test_pred_file = PREDICTION_TEST_PATH%(str(elem[1]), ckpt_hex)
     
     '''
     with open(val_pred_file, "w") as outfile:
@@ -318,6 +332,7 @@ for elem in QUARTER_CKPT_FILES:
         
    
     print("\n\n")
+    b_time = time.time() # begin time for the next checkpoint
 
 
 elapsed_time = time.time() - start_time
@@ -19,7 +19,6 @@ from __future__ import division
 from __future__ import print_function
 
 import heapq
-import math
 
 
 import numpy as np
@@ -121,8 +120,8 @@ class CaptionGenerator(object):
 
     Args:
       model: Object encapsulating a trained image-to-text model. Must have
-        methods feed_image() and inference_step(). For example, an instance of
-        InferenceWrapperBase.
+        methods feed_image() and inference_step(), and feed_images() for
+        beam_search_batch(). For example, an instance of InferenceWrapperBase.
       vocab: A Vocabulary object.
       beam_size: Beam size to use when generating captions.
       max_caption_length: The maximum caption length before stopping the search.
@@ -138,6 +137,77 @@ class CaptionGenerator(object):
     self.max_caption_length = max_caption_length
     self.length_normalization_factor = length_normalization_factor
 
+  def _top_words(self, partial_captions_list, softmax):
+    """Finds the beam_size most probable next words of every partial caption.
+
+    Selects them with argpartition over the whole [batch, vocab] softmax
+    matrix instead of sorting every row, and orders them the way a stable
+    sort by descending probability would: ties go to the lower word id.
+
+    Args:
+      partial_captions_list: The partial captions fed to the inference step.
+      softmax: Softmax output of the inference step, one row per caption.
+
+    Returns:
+      words: A list with the next word ids of each caption, most probable
+        first.
+      probs: A numpy array of their probabilities, [batch, beam_size].
+      logprobs: A list with the log-probabilities of the extended captions.
+    """
+    softmax = np.asarray(softmax)
+    k = min(self.beam_size, softmax.shape[1])
+    rows = np.arange(softmax.shape[0])[:, np.newaxis]
+    words = np.argpartition(-softmax, k - 1, axis=1)[:, :k]
+    probs = softmax[rows, words]
+    order = np.lexsort((words, -probs))
+    words = words[rows, order]
+    probs = probs[rows, order]
+    # argpartition picks any of the words tied with the k-th probability;
+    # redo the (rare) rows where that choice matters with a stable sort.
+    ties = np.count_nonzero(softmax >= probs[:, -1:], axis=1) > k
+    for row in np.nonzero(ties)[0]:
+      words[row] = np.argsort(-softmax[row], kind="mergesort")[:k]
+      probs[row] = softmax[row, words[row]]
+    # In double precision like the captions' logprob; the clipped words are
+    # below 1e-12 and get skipped by _extend() anyway.
+    logprobs = (
+        np.array([c.logprob for c in partial_captions_list])[:, np.newaxis] +
+        np.log(np.maximum(probs.astype(np.float64), 1e-12)))
+    return words.tolist(), probs, logprobs.tolist()
+
+  def _extend(self, partial_caption, words, probs, logprobs, state, metadata,
+              partial_captions, complete_captions):
+    """Extends a partial caption by its most probable next words.
+
+    Args:
+      partial_caption: The Caption to extend.
+      words: Its next word ids, most probable first (see _top_words()).
+      probs: Their probabilities.
+      logprobs: Log-probabilities of the extended captions.
+      state: Model state after feeding the last word of partial_caption.
+      metadata: Metadata of the inference step for partial_caption, or None.
+      partial_captions: TopN receiving the extended captions that go on.
+      complete_captions: TopN receiving the extended captions that end.
+    """
+    # Each next word gives a new partial caption.
+    for w, p, logprob in zip(words, probs, logprobs):
+      if p < 1e-12:
+        continue  # Avoid log(0).
+      sentence = partial_caption.sentence + [w]
+      score = logprob
+      if metadata is not None:
+        metadata_list = partial_caption.metadata + [metadata]
+      else:
+        metadata_list = None
+      if w == self.vocab.end_id:
+        if self.length_normalization_factor > 0:
+          score /= len(sentence)**self.length_normalization_factor
+        beam = Caption(sentence, state, logprob, score, metadata_list)
+        complete_captions.push(beam)
+      else:
+        beam = Caption(sentence, state, logprob, score, metadata_list)
+        partial_captions.push(beam)
+
   def beam_search(self, sess, encoded_image):
     """Runs beam search caption generation on a single image.
 
@@ -172,32 +242,11 @@ class CaptionGenerator(object):
                                                                 input_feed,
                                                                 state_feed)
 
+      words, probs, logprobs = self._top_words(partial_captions_list, softmax)
       for i, partial_caption in enumerate(partial_captions_list):
-        word_probabilities = softmax[i]
-        state = new_states[i]
-        # For this partial caption, get the beam_size most probable next words.
-        words_and_probs = list(enumerate(word_probabilities))
-        words_and_probs.sort(key=lambda x: -x[1])
-        words_and_probs = words_and_probs[0:self.beam_size]
-        # Each next word gives a new partial caption.
-        for w, p in words_and_probs:
-          if p < 1e-12:
-            continue  # Avoid log(0).
-          sentence = partial_caption.sentence + [w]
-          logprob = partial_caption.logprob + math.log(p)
-          score = logprob
-          if metadata:
-            metadata_list = partial_caption.metadata + [metadata[i]]
-          else:
-            metadata_list = None
-          if w == self.vocab.end_id:
-            if self.length_normalization_factor > 0:
-              score /= len(sentence)**self.length_normalization_factor
-            beam = Caption(sentence, state, logprob, score, metadata_list)
-            complete_captions.push(beam)
-          else:
-            beam = Caption(sentence, state, logprob, score, metadata_list)
-            partial_captions.push(beam)
+        self._extend(partial_caption, words[i], probs[i], logprobs[i],
+                     new_states[i], metadata[i] if metadata else None,
+                     partial_captions, complete_captions)
       if partial_captions.size() == 0:
         # We have run out of partial candidates; happens when beam_size = 1.
         break
@@ -209,3 +258,81 @@ class CaptionGenerator(object):
       complete_captions = partial_captions
 
     return complete_captions.extract(sort=True)
+
+  def beam_search_batch(self, sess, encoded_images):
+    """Runs beam search caption generation on a batch of images.
+
+    The partial captions of all images are stepped together, so each time step
+    is a single inference_step() over up to len(encoded_images) * beam_size
+    rows rather than one per image. Every image keeps its own top beam_size
+    partial and complete captions, and drops out of the batch once it has run
+    out of partial captions, so the captions are those beam_search() returns
+    for each image.
+
+    Args:
+      sess: TensorFlow Session object.
+      encoded_images: A list of encoded image strings.
+
+    Returns:
+      A list with, for each image, a list of Caption sorted by descending
+      score.
+    """
+    if len(encoded_images) == 0:
+      return []
+
+    # Feed in the images to get their initial states.
+    initial_states = self.model.feed_images(sess, encoded_images)
+
+    partial_captions = []
+    complete_captions = []
+    for initial_state in initial_states:
+      initial_beam = Caption(
+          sentence=[self.vocab.start_id],
+          state=initial_state,
+          logprob=0.0,
+          score=0.0,
+          metadata=[""])
+      partial_captions.append(TopN(self.beam_size))
+      partial_captions[-1].push(initial_beam)
+      complete_captions.append(TopN(self.beam_size))
+
+    # Indices of the images that still have partial captions.
+    active = list(range(len(encoded_images)))
+
+    # Run beam search.
+    for _ in range(self.max_caption_length - 1):
+      if not active:
+        break
+      # The partial captions of every active image, in order, as one batch.
+      partial_captions_lists = []
+      for image in active:
+        partial_captions_lists.append(partial_captions[image].extract())
+        partial_captions[image].reset()
+      batch = [c for captions in partial_captions_lists for c in captions]
+      input_feed = np.array([c.sentence[-1] for c in batch])
+      state_feed = np.array([c.state for c in batch])
+
+      softmax, new_states, metadata = self.model.inference_step(sess,
+                                                                input_feed,
+                                                                state_feed)
+
+      words, probs, logprobs = self._top_words(batch, softmax)
+      i = 0
+      for image, partial_captions_list in zip(active, partial_captions_lists):
+        for partial_caption in partial_captions_list:
+          self._extend(partial_caption, words[i], probs[i], logprobs[i],
+                       new_states[i], metadata[i] if metadata else None,
+                       partial_captions[image], complete_captions[image])
+          i += 1
+      # Images that have run out of partial candidates are done; happens when
+      # beam_size = 1.
+      active = [image for image in active if partial_captions[image].size()]
+
+    # As in beam_search(), fall back to the partial captions of an image only
+    # if it has no complete captions.
+    results = []
+    for partial, complete in zip(partial_captions, complete_captions):
+      if not complete.size():
+        complete = partial
+      results.append(complete.extract(sort=True))
+    return results
@@ -32,6 +32,9 @@ class FakeVocab(object):
     self.end_id = 1  # Word id denoting sentence end.
 
 
+ALTERNATIVE_IMAGE = "alternative"
+
+
 class FakeModel(object):
   """Fake model for testing purposes."""
 
@@ -66,22 +69,41 @@ class FakeModel(object):
         11: {1: 1.0},
     }
 
+    # Next word distributions for images fed as ALTERNATIVE_IMAGE, whose
+    # state is 1 instead of 0.
+    self._alternative_probabilities = {
+        0: {1: 0.4,
+            2: 0.6},
+        2: {1: 1.0},
+    }
+
   # pylint: disable=unused-argument
 
   def feed_image(self, sess, encoded_image):
     # Return a nominal model state.
+    if encoded_image == ALTERNATIVE_IMAGE:
+      return np.ones([1, self._state_size])
     return np.zeros([1, self._state_size])
 
+  def feed_images(self, sess, encoded_images):
+    return np.concatenate(
+        [self.feed_image(sess, encoded_image)
+         for encoded_image in encoded_images])
+
   def inference_step(self, sess, input_feed, state_feed):
     # Compute the matrix of softmax distributions for the next batch of words.
     batch_size = input_feed.shape[0]
     softmax_output = np.zeros([batch_size, self._vocab_size])
     for batch_index, word_id in enumerate(input_feed):
-      for next_word, probability in self._probabilities[word_id].items():
+      if state_feed[batch_index, 0] == 1:
+        probabilities = self._alternative_probabilities
+      else:
+        probabilities = self._probabilities
+      for next_word, probability in probabilities[word_id].items():
         softmax_output[batch_index, next_word] = probability
 
-    # Nominal state and metadata.
-    new_state = np.zeros([batch_size, self._state_size])
+    # The state only tells images apart; nominal metadata.
+    new_state = np.array(state_feed)
     metadata = None
 
     return softmax_output, new_state, metadata
@@ -123,6 +145,21 @@ class CaptionGeneratorTest(tf.test.TestCase):
     self.assertEqual(expected_sentences, actual_sentences)
     self.assertAllClose(expected_probabilities, actual_probabilities)
 
+    # The batched search returns the same captions for every image, whatever
+    # the other images of the batch.
+    batch_captions = generator.beam_search_batch(
+        sess=None, encoded_images=[None, ALTERNATIVE_IMAGE, None])
+    self.assertEqual(3, len(batch_captions))
+    for i in [0, 2]:
+      self.assertEqual(expected_sentences,
+                       [c.sentence for c in batch_captions[i]])
+      self.assertAllClose(expected_probabilities,
+                          [math.exp(c.logprob) for c in batch_captions[i]])
+    alternative_captions = generator.beam_search(
+        sess=None, encoded_image=ALTERNATIVE_IMAGE)
+    self.assertEqual([c.sentence for c in alternative_captions],
+                     [c.sentence for c in batch_captions[1]])
+
   def testBeamSize(self):
     # Beam size = 1.
     expected = [([0, 4, 10, 1], 0.16)]
@@ -173,6 +210,24 @@ class CaptionGeneratorTest(tf.test.TestCase):
     self._assertExpectedCaptions(
         expected, beam_size=4, length_normalization_factor=3)
 
+  def testBeamSearchBatch(self):
+    generator = caption_generator.CaptionGenerator(
+        model=FakeModel(), vocab=FakeVocab(), beam_size=3)
+    captions = generator.beam_search_batch(
+        sess=None, encoded_images=[ALTERNATIVE_IMAGE, None])
+
+    # The alternative image finishes after two words, the other one goes on.
+    self.assertEqual([[0, 2, 1], [0, 1]],
+                     [c.sentence for c in captions[0]])
+    self.assertAllClose([0.6, 0.4],
+                        [math.exp(c.logprob) for c in captions[0]])
+    self.assertEqual([[0, 2, 6, 1], [0, 4, 10, 1], [0, 3, 8, 1]],
+                     [c.sentence for c in captions[1]])
+
+    # An empty batch has no captions.
+    self.assertEqual([], generator.beam_search_batch(sess=None,
+                                                     encoded_images=[]))
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -0,0 +1,159 @@
+# Copyright 2016 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Cache of the Inception v3 image features of a checkpoint sweep.
+
+When the Inception weights are frozen, the image features (the Inception
+output that the image embedding layer maps into the LSTM input space) are the
+same for every checkpoint of a sweep. FeatureCache computes them once, stores
+them as a memory-mapped float16 array with one row per image id, and
+CachedFeatureModel lets a CaptionGenerator feed those rows instead of encoded
+images. The cache records a digest of the Inception weights it was computed
+with, so that it is only used for checkpoints with the same weights.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+
+import numpy as np
+import tensorflow as tf
+
+# Bump whenever the layout of the cache changes.
+CACHE_VERSION = 1
+
+INDEX_NAME = "index.json"
+FEATURES_NAME = "features.npy"
+
+
+class FeatureCache(object):
+  """Image features keyed by image id, in a cache directory."""
+
+  def __init__(self, cache_dir):
+    """Opens the cache in cache_dir, if there is one.
+
+    Args:
+      cache_dir: Directory of the cache; created by build() if it does not
+        exist.
+    """
+    self.cache_dir = cache_dir
+    # Digest of the Inception weights the features were computed with.
+    self.digest = None
+    self._rows = {}
+    self._features = None
+
+    index_path = os.path.join(cache_dir, INDEX_NAME)
+    if not os.path.isfile(index_path):
+      return
+    with open(index_path) as f:
+      index = json.load(f)
+    if index.get("version") != CACHE_VERSION:
+      tf.logging.info("Ignoring the version %s feature cache in %s",
+                      index.get("version"), cache_dir)
+      return
+    self.digest = index["inception_digest"]
+    self._rows = dict((image_id, row)
+                      for row, image_id in enumerate(index["image_ids"]))
+    self._features = np.load(os.path.join(cache_dir, FEATURES_NAME),
+                             mmap_mode="r")
+
+  def matches(self, digest, image_ids):
+    """Whether the cache has features of image_ids for these weights."""
+    return (self.digest is not None and self.digest == digest and
+            all(image_id in self._rows for image_id in image_ids))
+
+  def build(self, digest, image_ids, compute_fn, batch_size=16):
+    """Computes and stores the features of image_ids, replacing the cache.
+
+    Args:
+      digest: Digest of the Inception weights compute_fn uses.
+      image_ids: List of image ids to cache.
+      compute_fn: Function such that compute_fn(image_ids) returns a float
+        numpy array of shape [len(image_ids), feature_size] with their
+        features.
+      batch_size: Number of images passed to each compute_fn call.
+    """
+    if not os.path.isdir(self.cache_dir):
+      os.makedirs(self.cache_dir)
+    features_path = os.path.join(self.cache_dir, FEATURES_NAME)
+    index_path = os.path.join(self.cache_dir, INDEX_NAME)
+    # Drop the old index first, so that an interrupted build leaves no cache.
+    if os.path.isfile(index_path):
+      os.remove(index_path)
+    self.digest = None
+    self._rows = {}
+    self._features = None
+
+    tmp_path = features_path + ".tmp"
+    features = None
+    for start in range(0, len(image_ids), batch_size):
+      batch = compute_fn(image_ids[start:start + batch_size])
+      if features is None:
+        features = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float16,
+            shape=(len(image_ids), batch.shape[1]))
+      features[start:start + len(batch)] = batch
+    if features is None:
+      features = np.lib.format.open_memmap(
+          tmp_path, mode="w+", dtype=np.float16, shape=(0, 0))
+    features.flush()
+    del features
+    os.rename(tmp_path, features_path)
+
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w") as f:
+      json.dump({"version": CACHE_VERSION, "inception_digest": digest,
+                 "image_ids": list(image_ids)}, f)
+    os.rename(tmp_path, index_path)
+
+    self.digest = digest
+    self._rows = dict((image_id, row) for row, image_id in enumerate(image_ids))
+    self._features = np.load(features_path, mmap_mode="r")
+    tf.logging.info("Cached the features of %d images in %s", len(image_ids),
+                    self.cache_dir)
+
+  def lookup(self, image_ids):
+    """Returns the features of image_ids as a float32 numpy array."""
+    rows = [self._rows[image_id] for image_id in image_ids]
+    return np.asarray(self._features[rows], dtype=np.float32)
+
+
+class CachedFeatureModel(object):
+  """Model for a CaptionGenerator that takes image features, not images.
+
+  The "encoded images" passed to CaptionGenerator.beam_search_batch() are then
+  rows of image features (e.g. from FeatureCache.lookup()), which are fed to
+  the image embedding layer of the wrapped model.
+  """
+
+  def __init__(self, model):
+    """Initializes the model.
+
+    Args:
+      model: An InferenceWrapper; see InferenceWrapper.feed_features().
+    """
+    self.model = model
+
+  def feed_image(self, sess, features):
+    return self.model.feed_features(sess, features[np.newaxis])
+
+  def feed_images(self, sess, features):
+    return self.model.feed_features(sess, features)
+
+  def inference_step(self, sess, input_feed, state_feed):
+    return self.model.inference_step(sess, input_feed, state_feed)
@@ -0,0 +1,77 @@
+# Copyright 2016 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Unit tests for FeatureCache."""
+
+import os
+
+
+
+import numpy as np
+import tensorflow as tf
+
+from im2txt.inference_utils import feature_cache
+
+
+class FeatureCacheTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(FeatureCacheTest, self).setUp()
+    self._cache_dir = os.path.join(self.get_temp_dir(), "feature-cache")
+    self._image_ids = ["0000001", "0000002", "0000003", "0000004", "0000005"]
+    self._features = np.random.rand(len(self._image_ids), 8)
+    # Image ids passed to each compute_fn call.
+    self._computed = []
+
+  def _compute_fn(self, image_ids):
+    self._computed.append(list(image_ids))
+    return self._features[[self._image_ids.index(i) for i in image_ids]]
+
+  def testBuildAndLookup(self):
+    cache = feature_cache.FeatureCache(self._cache_dir)
+    self.assertFalse(cache.matches("digest", self._image_ids))
+
+    cache.build("digest", self._image_ids, self._compute_fn, batch_size=2)
+    self.assertEqual([["0000001", "0000002"], ["0000003", "0000004"],
+                      ["0000005"]], self._computed)
+    self.assertTrue(cache.matches("digest", self._image_ids))
+    self.assertTrue(cache.matches("digest", ["0000004"]))
+    self.assertFalse(cache.matches("other digest", self._image_ids))
+    self.assertFalse(cache.matches("digest", ["0000006"]))
+
+    features = cache.lookup(["0000004", "0000001"])
+    self.assertEqual(np.float32, features.dtype)
+    # Stored in float16.
+    self.assertAllClose(self._features[[3, 0]], features, atol=1e-3)
+
+  def testReopen(self):
+    feature_cache.FeatureCache(self._cache_dir).build(
+        "digest", self._image_ids, self._compute_fn)
+
+    cache = feature_cache.FeatureCache(self._cache_dir)
+    self.assertEqual("digest", cache.digest)
+    self.assertTrue(cache.matches("digest", self._image_ids))
+    self.assertAllClose(self._features, cache.lookup(self._image_ids),
+                        atol=1e-3)
+
+    # Rebuilding for other weights replaces the cache.
+    cache.build("other digest", self._image_ids[:2], self._compute_fn)
+    cache = feature_cache.FeatureCache(self._cache_dir)
+    self.assertTrue(cache.matches("other digest", self._image_ids[:2]))
+    self.assertFalse(cache.matches("digest", self._image_ids[:2]))
+    self.assertFalse(cache.matches("other digest", self._image_ids))
+
+
+if __name__ == "__main__":
+  tf.test.main()
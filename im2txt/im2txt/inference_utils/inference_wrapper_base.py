@@ -26,6 +26,11 @@ Subclasses must implement the following methods:
     precisely once at the start of inference for each image. Subclasses may
     compute and/or save per-image internal context in this method.
 
+  feed_images():
+    Optional. Takes a list of encoded images and returns their initial model
+    states, one row per image. The default calls feed_image() on each image;
+    subclasses whose graph can process a batch of images may override it.
+
   inference_step():
     Takes a batch of inputs and states at a single time-step. Returns the
     softmax output corresponding to the inputs, and the new states of the batch.
@@ -34,11 +39,14 @@ Subclasses must implement the following methods:
 
 Client usage:
   1. Build the model inference graph via build_graph_from_config() or
-     build_graph_from_proto().
+     build_graph_from_proto(), or via build_graph_from_config_for_checkpoints()
+     to caption with several checkpoints of the same model.
   2. Call the resulting restore_fn to load the model checkpoint.
   3. For each image in a batch of images:
      a) Call feed_image() once to get the initial state.
      b) For each step of caption generation, call inference_step().
+     Alternatively, call feed_images() once for the whole batch and step the
+     states of all images together with inference_step().
 """
 
 from __future__ import absolute_import
@@ -48,6 +56,7 @@ from __future__ import print_function
 import os.path
 
 
+import numpy as np
 import tensorflow as tf
 
 # pylint: disable=unused-argument
@@ -117,6 +126,27 @@ class InferenceWrapperBase(object):
 
     return self._create_restore_fn(checkpoint_path, saver)
 
+  def build_graph_from_config_for_checkpoints(self, model_config,
+                                              checkpoint_paths):
+    """Builds the inference graph once for several checkpoints of a model.
+
+    Args:
+      model_config: Object containing configuration for building the model.
+      checkpoint_paths: List of checkpoint files or directories containing a
+        checkpoint file.
+
+    Returns:
+      restore_fns: A list with, for each checkpoint path, a function such that
+        restore_fn(sess) loads model variables from that checkpoint into the
+        same graph.
+    """
+    tf.logging.info("Building model.")
+    self.build_model(model_config)
+    saver = tf.train.Saver()
+
+    return [self._create_restore_fn(checkpoint_path, saver)
+            for checkpoint_path in checkpoint_paths]
+
   def build_graph_from_proto(self, graph_def_file, saver_def_file,
                              checkpoint_path):
     """Builds the inference graph from serialized GraphDef and SaverDef protos.
@@ -161,6 +191,20 @@ class InferenceWrapperBase(object):
     """
     tf.logging.fatal("Please implement feed_image in subclass")
 
+  def feed_images(self, sess, encoded_images):
+    """Feeds a batch of images and returns their initial model states.
+
+    Args:
+      sess: TensorFlow Session object.
+      encoded_images: A list of encoded image strings.
+
+    Returns:
+      states: A numpy array of shape [len(encoded_images), state_size].
+    """
+    return np.concatenate(
+        [self.feed_image(sess, encoded_image)
+         for encoded_image in encoded_images])
+
   def inference_step(self, sess, input_feed, state_feed):
     """Runs one step of inference.
 
@@ -19,28 +19,103 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import hashlib
 
+import numpy as np
+import tensorflow as tf
 
 from im2txt import show_and_tell_model
+from im2txt.inference_utils import caption_generator
 from im2txt.inference_utils import inference_wrapper_base
 
 
 class InferenceWrapper(inference_wrapper_base.InferenceWrapperBase):
   """Model wrapper class for performing inference with a ShowAndTellModel."""
 
-  def __init__(self):
+  def __init__(self, in_graph_beam_search=False):
+    """Initializes the wrapper.
+
+    Args:
+      in_graph_beam_search: Whether to build the model with its in-graph beam
+        search decoder, which beam_search_in_graph() runs.
+    """
     super(InferenceWrapper, self).__init__()
+    self.in_graph_beam_search = in_graph_beam_search
 
   def build_model(self, model_config):
-    model = show_and_tell_model.ShowAndTellModel(model_config, mode="inference")
+    model = show_and_tell_model.ShowAndTellModel(
+        model_config, mode="inference",
+        in_graph_beam_search=self.in_graph_beam_search)
     model.build()
     return model
 
   def feed_image(self, sess, encoded_image):
+    if self.in_graph_beam_search:
+      # The graph takes a batch of images.
+      return self.feed_images(sess, [encoded_image])
     initial_state = sess.run(fetches="lstm/initial_state:0",
                              feed_dict={"image_feed:0": encoded_image})
     return initial_state
 
+  def feed_images(self, sess, encoded_images):
+    if not self.in_graph_beam_search:
+      return super(InferenceWrapper, self).feed_images(sess, encoded_images)
+    initial_states = sess.run(fetches="lstm/initial_state:0",
+                              feed_dict={"image_feed:0": encoded_images})
+    return initial_states
+
+  def compute_features(self, sess, encoded_images):
+    """Returns the Inception v3 features of a batch of images.
+
+    Args:
+      sess: TensorFlow Session object.
+      encoded_images: A list of encoded image strings.
+
+    Returns:
+      features: A numpy array of shape [len(encoded_images), feature_size].
+    """
+    if self.in_graph_beam_search:
+      return sess.run(fetches="inception_output:0",
+                      feed_dict={"image_feed:0": encoded_images})
+    return np.concatenate([
+        sess.run(fetches="inception_output:0",
+                 feed_dict={"image_feed:0": encoded_image})
+        for encoded_image in encoded_images])
+
+  def feed_features(self, sess, features):
+    """Like feed_images(), from the features compute_features() returns.
+
+    Args:
+      sess: TensorFlow Session object.
+      features: A numpy array of shape [batch_size, feature_size].
+
+    Returns:
+      states: A numpy array of shape [batch_size, state_size].
+    """
+    if self.in_graph_beam_search:
+      return sess.run(fetches="lstm/initial_state:0",
+                      feed_dict={"inception_output:0": features})
+    # The single image graph takes one image at a time.
+    return np.concatenate([
+        sess.run(fetches="lstm/initial_state:0",
+                 feed_dict={"inception_output:0": features[i:i + 1]})
+        for i in range(len(features))])
+
+  def inception_digest(self, sess):
+    """Returns a digest of the Inception v3 weights loaded in sess.
+
+    Checkpoints trained with frozen Inception weights share it, and so do the
+    features compute_features() returns for them.
+    """
+    variables = sess.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES,
+                                          scope="InceptionV3")
+    variables.sort(key=lambda v: v.op.name)
+    digest = hashlib.md5()
+    for variable, value in zip(variables, sess.run(variables)):
+      digest.update(variable.op.name.encode("utf-8"))
+      digest.update(np.ascontiguousarray(value).tobytes())
+    return digest.hexdigest()
+
   def inference_step(self, sess, input_feed, state_feed):
     softmax_output, state_output = sess.run(
         fetches=["softmax:0", "lstm/state:0"],
@@ -49,3 +124,52 @@ class InferenceWrapper(inference_wrapper_base.InferenceWrapperBase):
             "lstm/state_feed:0": state_feed,
         })
     return softmax_output, state_output, None
+
+  def beam_search_in_graph(self, sess, encoded_images, vocab, beam_size=3,
+                           max_caption_length=20,
+                           length_normalization_factor=0.0, features=None):
+    """Captions a batch of images with the in-graph beam search.
+
+    The whole search is a single Session.run(); see
+    ShowAndTellModel.build_beam_search().
+
+    Args:
+      sess: TensorFlow Session object.
+      encoded_images: A list of encoded image strings.
+      vocab: A Vocabulary object.
+      beam_size: See CaptionGenerator.
+      max_caption_length: See CaptionGenerator.
+      length_normalization_factor: See CaptionGenerator.
+      features: Optional features of the images (see compute_features()),
+        fed instead of encoded_images.
+
+    Returns:
+      A list with, for each image, a list of Caption sorted by descending
+      score, as CaptionGenerator.beam_search_batch() returns.
+    """
+    feed_dict = {
+        "beam_search/start_id:0": vocab.start_id,
+        "beam_search/end_id:0": vocab.end_id,
+        "beam_search/beam_size:0": beam_size,
+        "beam_search/max_caption_length:0": max_caption_length,
+        "beam_search/length_normalization_factor:0":
+            length_normalization_factor,
+    }
+    if features is not None:
+      feed_dict["inception_output:0"] = features
+    else:
+      feed_dict["image_feed:0"] = encoded_images
+    ids, lengths, scores, logprobs = sess.run(
+        fetches=["beam_search/ids:0", "beam_search/lengths:0",
+                 "beam_search/scores:0", "beam_search/logprobs:0"],
+        feed_dict=feed_dict)
+    captions = []
+    for image in range(ids.shape[0]):
+      captions.append([
+          caption_generator.Caption(
+              sentence=ids[image, i, :lengths[image, i]].tolist(),
+              state=None,
+              logprob=float(logprobs[image, i]),
+              score=float(scores[image, i]))
+          for i in range(ids.shape[1]) if lengths[image, i] > 0])
+    return captions
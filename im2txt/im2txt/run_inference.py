@@ -28,6 +28,7 @@ import tensorflow as tf
 from im2txt import configuration
 from im2txt import inference_wrapper
 from im2txt.inference_utils import caption_generator
+from im2txt.inference_utils import feature_cache
 from im2txt.inference_utils import vocabulary
 
 FLAGS = tf.flags.FLAGS
@@ -88,20 +89,43 @@ def main(_):
       
       
 # inference on a specific checkpoint, return a JSON with captions
-# linked to image ids
-def inference_on_ckpt(ckpt_path, vocab_file, input_files):
+# linked to image ids; batch_size images are beam searched together,
+# with in_graph_beam_search in a single sess.run per batch
+def inference_on_ckpt(ckpt_path, vocab_file, input_files, batch_size=16,
+                      in_graph_beam_search=False, feature_cache_dir=None):
     
     #if not os.path.isfile(ckpt_path):
         #return None
     
     #tf.app.run()
 
-    # Build the inference graph.
+    # return all the predictions
+    return list(inference_on_ckpts([ckpt_path], vocab_file, input_files,
+                                   batch_size, in_graph_beam_search,
+                                   feature_cache_dir))[0][1]
+
+
+# inference on a sequence of checkpoints of the same model; yields
+# (ckpt_path, results) for each checkpoint in order, with results as
+# inference_on_ckpt returns them. The graph, session, vocabulary and
+# file list are built once and only the weights are restored per
+# checkpoint, so a sweep spends its time captioning.
+# with feature_cache_dir, the Inception features of the images are computed
+# once and cached there (see inference_utils/feature_cache.py), and every
+# checkpoint with the same Inception weights feeds them instead of the images;
+# checkpoints whose Inception weights differ (trained with train_inception)
+# bypass the cache
+def inference_on_ckpts(ckpt_paths, vocab_file, input_files, batch_size=16,
+                       in_graph_beam_search=False, feature_cache_dir=None):
+
+    # Build the inference graph, with a restore function per checkpoint
+    # (all sharing one saver).
     g = tf.Graph()
     with g.as_default():
-        model = inference_wrapper.InferenceWrapper()
-        restore_fn = model.build_graph_from_config(configuration.ModelConfig(),
-                                                   ckpt_path)
+        model = inference_wrapper.InferenceWrapper(
+            in_graph_beam_search=in_graph_beam_search)
+        restore_fns = model.build_graph_from_config_for_checkpoints(
+            configuration.ModelConfig(), ckpt_paths)
     g.finalize()
 
     # Create the vocabulary.
@@ -113,14 +137,21 @@ def inference_on_ckpt(ckpt_path, vocab_file, input_files):
     tf.logging.info("Running caption generation on %d files matching %s",
                                         len(filenames), input_files)
                                         
+    cache = None
+    if feature_cache_dir is not None:
+        cache = feature_cache.FeatureCache(feature_cache_dir)
+        image_ids = [image_id_of(filename) for filename in filenames]
+        filenames_by_id = dict(zip(image_ids, filenames))
+        # whether the first checkpoint of this sweep used or (re)built the
+        # cache; from then on the cache is kept, and checkpoints with other
+        # Inception weights only bypass it
+        cache_settled = False
     
     gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=0.1)
   
   
     # create a session that only uses a tenth of the available GPU memory
     with tf.Session(graph=g, config=tf.ConfigProto(gpu_options=gpu_options)) as sess:
-        # Load the model from checkpoint.
-        restore_fn(sess)
 
         # Prepare the caption generator. Here we are implicitly using the default
         # beam search parameters. See caption_generator.py for a description of the
@@ -131,48 +162,104 @@ def inference_on_ckpt(ckpt_path, vocab_file, input_files):
         BEAM_SIZE = 3
         
         generator = caption_generator.CaptionGenerator(model, vocab, beam_size=BEAM_SIZE)
-        ### altered code to make a results json file ###
-        results = []
-        for filename in filenames:
-            start = time.time()
-            
-            #i+=1
-            #print("\n#%d INFERENCING ON "%(i) + filename, end = " ")
+        
+        # the same search, from cached image features
+        feature_generator = caption_generator.CaptionGenerator(
+            feature_cache.CachedFeatureModel(model), vocab, beam_size=BEAM_SIZE)
+
+        for ckpt_path, restore_fn in zip(ckpt_paths, restore_fns):
+            # Swap in the weights of this checkpoint.
+            restore_fn(sess)
+
+            use_cache = False
+            if cache is not None:
+                digest = model.inception_digest(sess)
+                if not cache.matches(digest, image_ids) and not cache_settled:
+                    # no cache yet, or one of another model or image set
+                    def compute_fn(batch_ids):
+                        return model.compute_features(sess, read_images(
+                            [filenames_by_id[image_id] for image_id in batch_ids]))
+                    cache.build(digest, image_ids, compute_fn, batch_size)
+                cache_settled = True
+                use_cache = cache.matches(digest, image_ids)
+                if not use_cache:
+                    tf.logging.info("Inception weights of %s differ from the cached "
+                                    "features; not using the feature cache", ckpt_path)
+
+            results = caption_files(sess, model, generator, vocab, filenames,
+                                    batch_size, in_graph_beam_search, BEAM_SIZE,
+                                    cache if use_cache else None, feature_generator)
+            yield ckpt_path, results
+
+
+# image id of an image file, e.g. image_id_0001234.jpg -> 0001234
+def image_id_of(filename):
+    return filename[-11:-4]
+
+
+def read_images(filenames):
+    images = []
+    for filename in filenames:
+        with tf.gfile.GFile(filename, "rb") as f:
+            images.append(f.read())
+    return images
+
+
+# captions every file in filenames with the restored model in sess,
+# batch_size images at a time; returns the results json of inference_on_ckpt.
+# with a feature cache, the cached features of the images are fed (through
+# feature_generator) instead of the image files
+def caption_files(sess, model, generator, vocab, filenames, batch_size,
+                  in_graph_beam_search, beam_size, cache=None,
+                  feature_generator=None):
+    ### altered code to make a results json file ###
+    results = []
+    for b in range(0, len(filenames), batch_size):
+        start = time.time()
+        
+        batch_filenames = filenames[b:b + batch_size]
+        
+        if cache is not None:
+            features = cache.lookup([image_id_of(filename) for filename in batch_filenames])
+            if in_graph_beam_search:
+                batch_captions = model.beam_search_in_graph(sess, None, vocab, beam_size=beam_size,
+                                                            features=features)
+            else:
+                batch_captions = feature_generator.beam_search_batch(sess, features)
+        elif in_graph_beam_search:
+            images = read_images(batch_filenames)
+            # the whole search in one run
+            batch_captions = model.beam_search_in_graph(sess, images, vocab, beam_size=beam_size)
+        else:
+            images = read_images(batch_filenames)
+            # one inference step per word for the whole batch
+            batch_captions = generator.beam_search_batch(sess, images)
+        
+        for filename, captions in zip(batch_filenames, batch_captions):
             results_entry = {}
-            with tf.gfile.GFile(filename, "rb") as f:
-                
-                image = f.read()
-                start=time.time()
-                captions = generator.beam_search(sess, image)
-                #print(captions)
-                results_entry["image_id"] = filename[-11:-4]
-                # change caption index to see a different caption
-                # 0 = top result, 1 = 2nd best result, etc...
-                
-                # list of captions as strings (we call them sentences here)
-                sentences = []
-                
-                for i in range(BEAM_SIZE): # 0 to 2 inclusive
-                    
-                    # if i is in range of the generated captions
-                    if (i < len(captions)):
-                        sentence = [vocab.id_to_word(w) for w in captions[i].sentence[1:-1]]
-                        sentence = " ".join(sentence)
-                    
-                        sentences.append(sentence)
-                    else:
-                         sentences.append("") # append an empty string
-                         print("Could not fetch caption #%d"%i)
-                         
-                
+            results_entry["image_id"] = image_id_of(filename)
+            # change caption index to see a different caption
+            # 0 = top result, 1 = 2nd best result, etc...
+            
+            # list of captions as strings (we call them sentences here)
+            sentences = []
+            
+            for i in range(beam_size): # 0 to 2 inclusive
                 
+                # if i is in range of the generated captions
+                if (i < len(captions)):
+                    sentence = [vocab.id_to_word(w) for w in captions[i].sentence[1:-1]]
+                    sentence = " ".join(sentence)
                 
-                results_entry["captions"] = sentences
-                results.append(results_entry)
-                #print(str(time.time() - start) + " s")
-            print(filename + " in %s s"%str(time.time()-start))
-        
-    # return all the predictions
+                    sentences.append(sentence)
+                else:
+                     sentences.append("") # append an empty string
+                     print("Could not fetch caption #%d"%i)
+            
+            results_entry["captions"] = sentences
+            results.append(results_entry)
+        print("%d images (%s ...) in %s s"%(len(batch_filenames), batch_filenames[0], str(time.time()-start)))
+    
     return results
 
 
@@ -38,18 +38,25 @@ class ShowAndTellModel(object):
   Oriol Vinyals, Alexander Toshev, Samy Bengio, Dumitru Erhan
   """
 
-  def __init__(self, config, mode, train_inception=False):
+  def __init__(self, config, mode, train_inception=False,
+               in_graph_beam_search=False):
     """Basic setup.
 
     Args:
       config: Object containing configuration parameters.
       mode: "train", "eval" or "inference".
       train_inception: Whether the inception submodel variables are trainable.
+      in_graph_beam_search: Inference mode only. Whether to feed a batch of
+        images and also build a beam search decoder in the graph (see
+        build_beam_search()), so that captioning the batch is a single
+        Session.run() instead of one run per generated word.
     """
     assert mode in ["train", "eval", "inference"]
+    assert mode == "inference" or not in_graph_beam_search
     self.config = config
     self.mode = mode
     self.train_inception = train_inception
+    self.in_graph_beam_search = in_graph_beam_search
 
     # Reader for the input data.
     self.reader = tf.TFRecordReader()
@@ -96,6 +103,22 @@ class ShowAndTellModel(object):
     # Global step Tensor.
     self.global_step = None
 
+    # The LSTM cell, its variable scope and the word embedding map, which the
+    # in-graph beam search reuses.
+    self.lstm_cell = None
+    self.lstm_scope = None
+    self.embedding_map = None
+
+    # A float32 Tensor with shape [batch_size, 2 * num_lstm_units]; the LSTM
+    # state after feeding the images (inference only).
+    self.initial_state = None
+
+    # Outputs of the in-graph beam search (see build_beam_search()).
+    self.beam_search_ids = None
+    self.beam_search_lengths = None
+    self.beam_search_scores = None
+    self.beam_search_logprobs = None
+
   def is_training(self):
     """Returns true if the model is built for training mode."""
     return self.mode == "train"
@@ -129,13 +152,21 @@ class ShowAndTellModel(object):
     """
     if self.mode == "inference":
       # In inference mode, images and inputs are fed via placeholders.
-      image_feed = tf.placeholder(dtype=tf.string, shape=[], name="image_feed")
       input_feed = tf.placeholder(dtype=tf.int64,
                                   shape=[None],  # batch_size
                                   name="input_feed")
+      if self.in_graph_beam_search:
+        # A batch of images.
+        image_feed = tf.placeholder(dtype=tf.string, shape=[None],
+                                    name="image_feed")
+        images = tf.map_fn(self.process_image, image_feed, dtype=tf.float32,
+                           back_prop=False)
+      else:
+        image_feed = tf.placeholder(dtype=tf.string, shape=[],
+                                    name="image_feed")
 
-      # Process image and insert batch dimensions.
-      images = tf.expand_dims(self.process_image(image_feed), 0)
+        # Process image and insert batch dimensions.
+        images = tf.expand_dims(self.process_image(image_feed), 0)
       input_seqs = tf.expand_dims(input_feed, 1)
 
       # No target sequences or input mask in inference mode.
@@ -194,6 +225,11 @@ class ShowAndTellModel(object):
     self.inception_variables = tf.get_collection(
         tf.GraphKeys.GLOBAL_VARIABLES, scope="InceptionV3")
 
+    if self.mode == "inference":
+      # Name the image features so that they can be fetched, and fed instead
+      # of images (see inference_utils/feature_cache.py).
+      inception_output = tf.identity(inception_output, name="inception_output")
+
     # Map inception output into embedding space.
     with tf.variable_scope("image_embedding") as scope:
       image_embeddings = tf.contrib.layers.fully_connected(
@@ -225,6 +261,7 @@ class ShowAndTellModel(object):
           initializer=self.initializer)
       seq_embeddings = tf.nn.embedding_lookup(embedding_map, self.input_seqs)
 
+    self.embedding_map = embedding_map
     self.seq_embeddings = seq_embeddings
 
   def build_model(self):
@@ -254,8 +291,12 @@ class ShowAndTellModel(object):
 
     with tf.variable_scope("lstm", initializer=self.initializer) as lstm_scope:
       # Feed the image embeddings to set the initial LSTM state.
+      batch_size = self.image_embeddings.get_shape()[0]
+      if self.in_graph_beam_search:
+        # The number of images is only known when they are fed.
+        batch_size = tf.shape(self.image_embeddings)[0]
       zero_state = lstm_cell.zero_state(
-          batch_size=self.image_embeddings.get_shape()[0], dtype=tf.float32)
+          batch_size=batch_size, dtype=tf.float32)
       _, initial_state = lstm_cell(self.image_embeddings, zero_state)
 
       # Allow the LSTM variables to be reused.
@@ -264,7 +305,8 @@ class ShowAndTellModel(object):
       if self.mode == "inference":
         # In inference mode, use concatenated states for convenient feeding and
         # fetching.
-        tf.concat(axis=1, values=initial_state, name="initial_state")
+        self.initial_state = tf.concat(axis=1, values=initial_state,
+                                       name="initial_state")
 
         # Placeholder for feeding a batch of concatenated states.
         state_feed = tf.placeholder(dtype=tf.float32,
@@ -289,16 +331,13 @@ class ShowAndTellModel(object):
                                             dtype=tf.float32,
                                             scope=lstm_scope)
 
+    self.lstm_cell = lstm_cell
+    self.lstm_scope = lstm_scope
+
     # Stack batches vertically.
     lstm_outputs = tf.reshape(lstm_outputs, [-1, lstm_cell.output_size])
 
-    with tf.variable_scope("logits") as logits_scope:
-      logits = tf.contrib.layers.fully_connected(
-          inputs=lstm_outputs,
-          num_outputs=self.config.vocab_size,
-          activation_fn=None,
-          weights_initializer=self.initializer,
-          scope=logits_scope)
+    logits = self.build_logits(lstm_outputs)
 
     if self.mode == "inference":
       tf.nn.softmax(logits, name="softmax")
@@ -325,6 +364,203 @@ class ShowAndTellModel(object):
       self.target_cross_entropy_losses = losses  # Used in evaluation.
       self.target_cross_entropy_loss_weights = weights  # Used in evaluation.
 
+  def build_logits(self, lstm_outputs, reuse=None):
+    """Maps LSTM outputs to logits over the vocabulary.
+
+    Args:
+      lstm_outputs: A float32 Tensor with shape [batch_size, num_lstm_units].
+      reuse: Whether to reuse the variables created by a previous call.
+
+    Returns:
+      logits: A float32 Tensor with shape [batch_size, vocab_size].
+    """
+    with tf.variable_scope("logits", reuse=reuse) as logits_scope:
+      logits = tf.contrib.layers.fully_connected(
+          inputs=lstm_outputs,
+          num_outputs=self.config.vocab_size,
+          activation_fn=None,
+          weights_initializer=self.initializer,
+          scope=logits_scope)
+    return logits
+
+  def build_beam_search(self):
+    """Builds a beam search decoder over the LSTM in the graph.
+
+    It searches the captions of every image of the batch together, in a
+    tf.while_loop that runs one LSTM step per word, like
+    CaptionGenerator.beam_search() does from Python: every partial caption is
+    extended by its beam_size most probable next words (skipping words of
+    probability < 1e-12), the best beam_size extensions that do not end the
+    caption go on, and the best beam_size that do are kept as complete
+    captions, scored by logprob / length**length_normalization_factor. The
+    search stops after max_caption_length words or when no image has partial
+    captions left; images without complete captions return their partial
+    ones.
+
+    Inputs (placeholders):
+      image_feed: The batch of encoded images.
+      beam_search/start_id, beam_search/end_id: Word ids of the sentence start
+        and end (Vocabulary.start_id and Vocabulary.end_id).
+      beam_search/beam_size (default 3),
+      beam_search/max_caption_length (default 20),
+      beam_search/length_normalization_factor (default 0.0): See
+        CaptionGenerator.
+
+    Outputs:
+      self.beam_search_ids: int32 [batch_size, beam_size, max_caption_length]
+        word ids of the captions, best first, starting with start_id and
+        padded with 0.
+      self.beam_search_lengths: int32 [batch_size, beam_size] number of ids of
+        each caption; 0 where an image has fewer than beam_size captions.
+      self.beam_search_scores: float32 [batch_size, beam_size] scores.
+      self.beam_search_logprobs: float32 [batch_size, beam_size] log
+        probabilities.
+    """
+    with tf.name_scope("beam_search"):
+      start_id = tf.placeholder(dtype=tf.int32, shape=[], name="start_id")
+      end_id = tf.placeholder(dtype=tf.int32, shape=[], name="end_id")
+      beam_size = tf.placeholder_with_default(3, shape=[], name="beam_size")
+      max_caption_length = tf.placeholder_with_default(
+          20, shape=[], name="max_caption_length")
+      length_normalization_factor = tf.placeholder_with_default(
+          0.0, shape=[], name="length_normalization_factor")
+
+      batch_size = tf.shape(self.initial_state)[0]
+      state_size = sum(self.lstm_cell.state_size)
+      neg_inf = tf.constant(-float("inf"))
+      min_logprob = tf.log(1e-12)
+
+      def gather_beams(params, indices):
+        """params[b, indices[b, i]] for every image b and beam i."""
+        batch_index = tf.tile(tf.expand_dims(tf.range(batch_size), 1),
+                              [1, tf.shape(indices)[1]])
+        return tf.gather_nd(params, tf.stack([batch_index, indices], axis=2))
+
+      def append_words(seqs, words, t):
+        """Writes words at position t + 1 of seqs."""
+        position = tf.one_hot(t + 1, max_caption_length, dtype=tf.int32)
+        return seqs + tf.expand_dims(words, 2) * position
+
+      def beam_fill(value, dtype):
+        return tf.fill([batch_size, beam_size], tf.cast(value, dtype))
+
+      # Only the first beam of every image starts alive, with the start word.
+      alive_seqs = tf.tile(
+          tf.reshape(tf.one_hot(0, max_caption_length, on_value=start_id,
+                                off_value=0, dtype=tf.int32), [1, 1, -1]),
+          [batch_size, beam_size, 1])
+      alive_logprobs = tf.concat(
+          axis=1,
+          values=[tf.zeros([batch_size, 1]),
+                  tf.fill([batch_size, beam_size - 1], neg_inf)])
+      state = tf.reshape(
+          tf.tile(tf.expand_dims(self.initial_state, 1), [1, beam_size, 1]),
+          [-1, state_size])
+      finished_seqs = tf.zeros_like(alive_seqs)
+      finished_scores = beam_fill(neg_inf, tf.float32)
+      finished_logprobs = beam_fill(neg_inf, tf.float32)
+      finished_lengths = beam_fill(0, tf.int32)
+
+      def cond(t, alive_seqs, alive_logprobs, *_):
+        return tf.logical_and(
+            t < max_caption_length - 1,
+            tf.reduce_any(alive_logprobs > neg_inf))
+
+      def body(t, alive_seqs, alive_logprobs, state, finished_seqs,
+               finished_scores, finished_logprobs, finished_lengths):
+        # One LSTM step for the last word of every beam of every image.
+        with tf.device("/cpu:0"):
+          embeddings = tf.nn.embedding_lookup(
+              self.embedding_map, tf.reshape(alive_seqs[:, :, t], [-1]))
+        with tf.variable_scope(self.lstm_scope, reuse=True):
+          lstm_outputs, state_tuple = self.lstm_cell(
+              inputs=embeddings,
+              state=tf.split(value=state, num_or_size_splits=2, axis=1))
+        logprobs = tf.nn.log_softmax(self.build_logits(lstm_outputs,
+                                                       reuse=True))
+
+        # The beam_size most probable next words of every beam give
+        # beam_size * beam_size candidates per image.
+        word_logprobs, words = tf.nn.top_k(logprobs, k=beam_size)
+        word_logprobs = tf.where(word_logprobs < min_logprob,
+                                 tf.fill(tf.shape(word_logprobs), neg_inf),
+                                 word_logprobs)
+        candidate_logprobs = tf.reshape(
+            tf.reshape(alive_logprobs, [-1, 1]) + word_logprobs,
+            [batch_size, -1])
+        candidate_words = tf.reshape(words, [batch_size, -1])
+        candidate_beams = tf.tile(
+            tf.expand_dims(tf.range(beam_size * beam_size) // beam_size, 0),
+            [batch_size, 1])
+        candidate_seqs = append_words(
+            gather_beams(alive_seqs, candidate_beams), candidate_words, t)
+        ends = tf.equal(candidate_words, end_id)
+        no_candidates = tf.fill(tf.shape(candidate_logprobs), neg_inf)
+
+        # Candidates that go on.
+        alive_logprobs, top = tf.nn.top_k(
+            tf.where(ends, no_candidates, candidate_logprobs), k=beam_size)
+        parents = gather_beams(candidate_beams, top)
+        alive_seqs = gather_beams(candidate_seqs, top)
+        state = tf.reshape(
+            gather_beams(
+                tf.reshape(tf.concat(axis=1, values=state_tuple),
+                           [batch_size, beam_size, state_size]),
+                parents),
+            [-1, state_size])
+
+        # Candidates that end, merged with the complete captions so far.
+        length = t + 2
+        normalization = tf.where(
+            length_normalization_factor > 0,
+            tf.pow(tf.cast(length, tf.float32), length_normalization_factor),
+            1.0)
+        end_logprobs = tf.where(ends, candidate_logprobs, no_candidates)
+        finished_scores, top = tf.nn.top_k(
+            tf.concat(axis=1, values=[finished_scores,
+                                      end_logprobs / normalization]),
+            k=beam_size)
+        finished_seqs = gather_beams(
+            tf.concat(axis=1, values=[finished_seqs, candidate_seqs]), top)
+        finished_logprobs = gather_beams(
+            tf.concat(axis=1, values=[finished_logprobs, end_logprobs]), top)
+        finished_lengths = gather_beams(
+            tf.concat(axis=1, values=[
+                finished_lengths,
+                tf.fill(tf.shape(candidate_words), length)]),
+            top)
+        return (t + 1, alive_seqs, alive_logprobs, state, finished_seqs,
+                finished_scores, finished_logprobs, finished_lengths)
+
+      matrix = tf.TensorShape([None, None])
+      t, alive_seqs, alive_logprobs, _, finished_seqs, finished_scores, \
+          finished_logprobs, finished_lengths = tf.while_loop(
+              cond, body,
+              loop_vars=[tf.constant(0), alive_seqs, alive_logprobs, state,
+                         finished_seqs, finished_scores, finished_logprobs,
+                         finished_lengths],
+              shape_invariants=[tf.TensorShape([]),
+                                tf.TensorShape([None, None, None]), matrix,
+                                tf.TensorShape([None, state_size]),
+                                tf.TensorShape([None, None, None]), matrix,
+                                matrix, matrix],
+              back_prop=False)
+
+      # Never mix complete and partial captions; fall back to the partial
+      # ones only for images without any complete caption.
+      complete = tf.reduce_any(finished_scores > neg_inf, axis=1)
+      alive_lengths = tf.where(alive_logprobs > neg_inf,
+                               beam_fill(t + 1, tf.int32),
+                               beam_fill(0, tf.int32))
+      self.beam_search_ids = tf.where(complete, finished_seqs, alive_seqs,
+                                      name="ids")
+      self.beam_search_lengths = tf.where(complete, finished_lengths,
+                                          alive_lengths, name="lengths")
+      self.beam_search_scores = tf.where(complete, finished_scores,
+                                         alive_logprobs, name="scores")
+      self.beam_search_logprobs = tf.where(complete, finished_logprobs,
+                                           alive_logprobs, name="logprobs")
+
   def setup_inception_initializer(self):
     """Sets up the function to restore inception variables from checkpoint."""
     if self.mode != "inference":
@@ -363,5 +599,7 @@ class ShowAndTellModel(object):
     self.build_image_embeddings()
     self.build_seq_embeddings()
     self.build_model()
+    if self.in_graph_beam_search:
+      self.build_beam_search()
     self.setup_inception_initializer()
     self.setup_global_step()
@@ -195,6 +195,37 @@ class ShowAndTellModelTest(tf.test.TestCase):
     }
     self._checkOutputs(expected_shapes, feed_dict)
 
+  def testBuildForInGraphBeamSearch(self):
+    model = ShowAndTellModel(self._model_config, mode="inference",
+                             in_graph_beam_search=True)
+    model.build()
+
+    # The decoder reuses the variables of the model.
+    self._checkModelParameters()
+
+    # Test feeding a batch of images to get their captions.
+    images_feed = np.random.rand(2, 299, 299, 3)
+    feed_dict = {
+        model.images: images_feed,
+        "beam_search/start_id:0": 0,
+        "beam_search/end_id:0": 1,
+        "beam_search/beam_size:0": 3,
+        "beam_search/max_caption_length:0": 5,
+    }
+    expected_shapes = {
+        # [batch_size, 2 * num_lstm_units]
+        "lstm/initial_state:0": (2, 1024),
+        # [batch_size, beam_size, max_caption_length]
+        model.beam_search_ids: (2, 3, 5),
+        # [batch_size, beam_size]
+        model.beam_search_lengths: (2, 3),
+        # [batch_size, beam_size]
+        model.beam_search_scores: (2, 3),
+        # [batch_size, beam_size]
+        model.beam_search_logprobs: (2, 3),
+    }
+    self._checkOutputs(expected_shapes, feed_dict)
+
 
 if __name__ == "__main__":
   tf.test.main()
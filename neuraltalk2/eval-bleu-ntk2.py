@@ -16,7 +16,14 @@ sys.path.append('./coco_caption/pycocoevalcap/tokenizer')
 
 from pycocotools.coco import COCO
 from pycocoevalcap.eval import COCOEvalCap
+from pycocoevalcap.tokenizer.ptbtokenizer import PTBTokenizer, PTBTokenizerServer
+from pycocoevalcap.meteor.meteor import MeteorPool
+from pycocoevalcap.bleu.bleu import Bleu
+from pycocoevalcap.bleu.ref_index import get_ref_index
+from score_store import ScoreStore, STORE_NAME
 from multiprocessing.dummy import Pool as ThreadPool 
+from multiprocessing import Pool as ProcessPool
+from multiprocessing.util import Finalize
 #import matplotlib.pyplot as plt
 #import skimage.io as io
 #import pylab
@@ -175,6 +182,8 @@ def get_bleu_scores(caption, image_id, gts_by_id):
 
     # create cocoEval object by taking coco and cocoRes
     cocoEval = COCOEvalCap(coco, cocoRes)
+    # only BLEU is kept, so leave CIDEr out
+    cocoEval.params['metrics'] = ['Bleu']
 
     # evaluate on a subset of images by setting
     # cocoEval.params['image_id'] = cocoRes.getImgIds()
@@ -214,6 +223,64 @@ def get_bleu_scores(caption, image_id, gts_by_id):
     return bleu_1, bleu_2, bleu_3, bleu_4
     
 
+# batched counterpart of get_bleu_scores; scores every caption of a whole
+# prediction file with one tokenizer call and one BleuScorer against the
+# precooked references in ref_index (image id -> PrecookedRefs, see
+# bleu/ref_index.py) instead of a COCOEvalCap run per caption
+# all_preds is the loaded prediction json (screenshot -> caption1..caption3)
+# returns (scores, corpus_bleu) where scores[screenshot] is the list of
+# per-caption {"Bleu_1":..,"Bleu_4":..} dicts ({} for empty captions), or
+# None if the image has no ground truths, and corpus_bleu is the corpus-level
+# [bleu_1, bleu_2, bleu_3, bleu_4] over every scored caption
+def get_bleu_scores_batch(all_preds, ref_index):
+    
+    res = {}
+    
+    for key in all_preds:
+        
+        if screens_to_ids[key] not in ref_index:
+            continue
+        
+        # dont evaluate bleu scores on an empty string
+        non_empty = [{"caption": all_preds[key][c]} for c in ["caption1", "caption2", "caption3"] if all_preds[key][c] != ""]
+        
+        if len(non_empty) != 0:
+            res[key] = non_empty
+    
+    scores = {}
+    for key in all_preds:
+        scores[key] = None
+    
+    if len(res) == 0:
+        return scores, [0.0, 0.0, 0.0, 0.0]
+    
+    # a single tokenizer run for every caption in the file
+    tokenized_res = PTBTokenizer().tokenize(res)
+    
+    gts = {}
+    for key in tokenized_res:
+        gts[key] = ref_index[screens_to_ids[key]]
+    
+    corpus_bleu, caption_scores = Bleu(4).compute_caption_scores(gts, tokenized_res)
+    
+    for key in all_preds:
+        
+        if screens_to_ids[key] not in ref_index:
+            continue
+        
+        # walk the captions in order, handing out scores to the non-empty ones
+        image_scores = iter(caption_scores.get(key, []))
+        scores[key] = []
+        
+        for c in ["caption1", "caption2", "caption3"]:
+            if all_preds[key][c] != "":
+                bleu_1, bleu_2, bleu_3, bleu_4 = next(image_scores)
+                scores[key].append({"Bleu_1":bleu_1,"Bleu_2":bleu_2,"Bleu_3":bleu_3,"Bleu_4":bleu_4})
+            else:
+                scores[key].append({})
+    
+    return scores, corpus_bleu
+
 
 # common command
 
@@ -232,8 +299,12 @@ if len(sys.argv) < 4:
     print("\nNOTE: this must be run within an ntk2 directory with the coco_caption code on a machine")
     print("that can run coco_caption, otherwise bleu scores will not be possible")
     print("\nNOTE 2: The files in the input prediction directory must have the .json extension to be recognized.")
-    print("\nNOTE 3: This script outputs one json file for each prediction json it reads in. The output file is identical to the prediction file except it has a list of 3 sets of Bleu scores in the same JSON object as the list of 3 captions (per image)") 
+    print("\nNOTE 3: This script writes the score of every caption of every prediction json into one score store, %s in the scores directory (see coco_caption/score_store.py), plus a csv of the average scores of each prediction json"%STORE_NAME)
     print("\nusage: python2 " + __file__ + " <directory with ntk2 prediction jsons> <whether the predictions come from a model trained on high, low, or combined> <whether these jsons are predictions on the val or test set>")
+    print("\noptional flags (after the three arguments above):")
+    print("    --per-caption    score each caption with its own COCOEvalCap run (slow; the old behaviour) instead of batching a whole prediction file against precooked references")
+    print("    --json    also write one json per prediction json, identical to it except for a list of 3 sets of Bleu scores next to the list of 3 captions (per image) (the old output)")
+    print("    --processes N    evaluate the prediction files on N worker processes (each with its own tokenizer JVM) instead of 64 threads of this process")
     print("\nex: python2 " + __file__ + " ./predictions low test\n")
     exit()
 global PREDS_DIR
@@ -242,6 +313,30 @@ model_type = sys.argv[2]
 global data_split
 data_split = sys.argv[3].lower()
 
+# whether to fall back to one COCOEvalCap run per caption (see get_bleu_scores)
+global per_caption
+per_caption = False
+
+# number of worker processes; 0 evaluates on a pool of threads instead
+num_processes = 0
+
+# whether to write the old per prediction file score jsons next to the store
+global write_json
+write_json = False
+
+flags = sys.argv[4:]
+while len(flags) != 0:
+    flag = flags.pop(0)
+    if flag == "--per-caption":
+        per_caption = True
+    elif flag == "--processes" and len(flags) != 0 and flags[0].isdigit() and int(flags[0]) > 0:
+        num_processes = int(flags.pop(0))
+    elif flag == "--json":
+        write_json = True
+    else:
+        print("Error: unknown or incomplete flag '%s'"%flag)
+        exit()
+
 if not os.path.isdir(PREDS_DIR):
     print("Error: invalid predictions directory '" + PREDS_DIR + "'")
     exit()
@@ -440,6 +535,23 @@ for entry in all_gts:
 '''
 
 
+# the ground truths never change between prediction files, so in batched mode
+# they are tokenized and cooked into BLEU references once here; the cooked
+# references are pickled next to the ground truth file and reused by later
+# runs (e.g. over other checkpoints) as long as the references match
+global ref_index
+ref_index = {}
+ref_index_path = None
+
+if not per_caption:
+    print("Tokenizing ground truth captions...")
+    with PTBTokenizerServer():
+        tokenized_gts_by_id = PTBTokenizer().tokenize({image_id: [{"caption": c} for c in gts_by_id[image_id]] for image_id in gts_by_id})
+    ref_index_path = "%s-%s-bleu-refs-java.pkl"%(os.path.splitext(GROUND_TRUTH_PATH)[0],data_split)
+    ref_index = get_ref_index(ref_index_path, tokenized_gts_by_id)
+    print("Using BLEU reference index '%s'"%ref_index_path)
+
+
 # list holding all of the filenames of the prediction jsons in the given directory
 prediction_jsons = []
 
@@ -452,6 +564,12 @@ if len(prediction_jsons) == 0:
     print("Error: directory '%s' contains no json files."%PREDS_DIR)
     exit()
 
+# checked up front, since a worker process can not stop the whole run
+for pred_json_name in prediction_jsons:
+    if pred_json_name.find(data_split) == -1:
+        print("Error: json file '%s' is not of the user inputted data split '%s'"%(pred_json_name,data_split))
+        exit()
+
 
 # time that the WHOLE PROCESS starts
 start_time = time.time()
@@ -463,13 +581,11 @@ scores_csv_list = [("preds_file_name, avg_bleu1, avg_bleu2, avg_bleu3, avg_bleu4
 
 
 # function to replace the innards of the `prediction_jsons` for loop
-# such that the work can be multithreaded with ThreadPools
+# such that the work can be multithreaded with ThreadPools or run on worker
+# processes; returns the file's csv row (see scores_csv_list), its scored
+# entries and the seconds it took, and the caller collects them in order
 def main_work_function(pred_json_name):
 
-    if pred_json_name.find(data_split) == -1:
-        print("Error: json file '%s' is not of the user inputted data split '%s'"%(pred_json_name,data_split))
-        exit()
-        
     print("Evaluating '%s'..."%pred_json_name)
     
     b_time = time.time()
@@ -530,6 +646,10 @@ def main_work_function(pred_json_name):
     bleu_3_scores = []
     bleu_4_scores = []
     
+    # score the whole file at once unless the old per-caption path was requested
+    if not per_caption:
+        batch_scores, corpus_bleu = get_bleu_scores_batch(all_preds, ref_index)
+    
     for key in all_preds:
         # `key` is a screenshot like 'yuni.tvremote.controle.remote.control-screens/screenshot_1.jpg'
         
@@ -558,7 +678,19 @@ def main_work_function(pred_json_name):
         
         
         # if this image_id has associated ground truths in gts_by_id
-        if image_id in gts_by_id:
+        if image_id in gts_by_id and not per_caption:
+            
+            # batched scores are already in caption order, with {} for empty captions
+            append_entry["scores"] = batch_scores[key]
+            
+            for caption_scores in append_entry["scores"]:
+                if caption_scores != {}:
+                    bleu_1_scores.append(caption_scores["Bleu_1"])
+                    bleu_2_scores.append(caption_scores["Bleu_2"])
+                    bleu_3_scores.append(caption_scores["Bleu_3"])
+                    bleu_4_scores.append(caption_scores["Bleu_4"])
+        
+        elif image_id in gts_by_id:
 
             for cap in captions_triplet:
                 if cap != "": # dont evaluate bleu scores on an empty string
@@ -590,24 +722,50 @@ def main_work_function(pred_json_name):
     # tuple of string, int where int is the ckpt number
     csv_tuple = (("%s,%f,%f,%f,%f"%(pred_json_name,avg(bleu_1_scores),avg(bleu_2_scores),avg(bleu_3_scores),avg(bleu_4_scores))),int(pred_json_name.split("_")[-2]))
     
-    scores_csv_list.append(csv_tuple)
     print("Finished evaluating bleu scores for %s in %s s"%(pred_json_name,str(time.time()-b_time)))
     
-    scores_file = open(os.path.join(SCORES_DIR,pred_json_name.replace("preds","scores")), "w")
-    json.dump(scores_with_preds,scores_file)
+    if not per_caption:
+        print("Corpus BLEU for %s: %f, %f, %f, %f"%(pred_json_name,corpus_bleu[0],corpus_bleu[1],corpus_bleu[2],corpus_bleu[3]))
     
-    print("Wrote bleu scores to %s"%scores_file.name)
+    if write_json:
+        scores_file = open(os.path.join(SCORES_DIR,pred_json_name.replace("preds","scores")), "w")
+        json.dump(scores_with_preds,scores_file)
+        scores_file.close()
+        
+        print("Wrote bleu scores to %s"%scores_file.name)
     print("")
         
     pred_file.close()
+    
+    return csv_tuple, scores_with_preds, time.time()-b_time
+
 
+# METEOR JVMs (up to 2G of heap each) of the pool the threaded run shares, and
+# of the pool of each worker process with --processes
+METEOR_WORKERS = 4
+PROCESS_METEOR_WORKERS = 1
 
-# on 64 threads...
-pool = ThreadPool(64)
+# initializer of every worker process (--processes); the workers are forked,
+# so they already have the ground truths and the BLEU reference index (and the
+# n-gram vocabulary its keys refer to). Each worker gets its own tokenizer JVM
+# and METEOR pool for its whole lifetime, since those can not be shared across
+# processes, and closes them when it exits
+def init_worker():
+    global worker_servers
+    worker_servers = [PTBTokenizerServer(), MeteorPool(PROCESS_METEOR_WORKERS)]
+    for server in worker_servers:
+        server.__enter__()
+    # pool workers leave through os._exit, which skips atexit hooks but not
+    # multiprocessing's finalizers
+    Finalize(None, close_worker_servers, exitpriority=10)
+
+def close_worker_servers():
+    for server in reversed(worker_servers):
+        server.__exit__(None, None, None)
 
 
 # main loop; go through each prediction json and evaluate each of its captions
-# (multithreaded variant)
+# (multithreaded variant, or on worker processes with --processes)
 
 
 # fixes unicode error in python 2 with map
@@ -617,10 +775,42 @@ pool = ThreadPool(64)
 #print(prediction_jsons)
 #exit()
 
-pool.map(main_work_function, prediction_jsons)
+# (csv row, scored entries, seconds) of every prediction json, in the order of prediction_jsons
+results = []
+
+if num_processes > 0:
+    print("Evaluating %d prediction files on %d worker processes"%(len(prediction_jsons),num_processes))
+    pool = ProcessPool(num_processes, initializer=init_worker)
+    # imap hands results back in order as the workers finish them
+    for result in pool.imap(main_work_function, prediction_jsons):
+        results.append(result)
+    pool.close()
+    pool.join()
+else:
+    # on 64 threads...
+    pool = ThreadPool(64)
+    
+    # every COCOEvalCap tokenization in the workers goes to this one PTBTokenizer JVM
+    # instead of launching java once per caption, and METEOR (when enabled in
+    # COCOEvalCap) to one shared pool of METEOR JVMs, started on first use
+    with PTBTokenizerServer(), MeteorPool(METEOR_WORKERS):
+        results = pool.map(main_work_function, prediction_jsons)
 
 # now we wait for all the threads to return; should be ~ 40 min
 
+# per caption scores of every prediction file, by screenshot
+score_store = ScoreStore(id_key="screenshot")
+
+print("\nPer-file evaluation times:")
+for pred_json_name, (csv_tuple, scores_with_preds, seconds) in zip(prediction_jsons, results):
+    scores_csv_list.append(csv_tuple)
+    score_store.add_file(pred_json_name, csv_tuple[1], data_split, scores_with_preds)
+    print("%10.2f s  %s"%(seconds,pred_json_name))
+print("%10.2f s  total over %d files (%.2f s per file)"%(sum([r[2] for r in results]),len(results),avg([r[2] for r in results])))
+
+score_store.save(os.path.join(SCORES_DIR,STORE_NAME))
+print("\nWrote scores of %d captions to '%s'"%(len(score_store),os.path.join(SCORES_DIR,STORE_NAME)))
+
 # sort the elements in `scores_csv_list` by increasing checkpoint
 scores_csv_list.sort(key=sort_by_ckpt_num)
 
@@ -7,9 +7,11 @@
 import json
 import sys
 import os
-import hashlib # for hashing ckpts
 import time
 
+sys.path.append('./coco_caption')
+from ckpt_fingerprint import FingerprintIndex, FAST_ALGORITHM # for hashing ckpts
+
 # custom sort function to sort by checkpoint number
 def sort_by_ckpt_num(elem):
     return elem[1]
@@ -43,6 +45,7 @@ if len(sys.argv) < 2:
     print("outputting a json of 3 predictions per test image per checkpoint")
     print("NOTE: ALL checkpoints in the given directory are evaluated")
     print("\nusage: python3 " + __file__ + " <directory with ntk2 checkpoint files>")
+    print("optional flag (after the directory): --md5    name prediction files after the md5 of their checkpoint (like older sweeps) instead of the faster %s digest"%FAST_ALGORITHM)
     print("ex: python3 " + __file__ + " /home/scratch/ayachnes/NTK2-CKPTS/finetune/high/\n")
     exit()
 
@@ -51,12 +54,19 @@ if len(sys.argv) < 2:
 start_time = time.time()
 
 
-# size of chunks to use when hashing ntk2 ckpts
-BUFFER_SIZE = 1000000000 # 1000 MB chunks for hashing files
-        
-        
 CKPT_DIR = sys.argv[1]
 
+# digest that goes into the prediction file names; checkpoint digests are
+# cached next to the checkpoints (see coco_caption/ckpt_fingerprint.py)
+hash_algorithm = FAST_ALGORITHM
+
+for flag in sys.argv[2:]:
+    if flag == "--md5":
+        hash_algorithm = "md5"
+    else:
+        print("Error: unknown flag '%s'"%flag)
+        exit()
+
 # remove trailing / if it exists on CKPT_DIR
 if CKPT_DIR[-1] == "/":
     CKPT_DIR = CKPT_DIR[0:-1]
@@ -92,11 +102,11 @@ elif len(os.listdir(PREDICTIONS_DIR)) != 0:
     
 
 # path to a validation predictions file written by each checkpoint (validation set)
-# note: the first %s is the checkpoint's number, the second %s is the checkpoints md5
+# note: the first %s is the checkpoint's number, the second %s is the checkpoints digest
 PREDICTION_VAL_PATH = os.path.join(PREDICTIONS_DIR, "preds_" + training_ID.replace("-","_") + "_val_%s_%s.json")
 
 # path to a validation predictions file written by each checkpoint (test set)
-# note: the first %s is the checkpoint's number, the second %s is the checkpoints md5
+# note: the first %s is the checkpoint's number, the second %s is the checkpoints digest
 PREDICTION_TEST_PATH = os.path.join(PREDICTIONS_DIR, "preds_" + training_ID.replace("-","_") + "_test_%s_%s.json")
 
 
@@ -131,6 +141,16 @@ ALL_CKPT_FILES.sort(reverse=True, key=sort_by_ckpt_num)
 #print(len(ALL_CKPT_FILES))
 
 
+# hash every checkpoint up front (in parallel, and only the ones that are
+# new or changed since the last sweep over this directory)
+fingerprints = FingerprintIndex(CKPT_DIR, hash_algorithm)
+hash_time = time.time()
+ckpt_digests = fingerprints.digest_all([os.path.join(CKPT_DIR,elem[0]) for elem in ALL_CKPT_FILES])
+print("Fingerprinted %d checkpoints (%d hashed with %s) in %s seconds"%(len(ckpt_digests),fingerprints.computed,hash_algorithm,str(time.time()-hash_time)))
+
+if not fingerprints.save():
+    print("Note: could not write the checkpoint fingerprint index '%s'"%fingerprints.path)
+
 
 
 
@@ -144,17 +164,7 @@ for elem in ALL_CKPT_FILES:
     abs_path = os.path.abspath(os.path.join(CKPT_DIR,ckpt))
         # get the ckpt's hash
 
-    md5_hash = hashlib.md5()
-    with open(os.path.join(CKPT_DIR,ckpt), "rb") as to_hash:
-        while True:
-            data = to_hash.read(BUFFER_SIZE)
-                                    
-            if not data: # if we're at the end of the file
-                break
-                                    
-            md5_hash.update(data)
-        
-    md5_hex = md5_hash.hexdigest()
+    ckpt_hex = ckpt_digests[os.path.join(CKPT_DIR,ckpt)]
 
 
     print("Generating test predictions for %s ..." % (ckpt) )
@@ -172,8 +182,8 @@ for elem in ALL_CKPT_FILES:
     ]
     '''
     
-    # fill in the filename with (ckpt_number, md5_hex)
-    test_pred_file = PREDICTION_TEST_PATH%(str(elem[1]), md5_hex)
+    # fill in the filename with (ckpt_number, ckpt_hex)
+    test_pred_file = PREDICTION_TEST_PATH%(str(elem[1]), ckpt_hex)
     
     args = [("-model " + os.path.join(CKPT_DIR,ckpt)),
             ("-batch_size 1"),
@@ -13,6 +13,8 @@ class COCOEvalCap:
         self.imgToEval = {}
         self.coco = coco
         self.cocoRes = cocoRes
+        # set params['meteor_workers'] to score METEOR with that many JVMs in
+        # parallel (each takes up to 2G of heap); one by default
         self.params = {'image_id': coco.getImgIds()}
 
     def evaluate(self):
@@ -38,7 +40,7 @@ class COCOEvalCap:
         print('setting up scorers...')
         scorers = [
             (Bleu(4), ["Bleu_1", "Bleu_2", "Bleu_3", "Bleu_4"]),
-            (Meteor(),"METEOR"),
+            (Meteor(workers=self.params.get('meteor_workers', 1)),"METEOR"),
             (Rouge(), "ROUGE_L"),
             (Cider(), "CIDEr")
         ]
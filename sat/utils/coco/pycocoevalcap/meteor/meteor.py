@@ -12,73 +12,210 @@ import threading
 METEOR_JAR = 'meteor-1.5.jar'
 # print METEOR_JAR
 
-class Meteor:
+# the pool entered most recently with a `with` block; Meteor instances
+# created without an explicit pool use it instead of launching their own java
+_active_pool = None
+
+class MeteorWorker:
+    """One METEOR JVM in -stdio mode. A batch of SCORE (or EVAL) lines is
+    written in one go and the answers are read back in order."""
 
     def __init__(self):
         # self.meteor_cmd = ['java', '-jar', '-Xmx2G', METEOR_JAR, \
         #         '-', '-', '-stdio', '-l', 'en', '-norm']
         self.meteor_cmd = ['java', '-jar', '-Xmx2G', METEOR_JAR, \
                  '-', '-', '-stdio', '-l', 'en', '-norm', '-a', 'data/paraphrase-en.gz']
+        self.meteor_p = None
+        # Used to guarantee thread safety
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.meteor_p is not None and self.meteor_p.poll() is None:
+            return
         self.meteor_p = subprocess.Popen(self.meteor_cmd, \
                 cwd=os.path.dirname(os.path.abspath(__file__)), \
                 stdin=subprocess.PIPE, \
                 stdout=subprocess.PIPE, \
                 stderr=subprocess.PIPE)
-        # Used to guarantee thread safety
+
+    def close(self):
+        if self.meteor_p is None:
+            return
+        try:
+            self.meteor_p.stdin.close()
+        except IOError:
+            pass
+        self.meteor_p.kill()
+        self.meteor_p.wait()
+        self.meteor_p = None
+
+    def run(self, lines, num_results):
+        """Sends lines to the JVM and returns the next num_results lines it
+        answers with."""
+        self.lock.acquire()
+        try:
+            try:
+                return self._run_batch(lines, num_results)
+            except IOError:
+                # the JVM died or got out of sync; start a fresh one and retry once
+                self.close()
+                return self._run_batch(lines, num_results)
+        finally:
+            self.lock.release()
+
+    def _run_batch(self, lines, num_results):
+        self.start()
+        payload = ''.join([line + '\n' for line in lines]).encode()
+
+        # write from a second thread so a large batch cannot deadlock against
+        # the JVM blocking on a full stdout pipe
+        def write_payload():
+            try:
+                self.meteor_p.stdin.write(payload)
+                self.meteor_p.stdin.flush()
+            except IOError:
+                pass
+        writer = threading.Thread(target=write_payload)
+        writer.start()
+
+        try:
+            results = []
+            for i in range(num_results):
+                line = self.meteor_p.stdout.readline()
+                if not line:
+                    raise IOError('METEOR process exited')
+                results.append(line.decode().strip())
+        finally:
+            writer.join()
+        return results
+
+    def __del__(self):
+        self.close()
+
+class MeteorPool:
+    """A pool of METEOR JVMs shared by every Meteor scorer created inside
+    its `with` block:
+
+        with MeteorPool(4):
+            for ...:
+                cocoEval.evaluate()
+
+    The SCORE lines of a batch are split into one contiguous chunk per
+    worker and scored in parallel; the results are merged back in order.
+    The JVMs are only launched by the first batch that needs them, and every
+    one takes up to 2G of heap, so size the pool to the machine."""
+
+    def __init__(self, workers=1):
+        assert workers > 0, "a MeteorPool needs at least one worker"
+        self.workers = [MeteorWorker() for i in range(workers)]
+        self._previous_pool = None
+        # round robin start, so concurrent small batches land on different JVMs
+        self._next_worker = 0
         self.lock = threading.Lock()
 
+    def __enter__(self):
+        global _active_pool
+        self._previous_pool = _active_pool
+        _active_pool = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active_pool
+        _active_pool = self._previous_pool
+        self.close()
+        return False
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+    def _take_workers(self, count):
+        self.lock.acquire()
+        try:
+            start = self._next_worker
+            self._next_worker = (start + count) % len(self.workers)
+        finally:
+            self.lock.release()
+        return [self.workers[(start + i) % len(self.workers)] for i in range(count)]
+
+    def score(self, score_lines):
+        """Returns the METEOR statistics line of every SCORE line, in order."""
+        if len(score_lines) == 0:
+            return []
+        num_chunks = min(len(self.workers), len(score_lines))
+        workers = self._take_workers(num_chunks)
+        bounds = [len(score_lines) * i // num_chunks for i in range(num_chunks + 1)]
+        results = [None] * num_chunks
+        errors = []
+
+        def run_chunk(i):
+            try:
+                chunk = score_lines[bounds[i]:bounds[i+1]]
+                results[i] = workers[i].run(chunk, len(chunk))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run_chunk, args=(i,)) for i in range(1, num_chunks)]
+        for thread in threads:
+            thread.start()
+        # the first chunk runs on the calling thread
+        run_chunk(0)
+        for thread in threads:
+            thread.join()
+        if len(errors) > 0:
+            raise errors[0]
+        return [stat for chunk in results for stat in chunk]
+
+    def evaluate(self, stats):
+        """Turns statistics lines into (corpus score, [score of every line])."""
+        eval_line = 'EVAL' + ''.join([' ||| {}'.format(stat) for stat in stats])
+        # EVAL answers with one score per statistics line, then the corpus score
+        results = self._take_workers(1)[0].run([eval_line], len(stats) + 1)
+        return float(results[-1]), [float(result) for result in results[:-1]]
+
+class Meteor:
+
+    def __init__(self, pool=None, workers=1):
+        # MeteorPool to score with; when None, the active pool (if any) is
+        # used, otherwise this scorer starts its own pool of `workers` JVMs
+        if pool is None:
+            pool = _active_pool
+        self.own_pool = pool is None
+        if self.own_pool:
+            pool = MeteorPool(workers)
+        self.pool = pool
+
     def compute_score(self, gts, res):
         assert(gts.keys() == res.keys())
         imgIds = gts.keys()
-        scores = []
 
-        eval_line = 'EVAL'
-        self.lock.acquire()
+        score_lines = []
         for i in imgIds:
             assert(len(res[i]) == 1)
-            stat = self._stat(res[i][0], gts[i])
-            eval_line += ' ||| {}'.format(stat)
-
-        self.meteor_p.stdin.write('{}\n'.format(eval_line).encode())
-        self.meteor_p.stdin.flush()
-        for i in range(0,len(imgIds)):
-            scores.append(float(self.meteor_p.stdout.readline().strip()))
-        score = float(self.meteor_p.stdout.readline().strip())
-        self.lock.release()
+            score_lines.append(self._score_line(res[i][0], gts[i]))
 
+        score, scores = self.pool.evaluate(self.pool.score(score_lines))
         return score, scores
 
     def method(self):
         return "METEOR"
 
-    def _stat(self, hypothesis_str, reference_list):
+    def _score_line(self, hypothesis_str, reference_list):
         # SCORE ||| reference 1 words ||| reference n words ||| hypothesis words
         hypothesis_str = hypothesis_str.replace('|||','').replace('  ',' ')
-        score_line = ' ||| '.join(('SCORE', ' ||| '.join(reference_list), hypothesis_str))
-        self.meteor_p.stdin.write('{}\n'.format(score_line).encode())
-        self.meteor_p.stdin.flush()
-        return self.meteor_p.stdout.readline().decode().strip()
+        return ' ||| '.join(('SCORE', ' ||| '.join(reference_list), hypothesis_str))
+
+    def _stat(self, hypothesis_str, reference_list):
+        return self.pool.score([self._score_line(hypothesis_str, reference_list)])[0]
 
     def _score(self, hypothesis_str, reference_list):
-        self.lock.acquire()
-        # SCORE ||| reference 1 words ||| reference n words ||| hypothesis words
-        hypothesis_str = hypothesis_str.replace('|||','').replace('  ',' ')
-        score_line = ' ||| '.join(('SCORE', ' ||| '.join(reference_list), hypothesis_str))
-        self.meteor_p.stdin.write('{}\n'.format(score_line))
-        stats = self.meteor_p.stdout.readline().strip()
-        eval_line = 'EVAL ||| {}'.format(stats)
         # EVAL ||| stats
-        self.meteor_p.stdin.write('{}\n'.format(eval_line))
-        score = float(self.meteor_p.stdout.readline().strip())
-        # bug fix: there are two values returned by the jar file, one average, and one all, so do it twice
+        # bug fix: there are two values returned by the jar file, one average, and one all,
+        # evaluate() reads both and returns the average
         # thanks for Andrej for pointing this out
-        score = float(self.meteor_p.stdout.readline().strip())
-        self.lock.release()
+        score, scores = self.pool.evaluate([self._stat(hypothesis_str, reference_list)])
         return score
 
     def __del__(self):
-        self.lock.acquire()
-        self.meteor_p.stdin.close()
-        self.meteor_p.kill()
-        self.meteor_p.wait()
-        self.lock.release()
+        if self.own_pool:
+            self.pool.close()
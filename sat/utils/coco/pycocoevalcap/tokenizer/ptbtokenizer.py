@@ -13,6 +13,7 @@ import sys
 import subprocess
 import tempfile
 import itertools
+import threading
 
 # path to the stanford corenlp jar
 STANFORD_CORENLP_3_4_1_JAR = 'stanford-corenlp-3.4.1.jar'
@@ -22,22 +23,167 @@ STANFORD_CORENLP_3_4_1_JAR = 'stanford-corenlp-3.4.1.jar'
 PUNCTUATIONS = ["''", "'", "``", "`", "-LRB-", "-RRB-", "-LCB-", "-RCB-", \
         ".", "?", "!", ",", ":", "-", "--", "...", ";"]
 
-class PTBTokenizer:
-    """Python wrapper of Stanford PTBTokenizer"""
+# marker lines framing each batch sent to a PTBTokenizerServer; they survive
+# PTB tokenization and lowercasing unchanged
+BATCH_START = 'xxptbbatchstartxx'
+BATCH_END = 'xxptbbatchendxx'
 
-    def tokenize(self, captions_for_image):
-        cmd = ['java', '-cp', STANFORD_CORENLP_3_4_1_JAR, \
+# PTBTokenizer never flushes stdout on its own, so every batch is followed by
+# enough filler lines to push the end marker through the JVM's output buffers
+PAD_LINE = 'xxptbpadxx'
+PAD_LINES = 2048
+
+# the server entered most recently with a `with` block; PTBTokenizer instances
+# created without an explicit server use it instead of launching java
+_active_server = None
+
+class PTBTokenizerServer:
+    """One long-lived Stanford PTBTokenizer JVM that tokenizes batches of
+    lines over stdin/stdout, shared by every PTBTokenizer.tokenize() call
+    made inside its `with` block:
+
+        with PTBTokenizerServer():
+            for ...:
+                cocoEval.evaluate()
+
+    The JVM is restarted if it dies or returns a short batch."""
+
+    def __init__(self):
+        self.cmd = ['java', '-cp', STANFORD_CORENLP_3_4_1_JAR, \
                 'edu.stanford.nlp.process.PTBTokenizer', \
                 '-preserveLines', '-lowerCase']
+        self.p_tokenizer = None
+        self._previous_server = None
+        # Used to guarantee thread safety
+        self.lock = threading.Lock()
 
-        #cmd = ['java', '-mx4g', '-cp', '"*"', 'edu.stanford.nlp.pipeline.StanfordCoreNLPServer' -port 9000 -timeout 15000
+    def start(self):
+        if self.p_tokenizer is not None and self.p_tokenizer.poll() is None:
+            return
+        self.p_tokenizer = subprocess.Popen(self.cmd, \
+                cwd=os.path.dirname(os.path.abspath(__file__)), \
+                stdin=subprocess.PIPE, \
+                stdout=subprocess.PIPE)
+
+    def close(self):
+        if self.p_tokenizer is None:
+            return
+        try:
+            self.p_tokenizer.stdin.close()
+        except IOError:
+            pass
+        self.p_tokenizer.kill()
+        self.p_tokenizer.wait()
+        self.p_tokenizer = None
+
+    def __enter__(self):
+        # the JVM itself is only launched by the first batch
+        global _active_server
+        self._previous_server = _active_server
+        _active_server = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active_server
+        _active_server = self._previous_server
+        self.close()
+        return False
 
+    def tokenize_lines(self, lines):
+        """Tokenizes a list of single-line sentences, returning one
+        space separated, lowercased line of tokens per sentence."""
+        self.lock.acquire()
+        try:
+            try:
+                return self._run_batch(lines)
+            except IOError:
+                # the JVM died or got out of sync; start a fresh one and retry once
+                self.close()
+                return self._run_batch(lines)
+        finally:
+            self.lock.release()
+
+    def _run_batch(self, lines):
+        self.start()
+        payload = '\n'.join([BATCH_START] + lines + [BATCH_END] + [PAD_LINE] * PAD_LINES) + '\n'
+
+        # write from a second thread so a large batch cannot deadlock against
+        # the JVM blocking on a full stdout pipe
+        def write_payload():
+            try:
+                self.p_tokenizer.stdin.write(payload.encode())
+                self.p_tokenizer.stdin.flush()
+            except IOError:
+                pass
+        writer = threading.Thread(target=write_payload)
+        writer.start()
+
+        try:
+            # skip whatever padding is left over from the previous batch
+            line = self._readline()
+            while line != BATCH_START:
+                line = self._readline()
+
+            token_lines = []
+            line = self._readline()
+            while line != BATCH_END:
+                token_lines.append(line)
+                line = self._readline()
+        finally:
+            writer.join()
+
+        if len(token_lines) != len(lines):
+            raise IOError('PTBTokenizer returned %d lines for a batch of %d' % (len(token_lines), len(lines)))
+        return token_lines
+
+    def _readline(self):
+        line = self.p_tokenizer.stdout.readline()
+        if not line:
+            raise IOError('PTBTokenizer process exited')
+        return line.decode().rstrip('\n')
+
+    def __del__(self):
+        self.close()
+
+class PTBTokenizer:
+    """Python wrapper of Stanford PTBTokenizer"""
+
+    def __init__(self, server=None):
+        # PTBTokenizerServer to send sentences to; when None, the active
+        # server (if any) is used, otherwise java is launched for each call
+        self.server = server
+
+    def tokenize(self, captions_for_image):
         # ======================================================
         # prepare data for PTB Tokenizer
         # ======================================================
         final_tokenized_captions_for_image = {}
         image_id = [k for k, v in captions_for_image.items() for _ in range(len(v))]
-        sentences = '\n'.join([c['caption'].replace('\n', ' ') for k, v in captions_for_image.items() for c in v])
+        captions = [c['caption'].replace('\n', ' ') for k, v in captions_for_image.items() for c in v]
+
+        server = self.server if self.server is not None else _active_server
+        if server is not None:
+            lines = server.tokenize_lines(captions)
+        else:
+            lines = self._tokenize_subprocess('\n'.join(captions))
+
+        # ======================================================
+        # create dictionary for tokenized captions
+        # ======================================================
+        for k, line in zip(image_id, lines):
+            if not k in final_tokenized_captions_for_image:
+                final_tokenized_captions_for_image[k] = []
+            tokenized_caption = ' '.join([w for w in line.rstrip().split(' ') \
+                    if w not in PUNCTUATIONS])
+            final_tokenized_captions_for_image[k].append(tokenized_caption)
+
+        return final_tokenized_captions_for_image
+
+    def _tokenize_subprocess(self, sentences):
+        cmd = ['java', '-cp', STANFORD_CORENLP_3_4_1_JAR, \
+                'edu.stanford.nlp.process.PTBTokenizer', \
+                '-preserveLines', '-lowerCase']
+        #cmd = ['java', '-mx4g', '-cp', '"*"', 'edu.stanford.nlp.pipeline.StanfordCoreNLPServer' -port 9000 -timeout 15000
 
         # ======================================================
         # save sentences to temporary file
@@ -59,14 +205,4 @@ class PTBTokenizer:
         # remove temp file
         os.remove(tmp_file.name)
 
-        # ======================================================
-        # create dictionary for tokenized captions
-        # ======================================================
-        for k, line in zip(image_id, lines):
-            if not k in final_tokenized_captions_for_image:
-                final_tokenized_captions_for_image[k] = []
-            tokenized_caption = ' '.join([w for w in line.rstrip().split(' ') \
-                    if w not in PUNCTUATIONS])
-            final_tokenized_captions_for_image[k].append(tokenized_caption)
-
-        return final_tokenized_captions_for_image
+        return lines
@@ -0,0 +1,145 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks the batched, array based `seq2seq.metrics.rouge.rouge` against
+the per pair, dictionary based implementation it replaced, and checks that
+both give the same scores.
+
+Runs on summaries produced by bin/data/cnn_daily_mail_summarization (e.g.
+a model's decoded dev summaries against dev.summaries), or on random data of
+the same size: 1000 examples of about 56 words.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import io
+import time
+import numpy as np
+
+from seq2seq.metrics import rouge
+
+PARSER = argparse.ArgumentParser(description="Benchmarks ROUGE.")
+PARSER.add_argument(
+    "--hypotheses", type=str, default=None,
+    help="file with one hypothesis summary per line")
+PARSER.add_argument(
+    "--references", type=str, default=None,
+    help="file with one reference summary per line, e.g. dev.summaries")
+PARSER.add_argument(
+    "--num_examples", type=int, default=1000,
+    help="number of random examples when no files are given")
+PARSER.add_argument(
+    "--summary_len", type=int, default=56,
+    help="average summary length of the random examples")
+PARSER.add_argument(
+    "--vocab_size", type=int, default=5000,
+    help="vocabulary size of the random examples")
+PARSER.add_argument(
+    "--repeat", type=int, default=3, help="number of timed runs")
+ARGS = PARSER.parse_args()
+
+
+def read_lines(path):
+  """Reads the lines of a file, without line endings"""
+  with io.open(path, "r", encoding="utf-8") as file:
+    return [line.rstrip("\n") for line in file]
+
+
+def random_summaries(num_examples, summary_len, vocab_size):
+  """Random summaries with Zipf distributed words, so that hypotheses and
+  references share common words like real summaries do"""
+  summaries = []
+  for _ in range(num_examples):
+    length = max(1, np.random.poisson(summary_len))
+    words = np.minimum(np.random.zipf(1.2, length), vocab_size)
+    summaries.append(" ".join(["w{}".format(_) for _ in words]))
+  return summaries
+
+
+def dict_lcs_len(x, y):
+  """The LCS length as computed before: a dictionary DP table"""
+  n, m = len(x), len(y)
+  table = dict()
+  for i in range(n + 1):
+    for j in range(m + 1):
+      if i == 0 or j == 0:
+        table[i, j] = 0
+      elif x[i - 1] == y[j - 1]:
+        table[i, j] = table[i - 1, j - 1] + 1
+      else:
+        table[i, j] = max(table[i - 1, j], table[i, j - 1])
+  return table[n, m]
+
+
+def unbatched_rouge(hypotheses, references):
+  """Average ROUGE scores as computed before: every score of every pair on
+  its own"""
+  scores = {}
+  for name, score_fn in [
+      ("rouge_1", lambda hyp, ref: rouge.rouge_n([hyp], [ref], 1)),
+      ("rouge_2", lambda hyp, ref: rouge.rouge_n([hyp], [ref], 2)),
+      ("rouge_l", lambda hyp, ref: rouge._f_p_r_lcs( #pylint: disable=W0212
+          dict_lcs_len(hyp.split(" "), ref.split(" ")),
+          len(ref.split(" ")), len(hyp.split(" "))))]:
+    f_p_r = [score_fn(hyp, ref) for hyp, ref in zip(hypotheses, references)]
+    f_score, p_score, r_score = map(np.mean, zip(*f_p_r))
+    scores[name + "/f_score"] = f_score
+    scores[name + "/p_score"] = p_score
+    scores[name + "/r_score"] = r_score
+  return scores
+
+
+def run(name, rouge_fn, hypotheses, references, repeat):
+  """Times rouge_fn, returning its scores"""
+  best = None
+  for _ in range(repeat):
+    start = time.time()
+    scores = rouge_fn(hypotheses, references)
+    elapsed = time.time() - start
+    best = elapsed if best is None else min(best, elapsed)
+  print("{:<10} {:8.3f} s".format(name, best))
+  return scores
+
+
+def main():
+  """Program entry point"""
+  if ARGS.hypotheses and ARGS.references:
+    hypotheses = read_lines(ARGS.hypotheses)
+    references = read_lines(ARGS.references)
+  else:
+    np.random.seed(42)
+    hypotheses = random_summaries(
+        ARGS.num_examples, ARGS.summary_len, ARGS.vocab_size)
+    references = random_summaries(
+        ARGS.num_examples, ARGS.summary_len, ARGS.vocab_size)
+  print("ROUGE of {} summary pairs (best of {})".format(
+      len(hypotheses), ARGS.repeat))
+
+  expected = run("unbatched", unbatched_rouge, hypotheses, references,
+                 ARGS.repeat)
+  actual = run("batched", rouge.rouge, hypotheses, references, ARGS.repeat)
+  for name in sorted(expected):
+    print("{:<16} {:.6f} {:.6f}".format(name, expected[name], actual[name]))
+    np.testing.assert_almost_equal(actual[name], expected[name], decimal=12)
+
+if __name__ == "__main__":
+  main()
@@ -20,6 +20,8 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
+import math
 import os
 import re
 import subprocess
@@ -30,6 +32,133 @@ from six.moves import urllib
 import tensorflow as tf
 
 
+# Whitespace as multi-bleu.perl splits on it: Perl's \s on byte strings,
+# without the unicode separators that str.split() also breaks on
+_PERL_WHITESPACE = re.compile(r"[ \t\n\r\f\v]+")
+
+# Number of statistics returned by multi_bleu_stats
+MULTI_BLEU_NUM_STATS = 10
+
+# Perl's lc on byte strings only folds ASCII letters
+_ASCII_LOWERCASE = {ord(c): ord(c) + 32 for c in "ABCDEFGHIJKLMNOPQRSTUVWXYZ"}
+
+
+def _perl_lines(sentences):
+  """Splits sentences into the lines multi-bleu.perl reads from the file
+  they are written to, one per line (sentences may contain newlines)."""
+  return "\n".join(sentences).split("\n")
+
+
+def _split_words(line):
+  """Splits a line into words like Perl's split(' ', $line)."""
+  return [word for word in _PERL_WHITESPACE.split(line) if word]
+
+
+def _ngram_counts(words, n):
+  """Counts of every n-gram of a list of words."""
+  return collections.Counter(
+      tuple(words[start:start + n]) for start in range(len(words) - n + 1))
+
+
+def multi_bleu_stats(hypotheses, references, lowercase=False):
+  """Collects the sufficient statistics of multi-bleu.perl for hypotheses and
+  references. They add up over batches: the statistics of a corpus are the sum
+  of the statistics of its parts.
+
+  Args:
+    hypotheses: A numpy array of strings where each string is a single example.
+    references: A numpy array of strings where each string is a single example.
+    lowercase: If true, lowercase like the "-lc" flag of the multi-bleu script
+
+  Returns:
+    A float64 numpy array of length `MULTI_BLEU_NUM_STATS`: the clipped
+    n-gram matches for n = 1..4, the hypothesis n-gram counts for n = 1..4,
+    the hypothesis length and the reference length.
+  """
+  stats = np.zeros(MULTI_BLEU_NUM_STATS, dtype=np.float64)
+  if np.size(hypotheses) == 0:
+    return stats
+
+  reference_lines = _perl_lines(references)
+  for index, hypothesis in enumerate(_perl_lines(hypotheses)):
+    if lowercase:
+      hypothesis = hypothesis.translate(_ASCII_LOWERCASE)
+    words = _split_words(hypothesis)
+
+    # A line without a reference (more hypotheses than references) keeps the
+    # script's initial closest reference length of 9999
+    closest_length = 9999
+    max_ref_counts = collections.Counter()
+    if index < len(reference_lines):
+      reference = reference_lines[index]
+      if lowercase:
+        reference = reference.translate(_ASCII_LOWERCASE)
+      ref_words = _split_words(reference)
+      closest_length = len(ref_words)
+      for n in range(1, 5):
+        max_ref_counts |= _ngram_counts(ref_words, n)
+
+    stats[8] += len(words)
+    stats[9] += closest_length
+    for n in range(1, 5):
+      for ngram, count in _ngram_counts(words, n).items():
+        stats[n + 3] += count
+        stats[n - 1] += min(count, max_ref_counts[ngram])
+  return stats
+
+
+def multi_bleu_from_stats(stats):
+  """Calculates the BLEU score multi-bleu.perl reports for (summed up)
+  statistics from `multi_bleu_stats`.
+
+  Args:
+    stats: A numpy array of `MULTI_BLEU_NUM_STATS` statistics.
+
+  Returns:
+    The BLEU score as a float32 value.
+  """
+  correct, total = stats[0:4], stats[4:8]
+  length_translation, length_reference = stats[8], stats[9]
+
+  # The script exits with an error (read as a score of 0) without references
+  # and divides by zero without a translation
+  if length_reference == 0 or length_translation == 0:
+    return np.float32(0.0)
+
+  precisions = [float(correct[n]) / total[n] if total[n] else 0
+                for n in range(4)]
+  brevity_penalty = 1
+  if length_translation < length_reference:
+    brevity_penalty = math.exp(1 - float(length_reference) / length_translation)
+  log_precision_sum = 0
+  for precision in precisions:
+    log_precision_sum += math.log(precision) if precision else -9999999999
+  bleu_score = brevity_penalty * math.exp(log_precision_sum / 4)
+
+  return np.float32(float("%.2f" % (100 * bleu_score)))
+
+
+def multi_bleu(hypotheses, references, lowercase=False):
+  """Calculate the corpus bleu score for hypotheses and references in
+  process, reproducing the MOSES multi-bleu.perl script (including its
+  rounding to two decimals) without writing files or running Perl.
+
+  Args:
+    hypotheses: A numpy array of strings where each string is a single example.
+    references: A numpy array of strings where each string is a single example.
+    lowercase: If true, lowercase like the "-lc" flag of the multi-bleu script
+
+  Returns:
+    The BLEU score as a float32 value.
+  """
+
+  if np.size(hypotheses) == 0:
+    return np.float32(0.0)
+
+  return multi_bleu_from_stats(
+      multi_bleu_stats(hypotheses, references, lowercase=lowercase))
+
+
 def moses_multi_bleu(hypotheses, references, lowercase=False):
   """Calculate the bleu score for hypotheses and references
   using the MOSES ulti-bleu.perl script.
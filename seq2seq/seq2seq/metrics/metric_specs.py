@@ -59,10 +59,36 @@ def accumulate_strings(values, name="strings"):
   return value_tensor, update_op
 
 
+def accumulate_stats(values, num_stats, name="stats"):
+  """Accumulates a fixed number of statistics by summing them up.
+
+  Args:
+    values: A 1-d float64 tensor of `num_stats` values to add to the
+      accumulator.
+    num_stats: The number of statistics.
+
+  Returns:
+    A tuple (value_tensor, update_op).
+  """
+  tf.assert_type(values, tf.float64)
+  stats = tf.Variable(
+      name=name,
+      initial_value=tf.zeros([num_stats], dtype=tf.float64),
+      trainable=False,
+      collections=[tf.GraphKeys.LOCAL_VARIABLES])
+  value_tensor = tf.identity(stats)
+  update_op = tf.assign_add(ref=stats, value=values)
+  return value_tensor, update_op
+
+
 @six.add_metaclass(abc.ABCMeta)
 class TextMetricSpec(Configurable, MetricSpec):
   """Abstract class for text-based metrics calculated based on
-  hypotheses and references. Subclasses must implement `metric_fn`.
+  hypotheses and references. Subclasses should set `num_stats` and implement
+  `stats_fn` and `score_fn`: the metric ops then only keep the sum of the
+  statistics of every batch, so evaluation runs in constant memory.
+  Subclasses that leave `num_stats` unset implement `metric_fn` instead,
+  which is called on every hypothesis and reference seen so far.
 
   Args:
     name: A name for the metric
@@ -101,6 +127,10 @@ class TextMetricSpec(Configurable, MetricSpec):
         "postproc_fn": "",
     }
 
+  # Number of statistics returned by `stats_fn`; None if the subclass only
+  # implements `metric_fn`
+  num_stats = None
+
   def create_metric_ops(self, _inputs, labels, predictions):
     """Creates (value, update_op) tensors
     """
@@ -112,25 +142,64 @@ class TextMetricSpec(Configurable, MetricSpec):
       labels_flat = tf.reduce_join(
           labels["target_tokens"], 1, separator=self._separator)
 
-      sources_value, sources_update = accumulate_strings(
-          values=predictions_flat, name="sources")
-      targets_value, targets_update = accumulate_strings(
-          values=labels_flat, name="targets")
+      if self.num_stats is None:
+        return self._create_accumulating_ops(predictions_flat, labels_flat)
+
+      batch_stats = tf.py_func(
+          func=self._py_stats_func,
+          inp=[predictions_flat, labels_flat],
+          Tout=tf.float64,
+          name="batch_stats")
+      batch_stats.set_shape([self.num_stats])
+
+      stats_value, stats_update = accumulate_stats(
+          values=batch_stats, num_stats=self.num_stats)
 
       metric_value = tf.py_func(
-          func=self._py_func,
-          inp=[sources_value, targets_value],
+          func=self.score_fn, inp=[stats_value], Tout=tf.float32, name="value")
+      update_op = tf.py_func(
+          func=self.score_fn,
+          inp=[stats_update],
           Tout=tf.float32,
-          name="value")
+          name="update_op")
+
+    return metric_value, update_op
+
+  def _create_accumulating_ops(self, predictions_flat, labels_flat):
+    """Creates (value, update_op) tensors that keep every hypothesis and
+    reference and compute `metric_fn` over all of them.
+    """
+    sources_value, sources_update = accumulate_strings(
+        values=predictions_flat, name="sources")
+    targets_value, targets_update = accumulate_strings(
+        values=labels_flat, name="targets")
+
+    metric_value = tf.py_func(
+        func=self._py_func,
+        inp=[sources_value, targets_value],
+        Tout=tf.float32,
+        name="value")
 
     with tf.control_dependencies([sources_update, targets_update]):
       update_op = tf.identity(metric_value, name="update_op")
 
     return metric_value, update_op
 
+  def _py_stats_func(self, hypotheses, references):
+    """Wrapper function that computes the statistics of a batch."""
+    hypotheses, references = self._slice(hypotheses, references)
+    return np.asarray(
+        self.stats_fn(hypotheses, references), dtype=np.float64)
+
   def _py_func(self, hypotheses, references):
-    """Wrapper function that converts tensors to unicode and slices
-      them until the EOS token is found.
+    """Wrapper function that computes the metric of every hypothesis and
+    reference seen so far."""
+    hypotheses, references = self._slice(hypotheses, references)
+    return np.float32(self.metric_fn(hypotheses, references))
+
+  def _slice(self, hypotheses, references):
+    """Converts tensors to unicode and slices them until the EOS token is
+      found.
     """
     # Deal with byte chars
     if hypotheses.dtype.kind == np.dtype("U"):
@@ -153,7 +222,33 @@ class TextMetricSpec(Configurable, MetricSpec):
       sliced_hypotheses = [self._postproc_fn(_) for _ in sliced_hypotheses]
       sliced_references = [self._postproc_fn(_) for _ in sliced_references]
 
-    return self.metric_fn(sliced_hypotheses, sliced_references) #pylint: disable=E1102
+    return sliced_hypotheses, sliced_references
+
+  def stats_fn(self, hypotheses, references):
+    """Calculates the sufficient statistics of a batch. Statistics of
+    several batches are summed up.
+
+    Args:
+      hypotheses: A python list of strings, each corresponding to a
+        single hypothesis/example.
+      references: A python list of strings, each corresponds to a single
+        reference. Must have the same number of elements of `hypotheses`.
+
+    Returns:
+      A sequence of `num_stats` float values.
+    """
+    raise NotImplementedError()
+
+  def score_fn(self, stats):
+    """Calculates the value of the metric from summed up statistics.
+
+    Args:
+      stats: A numpy array of `num_stats` float64 values.
+
+    Returns:
+      A float32 value.
+    """
+    raise NotImplementedError()
 
   def metric_fn(self, hypotheses, references):
     """Calculates the value of the metric.
@@ -167,24 +262,32 @@ class TextMetricSpec(Configurable, MetricSpec):
     Returns:
       A float value.
     """
-    raise NotImplementedError()
+    return self.score_fn(
+        np.asarray(self.stats_fn(hypotheses, references), dtype=np.float64))
 
 
 class BleuMetricSpec(TextMetricSpec):
-  """Calculates BLEU score using the Moses multi-bleu.perl script.
+  """Calculates BLEU score like the Moses multi-bleu.perl script, in process.
   """
 
+  num_stats = bleu.MULTI_BLEU_NUM_STATS
+
   def __init__(self, params):
     super(BleuMetricSpec, self).__init__(params, "bleu")
 
-  def metric_fn(self, hypotheses, references):
-    return bleu.moses_multi_bleu(hypotheses, references, lowercase=False)
+  def stats_fn(self, hypotheses, references):
+    return bleu.multi_bleu_stats(hypotheses, references, lowercase=False)
+
+  def score_fn(self, stats):
+    return bleu.multi_bleu_from_stats(stats)
 
 
 class RougeMetricSpec(TextMetricSpec):
-  """Calculates BLEU score using the Moses multi-bleu.perl script.
+  """Calculates the average ROUGE score of all examples.
   """
 
+  num_stats = 2
+
   def __init__(self, params, **kwargs):
     if not params["rouge_type"]:
       raise ValueError("You must provide a rouge_type for ROUGE")
@@ -200,10 +303,17 @@ class RougeMetricSpec(TextMetricSpec):
     })
     return params
 
-  def metric_fn(self, hypotheses, references):
+  def stats_fn(self, hypotheses, references):
+    # The sum of the scores of all examples and their number
     if not hypotheses or not references:
+      return [0.0, 0.0]
+    scores = rouge.rouge_scores(hypotheses, references)[self._rouge_type]
+    return [np.sum(scores), len(scores)]
+
+  def score_fn(self, stats):
+    if stats[1] == 0:
       return np.float32(0.0)
-    return np.float32(rouge.rouge(hypotheses, references)[self._rouge_type])
+    return np.float32(stats[0] / stats[1])
 
 
 class LogPerplexityMetricSpec(MetricSpec, Configurable):
@@ -65,7 +65,7 @@ def _get_word_ngrams(n, sentences):
 def _len_lcs(x, y):
   """
   Returns the length of the Longest Common Subsequence between sequences x
-  and y.
+  and y. Only keeps one row of the table of `_lcs` at a time.
   Source: http://www.algorithmist.com/index.php/Longest_Common_Subsequence
 
   Args:
@@ -75,16 +75,51 @@ def _len_lcs(x, y):
   Returns
     integer: Length of LCS between x and y
   """
-  table = _lcs(x, y)
-  n, m = len(x), len(y)
-  return table[n, m]
+  row = np.zeros(len(y) + 1, dtype=np.int32)
+  for matches in _match_rows(x, y):
+    row = _next_lcs_row(row, matches)
+  return int(row[-1])
+
+
+def _match_rows(x, y):
+  """Yields, for every word of x, a boolean array of the positions of y that
+  hold the same word."""
+  ids = {}
+  y_ids = np.array([ids.setdefault(word, len(ids)) for word in y],
+                   dtype=np.int64)
+  for word in x:
+    if word in ids:
+      yield y_ids == ids[word]
+    else:
+      yield np.zeros(len(y), dtype=bool)
+
+
+def _next_lcs_row(row, matches):
+  """
+  Computes row i of the LCS table from row i - 1. Entry j is
+  max(row[j], new_row[j - 1], row[j - 1] + 1 if x[i - 1] == y[j - 1]),
+  which is a running maximum over the row, so the whole row is computed with
+  array operations.
+
+  Args:
+    row: Row i - 1 of the table, an integer array of length len(y) + 1
+    matches: Boolean array, whether x[i - 1] == y[j - 1] for every j
+
+  Returns:
+    Row i of the table
+  """
+  new_row = np.empty_like(row)
+  new_row[0] = 0
+  new_row[1:] = np.maximum.accumulate(
+      np.maximum(row[1:], row[:-1] + matches))
+  return new_row
 
 
 def _lcs(x, y):
   """
   Computes the length of the longest common subsequence (lcs) between two
   strings. The implementation below uses a DP programming algorithm and runs
-  in O(nm) time where n = len(x) and m = len(y).
+  in O(nm) time where n = len(x) and m = len(y), one row at a time.
   Source: http://www.algorithmist.com/index.php/Longest_Common_Subsequence
 
   Args:
@@ -92,18 +127,15 @@ def _lcs(x, y):
     y: collection of words
 
   Returns:
-    Table of dictionary of coord and len lcs
+    Table of LCS lengths as an (n + 1) x (m + 1) integer array; entry
+    [i, j] is the LCS length of x[:i] and y[:j]
   """
   n, m = len(x), len(y)
-  table = dict()
-  for i in range(n + 1):
-    for j in range(m + 1):
-      if i == 0 or j == 0:
-        table[i, j] = 0
-      elif x[i - 1] == y[j - 1]:
-        table[i, j] = table[i - 1, j - 1] + 1
-      else:
-        table[i, j] = max(table[i - 1, j], table[i, j - 1])
+  # LCS lengths are at most min(n, m), so int32 entries are plenty and halve
+  # the memory of the table
+  table = np.zeros((n + 1, m + 1), dtype=np.int32)
+  for i, matches in enumerate(_match_rows(x, y), 1):
+    table[i] = _next_lcs_row(table[i - 1], matches)
   return table
 
 
@@ -122,18 +154,19 @@ def _recon_lcs(x, y):
   i, j = len(x), len(y)
   table = _lcs(x, y)
 
-  def _recon(i, j):
-    """private recon calculation"""
-    if i == 0 or j == 0:
-      return []
-    elif x[i - 1] == y[j - 1]:
-      return _recon(i - 1, j - 1) + [(x[i - 1], i)]
+  # Walk back from the end of the table (iteratively, so long sequences
+  # cannot hit the recursion limit)
+  recon = []
+  while i > 0 and j > 0:
+    if x[i - 1] == y[j - 1]:
+      recon.append(x[i - 1])
+      i, j = i - 1, j - 1
     elif table[i - 1, j] > table[i, j - 1]:
-      return _recon(i - 1, j)
+      i -= 1
     else:
-      return _recon(i, j - 1)
+      j -= 1
 
-  recon_tuple = tuple(map(lambda x: x[0], _recon(i, j)))
+  recon_tuple = tuple(reversed(recon))
   return recon_tuple
 
 
@@ -159,6 +192,20 @@ def rouge_n(evaluated_sentences, reference_sentences, n=2):
 
   evaluated_ngrams = _get_word_ngrams(n, evaluated_sentences)
   reference_ngrams = _get_word_ngrams(n, reference_sentences)
+  return _f_p_r_ngrams(evaluated_ngrams, reference_ngrams)
+
+
+def _f_p_r_ngrams(evaluated_ngrams, reference_ngrams):
+  """
+  Computes the ROUGE-N F-measure, precision and recall of two n-gram sets.
+
+  Args:
+    evaluated_ngrams: The set of n-grams of the evaluated sentences
+    reference_ngrams: The set of n-grams of the reference sentences
+
+  Returns:
+    A tuple (f1, precision, recall)
+  """
   reference_count = len(reference_ngrams)
   evaluated_count = len(evaluated_ngrams)
 
@@ -324,42 +371,43 @@ def rouge_l_summary_level(evaluated_sentences, reference_sentences):
   return _f_p_r_lcs(union_lcs_sum_across_all_references, m, n)
 
 
+def rouge_scores(hypotheses, references):
+  """Calculates rouge scores of every hypothesis/reference pair. Each pair is
+  split into words once and its n-gram sets are built once for all scores.
+
+  Returns:
+    A dictionary from score name (e.g. "rouge_l/f_score") to a numpy array
+    with the score of every pair.
+  """
+  f_p_r = {"rouge_1": [], "rouge_2": [], "rouge_l": []}
+  for hyp, ref in zip(hypotheses, references):
+    hyp_words = _split_into_words([hyp])
+    ref_words = _split_into_words([ref])
+    for n in [1, 2]:
+      f_p_r["rouge_%d" % n].append(
+          _f_p_r_ngrams(_get_ngrams(n, hyp_words), _get_ngrams(n, ref_words)))
+    f_p_r["rouge_l"].append(
+        _f_p_r_lcs(_len_lcs(hyp_words, ref_words), len(ref_words),
+                   len(hyp_words)))
+
+  scores = {}
+  for name, values in f_p_r.items():
+    values = np.array(values, dtype=np.float64).reshape([-1, 3])
+    scores[name + "/f_score"] = values[:, 0]
+    scores[name + "/p_score"] = values[:, 1]
+    scores[name + "/r_score"] = values[:, 2]
+  return scores
+
+
 def rouge(hypotheses, references):
   """Calculates average rouge scores for a list of hypotheses and
-  references"""
+  references, all pairs in one batch (see `rouge_scores`)"""
 
   # Filter out hyps that are of 0 length
   # hyps_and_refs = zip(hypotheses, references)
   # hyps_and_refs = [_ for _ in hyps_and_refs if len(_[0]) > 0]
   # hypotheses, references = zip(*hyps_and_refs)
 
-  # Calculate ROUGE-1 F1, precision, recall scores
-  rouge_1 = [
-      rouge_n([hyp], [ref], 1) for hyp, ref in zip(hypotheses, references)
-  ]
-  rouge_1_f, rouge_1_p, rouge_1_r = map(np.mean, zip(*rouge_1))
-
-  # Calculate ROUGE-2 F1, precision, recall scores
-  rouge_2 = [
-      rouge_n([hyp], [ref], 2) for hyp, ref in zip(hypotheses, references)
-  ]
-  rouge_2_f, rouge_2_p, rouge_2_r = map(np.mean, zip(*rouge_2))
-
-  # Calculate ROUGE-L F1, precision, recall scores
-  rouge_l = [
-      rouge_l_sentence_level([hyp], [ref])
-      for hyp, ref in zip(hypotheses, references)
-  ]
-  rouge_l_f, rouge_l_p, rouge_l_r = map(np.mean, zip(*rouge_l))
-
-  return {
-      "rouge_1/f_score": rouge_1_f,
-      "rouge_1/r_score": rouge_1_r,
-      "rouge_1/p_score": rouge_1_p,
-      "rouge_2/f_score": rouge_2_f,
-      "rouge_2/r_score": rouge_2_r,
-      "rouge_2/p_score": rouge_2_p,
-      "rouge_l/f_score": rouge_l_f,
-      "rouge_l/r_score": rouge_l_r,
-      "rouge_l/p_score": rouge_l_p,
-  }
+  # Calculate ROUGE-1, ROUGE-2 and ROUGE-L F1, precision, recall scores
+  scores = rouge_scores(hypotheses, references)
+  return {name: np.mean(values) for name, values in scores.items()}
@@ -28,16 +28,20 @@ from seq2seq.metrics import bleu
 from seq2seq.metrics import rouge
 from seq2seq.metrics.metric_specs import BleuMetricSpec
 from seq2seq.metrics.metric_specs import RougeMetricSpec
+from seq2seq.metrics.metric_specs import TextMetricSpec
 
 
-class TestMosesBleu(tf.test.TestCase):
-  """Tests using the Moses multi-bleu script to calcualte BLEU score
+class MultiBleuCases(object):
+  """Multi-bleu test cases shared by the Moses script and the in-process
+  BLEU; subclasses set `bleu_fn`
   """
 
+  bleu_fn = None
+
   def _test_multi_bleu(self, hypotheses, references, lowercase, expected_bleu):
     #pylint: disable=R0201
     """Runs a multi-bleu test."""
-    result = bleu.moses_multi_bleu(
+    result = self.bleu_fn(
         hypotheses=hypotheses, references=references, lowercase=lowercase)
     np.testing.assert_almost_equal(result, expected_bleu, decimal=2)
 
@@ -75,6 +79,71 @@ class TestMosesBleu(tf.test.TestCase):
         expected_bleu=46.51)
 
 
+class TestMosesBleu(MultiBleuCases, tf.test.TestCase):
+  """Tests using the Moses multi-bleu script to calcualte BLEU score
+  """
+
+  bleu_fn = staticmethod(bleu.moses_multi_bleu)
+
+  def _test_matches_in_process(self, hypotheses, references, lowercase):
+    expected = bleu.moses_multi_bleu(
+        hypotheses=hypotheses, references=references, lowercase=lowercase)
+    result = bleu.multi_bleu(
+        hypotheses=hypotheses, references=references, lowercase=lowercase)
+    self.assertEqual(result, expected)
+
+  def test_matches_in_process(self):
+    """The in-process BLEU agrees with the script exactly"""
+    self._test_matches_in_process(
+        hypotheses=np.array(["The brown fox", "jumps over\tthe  dog 笑", ""]),
+        references=np.array(["The quick brown fox", "jumps over the dog", "a"]),
+        lowercase=False)
+    self._test_matches_in_process(
+        hypotheses=np.array(["THE Brown FOX jumps over the dog", "É b c d e"]),
+        references=np.array(
+            ["the brown fox jumps over the lazy dog", "é b c d"]),
+        lowercase=True)
+
+
+class TestMultiBleu(MultiBleuCases, tf.test.TestCase):
+  """Runs the multi-bleu tests against the in-process BLEU, without the
+  script
+  """
+
+  bleu_fn = staticmethod(bleu.multi_bleu)
+
+  def test_tokenization(self):
+    self._test_multi_bleu(
+        hypotheses=np.array(["The brown fox", "jumps over\tthe  dog 笑", ""]),
+        references=np.array(["The quick brown fox", "jumps over the dog", "a"]),
+        lowercase=False,
+        expected_bleu=54.54)
+    self._test_multi_bleu(
+        hypotheses=np.array(["THE Brown FOX jumps over the dog", "É b c d e"]),
+        references=np.array(
+            ["the brown fox jumps over the lazy dog", "é b c d"]),
+        lowercase=True,
+        expected_bleu=65.34)
+
+  def test_stats_add_up(self):
+    hypotheses = np.array(["The brown fox", "jumps over the dog 笑", "A B"])
+    references = np.array(["The quick brown fox", "jumps over the dog", "A"])
+    stats = bleu.multi_bleu_stats(hypotheses[:2], references[:2]) + \
+            bleu.multi_bleu_stats(hypotheses[2:], references[2:])
+    np.testing.assert_array_equal(
+        stats, bleu.multi_bleu_stats(hypotheses, references))
+    self.assertEqual(
+        bleu.multi_bleu_from_stats(stats),
+        bleu.multi_bleu(hypotheses, references))
+
+  def test_no_references(self):
+    self._test_multi_bleu(
+        hypotheses=np.array(["The brown fox"]),
+        references=np.array([""]),
+        lowercase=False,
+        expected_bleu=0.00)
+
+
 class TestTextMetricSpec(tf.test.TestCase):
   """Abstract class for testing TextMetricSpecs
   based on hypotheses and references"""
@@ -183,6 +252,29 @@ class TestRougeMetricSpec(TestTextMetricSpec):
         expected_scores=[0.0])
 
 
+class ExactMatchMetricSpec(TextMetricSpec):
+  """Fraction of hypotheses equal to their reference; only implements
+  `metric_fn`."""
+
+  def __init__(self, params):
+    super(ExactMatchMetricSpec, self).__init__(params, "exact_match")
+
+  def metric_fn(self, hypotheses, references):
+    return np.mean([h == r for h, r in zip(hypotheses, references)])
+
+
+class TestMetricFnOnlySpec(TestTextMetricSpec):
+  """Tests a `TextMetricSpec` without sufficient statistics"""
+
+  def test_exact_match(self):
+    metric_spec = ExactMatchMetricSpec({})
+    return self._test_metric_spec(
+        metric_spec=metric_spec,
+        hyps=["A B C", "A B C", "A B C", "D E"],
+        refs=["A B C", "A B D", "A B C", "D E"],
+        expected_scores=[1.0, 0.5, 0.6667, 0.75])
+
+
 class TestRougeMetric(tf.test.TestCase):
   """Tests the RougeMetric"""
 
@@ -204,6 +296,25 @@ class TestRougeMetric(tf.test.TestCase):
     # pyrouge result 0.84926
     np.testing.assert_almost_equal(output["rouge_l/f_score"], 0.852, decimal=2)
 
+  def test_rouge_scores(self):
+    scores = rouge.rouge_scores(
+        ["A B C D E F", "A B C D E F"], ["A B C D E F", "A B A D E F"])
+    np.testing.assert_almost_equal(
+        scores["rouge_1/f_score"], [1.0, 0.909], decimal=3)
+    np.testing.assert_almost_equal(
+        scores["rouge_2/f_score"], [1.0, 0.6], decimal=3)
+    np.testing.assert_almost_equal(
+        scores["rouge_l/f_score"], [1.0, 0.833], decimal=3)
+
+  def test_recon_lcs(self):
+    #pylint: disable=W0212
+    self.assertEqual(
+        rouge._recon_lcs("A B C B D A B".split(), "B D C A B A".split()),
+        ("B", "D", "A", "B"))
+    # Sequences longer than the default recursion limit (1000) must work
+    words = ["A"] * 1200
+    self.assertEqual(len(rouge._recon_lcs(words, words)), 1200)
+
 
 if __name__ == "__main__":
   tf.test.main()